@@ -0,0 +1,26 @@
+#!/bin/sh
+# Stand-in for the create_tfstack.sh of a terraform config, for benchmarking.
+# Emits FAKE_TF_OUTPUT_LINES lines of terraform like output over FAKE_TF_DELAY seconds.
+
+LINES=${FAKE_TF_OUTPUT_LINES:-500}
+DELAY=${FAKE_TF_DELAY:-1}
+RESOURCE_ID=$(head -c 16 /dev/urandom | od -An -tx1 | tr -d ' \n' | head -c 6)
+
+# a warm working directory is initialized already
+if [ "$TF_WORKDIR_INITIALIZED" != "1" ]; then
+  echo "Initializing the backend..."
+  echo "Initializing provider plugins..."
+  sleep $(awk "BEGIN {print $DELAY / 4}")
+fi
+echo "Terraform will perform the following actions:"
+i=0
+while [ $i -lt $LINES ]; do
+  echo "  + attribute_$i = \"value of attribute $i of resource $RESOURCE_ID\""
+  i=$((i + 1))
+done
+sleep $(awk "BEGIN {print $DELAY / 4}")
+echo "aws_instance.this: Creating..."
+sleep $(awk "BEGIN {print $DELAY / 2}")
+echo "Apply complete! Resources: 1 added, 0 changed, 0 destroyed."
+echo "Outputs:"
+echo "resource_id = \"$RESOURCE_ID\""
@@ -0,0 +1,22 @@
+#!/bin/sh
+# Stand-in for the delete_tfstack.sh of a terraform config, for benchmarking.
+# Emits FAKE_TF_OUTPUT_LINES lines of terraform like output over FAKE_TF_DELAY seconds.
+
+if [ -z "$1" ]; then
+  echo "error:IdNotSpecified"
+  exit 1
+fi
+
+LINES=${FAKE_TF_OUTPUT_LINES:-500}
+DELAY=${FAKE_TF_DELAY:-1}
+
+echo "Initializing the backend..."
+sleep $(awk "BEGIN {print $DELAY / 2}")
+i=0
+while [ $i -lt $LINES ]; do
+  echo "  - attribute_$i = \"value of attribute $i of resource $1\""
+  i=$((i + 1))
+done
+echo "aws_instance.this: Destroying..."
+sleep $(awk "BEGIN {print $DELAY / 2}")
+echo "Destroy complete! Resources: 1 destroyed."
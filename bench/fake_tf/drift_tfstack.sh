@@ -0,0 +1,19 @@
+#!/bin/sh
+# Stand-in for the drift_tfstack.sh of a terraform config, for benchmarking.
+# Exits like 'terraform plan -refresh-only -detailed-exitcode', drifted when FAKE_TF_DRIFT=1.
+
+if [ -z "$1" ]; then
+  echo "error:IdNotSpecified"
+  exit 1
+fi
+
+DELAY=${FAKE_TF_DELAY:-1}
+
+echo "Refreshing state..."
+sleep $DELAY
+if [ "${FAKE_TF_DRIFT:-0}" = "1" ]; then
+  echo "Note: Objects have changed outside of Terraform"
+  echo "  # aws_instance.this has changed"
+  exit 2
+fi
+echo "No changes. Your infrastructure still matches the configuration."
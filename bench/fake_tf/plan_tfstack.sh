@@ -0,0 +1,20 @@
+#!/bin/sh
+# Stand-in for the plan_tfstack.sh of a terraform config, for benchmarking.
+# Exits like 'terraform plan -detailed-exitcode', with changes when FAKE_TF_PLAN_CHANGES=1.
+
+if [ -z "$1" ]; then
+  echo "error:IdNotSpecified"
+  exit 1
+fi
+
+DELAY=${FAKE_TF_DELAY:-1}
+
+echo "Refreshing state..."
+sleep $DELAY
+if [ "${FAKE_TF_PLAN_CHANGES:-0}" = "1" ]; then
+  echo "Terraform will perform the following actions:"
+  echo "  ~ aws_instance.this"
+  echo "Plan: 0 to add, 1 to change, 0 to destroy."
+  exit 2
+fi
+echo "No changes. Your infrastructure matches the configuration."
@@ -0,0 +1,18 @@
+#!/bin/sh
+# Stand-in for the read_tfstack.sh of a terraform config, for benchmarking.
+# Lists FAKE_TF_RESOURCES resources after FAKE_TF_DELAY seconds.
+
+if [ -z "$1" ]; then
+  echo "error:IdNotSpecified"
+  exit 1
+fi
+
+RESOURCES=${FAKE_TF_RESOURCES:-20}
+DELAY=${FAKE_TF_DELAY:-1}
+
+sleep $DELAY
+i=0
+while [ $i -lt $RESOURCES ]; do
+  echo "aws_instance.instance_$i"
+  i=$((i + 1))
+done
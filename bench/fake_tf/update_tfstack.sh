@@ -0,0 +1,13 @@
+#!/bin/sh
+# Stand-in for the update_tfstack.sh of a terraform config, for benchmarking.
+
+if [ -z "$1" ]; then
+  echo "error:IdNotSpecified"
+  exit 1
+fi
+
+DELAY=${FAKE_TF_DELAY:-1}
+
+echo "aws_instance.this: Modifying..."
+sleep $DELAY
+echo "Apply complete! Resources: 0 added, 1 changed, 0 destroyed."
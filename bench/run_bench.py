@@ -0,0 +1,419 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'src'))
+
+
+"""Benchmark and load test of API -> broker -> worker -> executor.
+
+Runs the Flask app and a Celery worker in this process, against a local Redis
+and the stand-in Terraform shell scripts in bench/fake_tf, and drives the API endpoints
+with a load generator. Every phase reports the API latency, the end-to-end latency
+of the requests, requests per second, worker utilization and memory per running task.
+
+The Redis database of --redis-url is flushed, use a dedicated database.
+"""
+
+FAKE_TF_DIR = os.path.join(BENCH_DIR, 'fake_tf')
+PHASES = ['create', 'read', 'read-cached', 'update', 'delete']
+FINAL_STATUSES = ['SUCCESS', 'FAILURE', 'REVOKED']
+
+
+def percentile(values: list, percent: float):
+    """
+    Nearest-rank percentile
+
+    Args:
+        values (list): measurements
+        percent (float): percentile, between 0 and 100
+
+    Returns:
+        float: the percentile or None without measurements
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(percent / 100.0 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def current_rss():
+    """
+    Returns:
+        int: resident memory of this process in bytes, or None when unknown
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def call_api(api_url: str, method: str, path: str, body: dict = None):
+    """
+    Calls an API endpoint
+
+    Args:
+        api_url (str): base url of the API
+        method (str): http method
+        path (str): path of the endpoint
+        body (dict): optional json body
+
+    Returns:
+        tuple: the status code, the decoded json response and the latency in seconds
+    """
+    data = json.dumps(body).encode('utf8') if body is not None else None
+    api_request = urllib.request.Request(api_url + path, data=data, method=method,
+                                         headers={'Content-Type': 'application/json'})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(api_request, timeout=60) as response:
+            status, content = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, content = e.code, e.read()
+    latency = time.perf_counter() - started
+    try:
+        return status, json.loads(content), latency
+    except ValueError:
+        return status, None, latency
+
+
+class WorkerTracker:
+    """
+    Tracks the running tasks of the in-process worker, from the Celery task signals
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = dict()
+        self.busy_seconds = 0.0
+        self.peak_running = 0
+        self.peak_rss = 0
+
+    def connect(self):
+        from celery.signals import task_prerun, task_postrun
+
+        task_prerun.connect(self.on_task_prerun, weak=False)
+        task_postrun.connect(self.on_task_postrun, weak=False)
+
+    def on_task_prerun(self, task_id=None, **kwargs):
+        with self.lock:
+            self.running[task_id] = time.perf_counter()
+            self.peak_running = max(self.peak_running, len(self.running))
+
+    def on_task_postrun(self, task_id=None, **kwargs):
+        with self.lock:
+            started = self.running.pop(task_id, None)
+            if started is not None:
+                self.busy_seconds += time.perf_counter() - started
+
+    def sample(self):
+        """
+        Records the peak resident memory, call periodically
+        """
+        rss = current_rss()
+        if rss is not None:
+            with self.lock:
+                self.peak_rss = max(self.peak_rss, rss)
+
+    def reset(self):
+        """
+        Starts the measurements of a new phase
+
+        Returns:
+            int: resident memory at the start of the phase
+        """
+        with self.lock:
+            now = time.perf_counter()
+            # tasks still running from the previous phase count from now on
+            self.running = {task_id: now for task_id in self.running}
+            self.busy_seconds = 0.0
+            self.peak_running = len(self.running)
+            self.peak_rss = current_rss() or 0
+            return self.peak_rss
+
+
+class RequestPoller:
+    """
+    Polls the status of the outstanding requests in bulk, with POST /tfstacks/requests:lookup
+    """
+
+    def __init__(self, api_url: str, interval: float):
+        self.api_url = api_url
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.outstanding = dict()
+        self.finished = list()
+
+    def add(self, request_id: str, submitted_at: float):
+        with self.lock:
+            self.outstanding[request_id] = submitted_at
+
+    def wait(self, timeout: float):
+        """
+        Polls until all outstanding requests are finished
+
+        Args:
+            timeout (float): seconds to wait at most
+
+        Returns:
+            list: (request_id, status, end-to-end latency) per finished request
+        """
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            self.poll()
+            with self.lock:
+                if not self.outstanding:
+                    break
+            time.sleep(self.interval)
+        return self.finished
+
+    def poll(self):
+        with self.lock:
+            request_ids = list(self.outstanding)[:1000]
+        if not request_ids:
+            return
+        status, response, _ = call_api(self.api_url, 'POST', '/tfstacks/requests:lookup',
+                                       {'request_ids': request_ids})
+        if status != 200:
+            return
+        now = time.perf_counter()
+        with self.lock:
+            for request_status in response['requests']:
+                submitted_at = self.outstanding.get(request_status['request_id'])
+                if submitted_at is not None and request_status['request_status'] in FINAL_STATUSES:
+                    del self.outstanding[request_status['request_id']]
+                    self.finished.append((request_status['request_id'],
+                                          request_status['request_status'], now - submitted_at))
+
+
+def phase_requests(phase: str, resource_ids: list, count: int):
+    """
+    Args:
+        phase (str): one of PHASES
+        resource_ids (list): existing stack/resource ids
+        count (int): amount of create requests
+
+    Returns:
+        list: (method, path) per request of the phase
+    """
+    if phase == 'create':
+        return [('POST', '/tfstacks')] * count
+    if phase == 'read':
+        return [('GET', '/tfstacks/{}?refresh=true'.format(resource_id)) for resource_id in resource_ids]
+    if phase == 'read-cached':
+        return [('GET', '/tfstacks/{}'.format(resource_id)) for resource_id in resource_ids]
+    if phase == 'update':
+        return [('PUT', '/tfstacks/{}'.format(resource_id)) for resource_id in resource_ids]
+    return [('DELETE', '/tfstacks/{}'.format(resource_id)) for resource_id in resource_ids]
+
+
+def list_resource_ids(api_url: str):
+    """
+    Returns:
+        list: stack/resource ids of the inventory
+    """
+    resource_ids = list()
+    while True:
+        _, response, _ = call_api(api_url, 'GET', '/tfstacks?offset={}&limit=1000'.format(len(resource_ids)))
+        stacks = response['stacks']
+        resource_ids.extend(stack['resource_id'] for stack in stacks)
+        if not stacks or len(resource_ids) >= response['total']:
+            return resource_ids
+
+
+def run_phase(phase: str, requests: list, args, tracker: WorkerTracker = None):
+    """
+    Submits the requests of a phase with the load generator and waits until they are finished
+
+    Args:
+        phase (str): one of PHASES
+        requests (list): (method, path) per request
+        args (argparse.Namespace): the command line arguments
+        tracker (WorkerTracker): tracker of the in-process worker, if any
+
+    Returns:
+        dict: report of the phase
+    """
+    poller = RequestPoller(args.api_url, args.poll_interval)
+    api_latencies = list()
+    immediate = list()
+    errors = list()
+    rss_at_start = tracker.reset() if tracker else None
+    started = time.perf_counter()
+
+    def submit(index_request):
+        index, (method, path) = index_request
+        if args.rate > 0:
+            time.sleep(max(started + index / args.rate - time.perf_counter(), 0))
+        submitted_at = time.perf_counter()
+        status, response, latency = call_api(args.api_url, method, path)
+        api_latencies.append(latency)
+        if status == 202:
+            poller.add(response['request_id'], submitted_at)
+        elif status == 200:
+            immediate.append(latency)
+        else:
+            errors.append(status)
+
+    stop_sampling = threading.Event()
+
+    def sample():
+        while not stop_sampling.wait(0.05):
+            tracker.sample()
+
+    if tracker:
+        threading.Thread(target=sample, daemon=True).start()
+
+    with ThreadPoolExecutor(max_workers=args.clients) as executor:
+        list(executor.map(submit, enumerate(requests)))
+    submitted = time.perf_counter() - started
+
+    finished = poller.wait(args.timeout)
+    elapsed = time.perf_counter() - started
+    stop_sampling.set()
+
+    end_to_end = [latency for _, status, latency in finished] + immediate
+    failed = [request_id for request_id, status, _ in finished if status != 'SUCCESS']
+    report = {
+        'phase': phase,
+        'requests': len(requests),
+        'completed': len(end_to_end) - len(failed),
+        'failed': len(failed) + len(errors),
+        'unfinished': len(requests) - len(end_to_end) - len(errors),
+        'api_p50_ms': _ms(percentile(api_latencies, 50)),
+        'api_p99_ms': _ms(percentile(api_latencies, 99)),
+        'e2e_p50_s': _round(percentile(end_to_end, 50)),
+        'e2e_p99_s': _round(percentile(end_to_end, 99)),
+        'api_rps': _round(len(api_latencies) / submitted if submitted else None),
+        'rps': _round((len(end_to_end) - len(failed)) / elapsed if elapsed else None),
+        'worker_utilization': None,
+        'memory_per_task_kb': None,
+    }
+    if tracker:
+        report['worker_utilization'] = _round(tracker.busy_seconds / (elapsed * args.worker_concurrency))
+        if tracker.peak_running and rss_at_start:
+            report['memory_per_task_kb'] = int(
+                (tracker.peak_rss - rss_at_start) / tracker.peak_running / 1024)
+    return report
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+def _round(value):
+    return round(value, 3) if value is not None else None
+
+
+def print_reports(reports: list):
+    columns = ['phase', 'requests', 'completed', 'failed', 'unfinished', 'api_p50_ms', 'api_p99_ms',
+               'e2e_p50_s', 'e2e_p99_s', 'api_rps', 'rps', 'worker_utilization', 'memory_per_task_kb']
+    widths = [max(len(column), *(len(str(report[column])) for report in reports)) for column in columns]
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)))
+    for report in reports:
+        print('  '.join(str(report[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark and load test of the tfstack-api')
+    parser.add_argument('--redis-url', default=os.environ.get('BENCH_REDIS_URL', 'redis://localhost:6379/15'),
+                        help='broker and result backend, flushed before the run')
+    parser.add_argument('--api-url', default=None,
+                        help='benchmark an API that is already running (e.g. gunicorn) instead of the in-process Flask app')
+    parser.add_argument('--external-worker', action='store_true',
+                        help="don't start an in-process Celery worker, e.g. to benchmark a prefork worker")
+    parser.add_argument('--phases', default=','.join(PHASES),
+                        help='comma separated phases: {}'.format(', '.join(PHASES)))
+    parser.add_argument('--requests', type=int, default=100, help='amount of stacks to create')
+    parser.add_argument('--clients', type=int, default=10, help='concurrent load generator clients')
+    parser.add_argument('--rate', type=float, default=0, help='requests per second, 0 is as fast as possible')
+    parser.add_argument('--worker-concurrency', type=int, default=20)
+    parser.add_argument('--executor-mode', choices=['sync', 'async'], default='sync')
+    parser.add_argument('--output-lines', type=int, default=500, help='output lines of the create and delete scripts')
+    parser.add_argument('--resources', type=int, default=20, help='resources listed by the read script')
+    parser.add_argument('--delay', type=float, default=1.0, help='seconds every script runs')
+    parser.add_argument('--plan-changes', action='store_true', help='plans of the update phase have changes')
+    parser.add_argument('--drift', action='store_true', help='drift checks of the stacks find drift')
+    parser.add_argument('--poll-interval', type=float, default=0.1)
+    parser.add_argument('--timeout', type=float, default=600, help='seconds to wait for the requests of a phase')
+    parser.add_argument('--json', dest='json_file', default=None, help='also write the reports to this file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # the modules of the app read their configuration on import
+    os.environ['CELERY_BROKER_URL'] = args.redis_url
+    os.environ['CELERY_RESULT_BACKEND'] = args.redis_url
+    os.environ['EXECUTOR_MODE'] = args.executor_mode
+    os.environ['FAKE_TF_OUTPUT_LINES'] = str(args.output_lines)
+    os.environ['FAKE_TF_RESOURCES'] = str(args.resources)
+    os.environ['FAKE_TF_DELAY'] = str(args.delay)
+    os.environ['FAKE_TF_PLAN_CHANGES'] = '1' if args.plan_changes else '0'
+    os.environ['FAKE_TF_DRIFT'] = '1' if args.drift else '0'
+    os.environ.setdefault('STACK_LOCK_RETRY_DELAY', '1')
+    # the load generator is a single client, admission control is disabled unless configured
+    for operation in ('CREATE', 'READ', 'UPDATE', 'DELETE'):
+        os.environ.setdefault('RATE_LIMIT_' + operation, '0')
+    os.environ.setdefault('MAX_QUEUED_TASKS', '0')
+
+    from utils import get_redis_client
+    from tfstack_queues import QUEUES
+    from tfstack_tasks import celery
+
+    get_redis_client().flushdb()
+
+    server = None
+    if args.api_url is None:
+        from werkzeug.serving import make_server
+        from app import create_app
+
+        server = make_server('127.0.0.1', 0, create_app(FAKE_TF_DIR), threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        args.api_url = 'http://127.0.0.1:{}'.format(server.server_port)
+
+    tracker = None
+    reports = list()
+    worker_context = None
+    try:
+        if not args.external_worker:
+            from celery.contrib.testing.worker import start_worker
+
+            tracker = WorkerTracker()
+            tracker.connect()
+            worker_context = start_worker(celery, concurrency=args.worker_concurrency, pool='threads',
+                                          queues=QUEUES, perform_ping_check=False, loglevel='error')
+            worker_context.__enter__()
+
+        resource_ids = list()
+        for phase in args.phases.split(','):
+            if phase not in PHASES:
+                raise SystemExit('unknown phase {}'.format(phase))
+            if phase != 'create':
+                resource_ids = list_resource_ids(args.api_url)
+            reports.append(run_phase(phase, phase_requests(
+                phase, resource_ids, args.requests), args, tracker))
+    finally:
+        if worker_context is not None:
+            worker_context.__exit__(None, None, None)
+        if server is not None:
+            server.shutdown()
+
+    print_reports(reports)
+    if args.json_file:
+        with open(args.json_file, 'w') as json_file:
+            json.dump({'arguments': vars(args), 'reports': reports}, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -55,3 +55,29 @@ Create the name of the service account to use
 {{- default "default" .Values.serviceAccount.name }}
 {{- end }}
 {{- end }}
+
+{{/*
+The redis of the Celery result backend and the state of the API, the broker unless resultStore is enabled
+*/}}
+{{- define "tfstack-api.resultBackendUrl" -}}
+{{- if .Values.resultStore.enabled }}
+{{- printf "redis://%s-redis-results:6379" (include "tfstack-api.fullname" .) }}
+{{- else }}
+{{- print "redis://redis:6379" }}
+{{- end }}
+{{- end }}
+
+{{/*
+Environment of the completion callbacks, for the app and the workers
+*/}}
+{{- define "tfstack-api.callbackEnv" -}}
+{{- if .Values.callbacks.secretName }}
+- name: CALLBACK_SECRET
+  valueFrom:
+    secretKeyRef:
+      name: {{ .Values.callbacks.secretName }}
+      key: CALLBACK_SECRET
+- name: CALLBACK_ALLOWED_HOSTS
+  value: {{ .Values.callbacks.allowedHosts | quote }}
+{{- end }}
+{{- end }}
@@ -1,16 +1,14 @@
 from flask import Flask
 from flask_swagger_ui import get_swaggerui_blueprint
-from flask import request, jsonify
 from flask_cors import CORS
-from pprint import pprint
-from urllib.parse import parse_qs
 from os import environ
-import ssl
-import json
-import subprocess
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 from tfstack_blueprint import tfstack_blueprint
-from utils import get_logger
+from tfstack_metrics_blueprint import metrics_blueprint
+
+# amount of proxies in front of the app whose X-Forwarded-For is trusted, 0 trusts none
+PROXY_FIX_X_FOR = int(environ.get("PROXY_FIX_X_FOR", "0"))
 
 
 def create_app(tf_dir):
@@ -24,6 +22,9 @@ def create_app(tf_dir):
     """
     app = Flask(__name__)
     CORS(app)
+    if PROXY_FIX_X_FOR > 0:
+        # the remote address identifies the clients of the rate limits, not the address of the proxy
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_FIX_X_FOR)
 
     SWAGGER_URL = '/swagger'
     API_URL = '/static/swagger.json'
@@ -32,6 +33,7 @@ def create_app(tf_dir):
     app.register_blueprint(SWAGGERUI_BLUEPRINT, url_prefix=SWAGGER_URL)
 
     app.register_blueprint(tfstack_blueprint)
+    app.register_blueprint(metrics_blueprint)
 
     app.config['TF_DIR'] = tf_dir
 
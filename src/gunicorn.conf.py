@@ -0,0 +1,34 @@
+import multiprocessing
+import os
+
+
+"""gunicorn configuration of the tfstack-api API component.
+
+Every setting can be tuned with an environment variable. Each worker process
+creates the Celery app and the redis connection pool once, shared by its threads.
+"""
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8080")
+
+workers = int(os.environ.get("GUNICORN_WORKERS",
+                             multiprocessing.cpu_count() * 2 + 1))
+# gthread keeps long lived connections (e.g. the request stream endpoint) on a thread,
+# use 'gevent' for many concurrent streams (requires the gevent package)
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "1000"))
+
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "5"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+
+# load the app before forking the workers, connections are only opened after the fork
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() == "true"
+
+accesslog = os.environ.get("GUNICORN_ACCESSLOG", "-")
+
+
+def child_exit(server, worker):
+    # cleans up the metrics of the worker process, see tfstack_metrics
+    from tfstack_metrics import mark_process_dead
+    mark_process_dead(worker.pid)
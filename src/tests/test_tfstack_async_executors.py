@@ -0,0 +1,98 @@
+import os
+import time
+import asyncio
+import shutil
+import tempfile
+import threading
+import unittest
+
+from unittest.mock import patch
+
+from tfstack_async_executors import create_tf_stack_async, delete_tf_stack_async, read_tf_stack_async, \
+    get_async_runner
+
+
+class Test_async_executors(unittest.TestCase):
+    def setUp(self):
+        # This temporary directory holds stand-ins for the terraform shell scripts
+        self.tf_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tf_dir)
+
+    def write_script(self, name, content):
+        path = os.path.join(self.tf_dir, name)
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\n' + content)
+        os.chmod(path, 0o755)
+
+    def test_create_tf_stack_async(self):
+        self.write_script('create_tfstack.sh',
+                          'echo mocked stdout line 1\necho \'resource_id "123"\'\n')
+
+        published_lines = list()
+        result = asyncio.run(create_tf_stack_async(
+            self.tf_dir, on_line=published_lines.append))
+        self.assertEqual(result, {
+                         'message': 'TFstack created succesfully', 'resource_id': '123'})
+        self.assertEqual(published_lines, [
+                         'mocked stdout line 1', 'resource_id "123"'])
+
+    def test_create_tf_stack_async_long_line(self):
+        # a line beyond the 64 KiB limit of the stream, the last line without a newline
+        self.write_script('create_tfstack.sh',
+                          'printf "%070000d\\n" 0\nprintf \'resource_id "123"\'\n')
+
+        published_lines = list()
+        result = asyncio.run(create_tf_stack_async(
+            self.tf_dir, on_line=published_lines.append))
+        self.assertEqual(result['resource_id'], '123')
+        self.assertEqual([len(line) for line in published_lines], [70000, 17])
+
+    def test_delete_tf_stack_async_scripterror(self):
+        self.write_script('delete_tfstack.sh',
+                          'echo error:WorkspaceNotExist $1\nexit 1\n')
+
+        with self.assertRaises(Exception) as cm:
+            asyncio.run(delete_tf_stack_async(self.tf_dir, '123'))
+        self.assertEqual('error:WorkspaceNotExist', str(cm.exception))
+
+    def test_read_tf_stack_async(self):
+        self.write_script('read_tfstack.sh', 'echo aws_instance.stack_$1\n')
+
+        self.assertEqual(asyncio.run(read_tf_stack_async(self.tf_dir, '123')), {
+            'message': "TFstack read succesfully",
+            'resources': [{'address': 'aws_instance.stack_123', 'module': None, 'mode': 'managed',
+                           'type': 'aws_instance', 'name': 'stack_123', 'index': None}],
+        })
+
+    @patch('tfstack_async_executors.TERMINATE_GRACE_PERIOD', 1)
+    def test_read_tf_stack_async_timeout(self):
+        self.write_script('read_tfstack.sh', 'sleep 30\n')
+
+        started = time.time()
+        with self.assertRaises(Exception) as cm:
+            asyncio.run(read_tf_stack_async(self.tf_dir, '123', timeout=1))
+        self.assertEqual(
+            'Timeout during execution of Terraform executor', str(cm.exception))
+        self.assertLess(time.time() - started, 10)
+
+
+class Test_async_runner(unittest.TestCase):
+    @patch('tfstack_async_executors._async_runner', None)
+    @patch('tfstack_async_executors.AsyncExecutorRunner')
+    def test_get_async_runner(self, patch_runner):
+        # the first tasks of the threads of a worker process get the same runner
+        patch_runner.side_effect = lambda: time.sleep(0.05) or object()
+        runners = list()
+        threads = [threading.Thread(target=lambda: runners.append(get_async_runner())) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(patch_runner.call_count, 1)
+        self.assertEqual(len(set(map(id, runners))), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
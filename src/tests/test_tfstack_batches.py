@@ -0,0 +1,94 @@
+import unittest
+
+from unittest.mock import call, patch
+
+from tfstack_batches import create_batch, expired_batch_requests, get_batch_status, pending_batch_items, \
+    claim_batch_item, record_batch_result
+
+
+class Test_batches(unittest.TestCase):
+    @patch('tfstack_batches.get_redis_client')
+    def test_get_batch_status(self, patch_client):
+        patch_client.return_value.pipeline.return_value.execute.return_value = [
+            {b'operation': b'delete_tf_stack_task', b'total': b'200',
+             b'succeeded': b'173', b'failed': b'2'},
+            [b'request-1', b'request-2'],
+        ]
+
+        self.assertEqual(get_batch_status('batch-1'), {
+            'batch_id': 'batch-1',
+            'operation': 'delete_tf_stack_task',
+            'total': 200,
+            'succeeded': 173,
+            'failed': 2,
+            'done': 175,
+            'request_ids': ['request-1', 'request-2'],
+        })
+
+    @patch('tfstack_batches.get_redis_client')
+    def test_get_batch_status_not_found(self, patch_client):
+        patch_client.return_value.pipeline.return_value.execute.return_value = [
+            {}, []]
+
+        self.assertEqual(get_batch_status('batch-1'), None)
+
+    @patch('tfstack_batches.time.time', return_value=1000.0)
+    @patch('tfstack_batches.get_redis_client')
+    def test_claim_batch_item(self, patch_client, patch_time):
+        patch_client.return_value.eval.side_effect = [b'{"tf_dir": "some_dir", "resource_id": "123"}', None]
+
+        self.assertEqual(claim_batch_item('batch-1', 'request-1'), {'tf_dir': 'some_dir', 'resource_id': '123'})
+        self.assertEqual(claim_batch_item('batch-1', 'request-2'), None)
+        self.assertEqual(patch_client.return_value.eval.call_args[0][1:], (
+            3, 'tfstack:batch:batch-1:pending', 'tfstack:batch:batch-1:requests', 'tfstack:batch:batch-1:inflight',
+            'request-2', 1000.0, 86400))
+
+    @patch('tfstack_batches.get_redis_client')
+    def test_create_batch(self, patch_client):
+        batch_id = create_batch('delete_tf_stack_task', [{'resource_id': '123'}], priority=9)
+        pipeline = patch_client.return_value.pipeline.return_value
+        pipeline.hset.assert_called_once_with('tfstack:batch:' + batch_id, mapping={
+            'operation': 'delete_tf_stack_task', 'total': 1, 'succeeded': 0, 'failed': 0, 'priority': 9})
+        self.assertEqual(pipeline.zadd.call_args[0][0], 'tfstack:batches:active')
+
+    @patch('tfstack_batches.get_redis_client')
+    def test_record_batch_result(self, patch_client):
+        client = patch_client.return_value
+        client.zrem.return_value = 1
+        client.pipeline.return_value.execute.return_value = [2, [b'2', b'1', b'1']]
+
+        self.assertTrue(record_batch_result('batch-1', 'request-2', False))
+        client.pipeline.return_value.hincrby.assert_called_once_with('tfstack:batch:batch-1', 'failed', 1)
+        # the last item is done, the batch isn't active anymore
+        self.assertEqual(client.zrem.call_args_list, [call('tfstack:batch:batch-1:inflight', 'request-2'),
+                                                      call('tfstack:batches:active', 'batch-1')])
+
+    @patch('tfstack_batches.get_redis_client')
+    def test_record_batch_result_once(self, patch_client):
+        # the item was reaped already
+        patch_client.return_value.zrem.return_value = 0
+
+        self.assertFalse(record_batch_result('batch-1', 'request-2', True))
+        patch_client.return_value.pipeline.assert_not_called()
+
+    @patch('tfstack_batches.get_redis_client')
+    def test_expired_batch_requests(self, patch_client):
+        client = patch_client.return_value
+        client.zrange.return_value = [b'batch-1', b'batch-2']
+        client.pipeline.return_value.execute.return_value = [[b'request-1'], []]
+
+        self.assertEqual(expired_batch_requests(timeout=600, now=1000.0), [('batch-1', 'request-1')])
+        client.zremrangebyscore.assert_called_once_with('tfstack:batches:active', '-inf', 1000.0)
+        client.pipeline.return_value.zrangebyscore.assert_any_call('tfstack:batch:batch-2:inflight', '-inf', 400.0)
+
+    @patch('tfstack_batches.get_redis_client')
+    def test_pending_batch_items(self, patch_client):
+        patch_client.return_value.zrange.return_value = [b'batch-1', b'batch-2']
+        patch_client.return_value.pipeline.return_value.execute.return_value = [190, 5]
+
+        self.assertEqual(pending_batch_items(), 195)
+        patch_client.return_value.pipeline.return_value.llen.assert_any_call('tfstack:batch:batch-2:pending')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,292 @@
+import unittest
+
+from unittest.mock import patch
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from app import create_app
+from tfstack_callbacks import InvalidCallback
+from tfstack_ratelimit import RateLimited
+from tfstack_blueprint import enqueue_coalesced
+from tfstack_tasks import create_tf_stack_task, delete_tf_stack_task, read_tf_stack_task
+
+
+class BlueprintTestCase(unittest.TestCase):
+    """
+    Calls the API with a test client, the tasks and the redis state of the API mocked per test
+    """
+
+    def setUp(self):
+        self.client = create_app('/tf').test_client()
+        self.admit = patch('tfstack_blueprint.admit').start()
+        self.take_tokens = patch('tfstack_blueprint.take_tokens').start()
+
+    def tearDown(self):
+        patch.stopall()
+
+
+class Test_list_tf_stacks(BlueprintTestCase):
+    def setUp(self):
+        super().setUp()
+        self.list_stacks = patch('tfstack_blueprint.list_stacks', return_value={'total': 0, 'stacks': []}).start()
+
+    @patch('tfstack_blueprint.INVENTORY_MAX_LIMIT', 50)
+    def test_list_tf_stacks(self):
+        response = self.client.get('/tfstacks?offset=10&limit=500&state=created&created_after=900.5')
+        self.assertEqual(response.status_code, 200)
+        # the limit is clamped, the response holds the applied limit
+        self.assertEqual(response.get_json(), {'total': 0, 'stacks': [], 'offset': 10, 'limit': 50})
+        self.list_stacks.assert_called_once_with(offset=10, limit=50, state='created',
+                                                 created_after=900.5, created_before=None)
+
+    def test_list_tf_stacks_invalid(self):
+        for query in ('limit=-1', 'limit=0', 'offset=-1', 'offset=a', 'created_after=yesterday',
+                      'created_before=nan', 'state=gone'):
+            response = self.client.get('/tfstacks?' + query)
+            self.assertEqual(response.status_code, 400, query)
+        self.list_stacks.assert_not_called()
+
+    @patch('tfstack_blueprint.get_drift_report', return_value={'stacks': []})
+    def test_drift_report_invalid_limit(self, patch_report):
+        self.assertEqual(self.client.get('/drift?limit=-1').status_code, 400)
+        patch_report.assert_not_called()
+
+
+class Test_coalescing(BlueprintTestCase):
+    @patch('tfstack_blueprint.claim_inflight_request')
+    def test_enqueue_coalesced(self, patch_claim):
+        patch_claim.side_effect = lambda operation, resource_id, request_id: (request_id, True)
+
+        with patch.object(read_tf_stack_task, 'apply_async') as patch_apply:
+            request_id = enqueue_coalesced(read_tf_stack_task, '/tf', '123', priority=0)
+        patch_apply.assert_called_once_with(kwargs={'tf_dir': '/tf', 'resource_id': '123'},
+                                            task_id=request_id, priority=0)
+
+    @patch('tfstack_blueprint.claim_inflight_request', return_value=('abc', False))
+    def test_enqueue_coalesced_inflight(self, patch_claim):
+        with patch.object(read_tf_stack_task, 'apply_async') as patch_apply:
+            self.assertEqual(enqueue_coalesced(read_tf_stack_task, '/tf', '123'), 'abc')
+        patch_apply.assert_not_called()
+
+    @patch('tfstack_blueprint.release_inflight_request')
+    @patch('tfstack_blueprint.claim_inflight_request', return_value=('abc', True))
+    def test_enqueue_coalesced_releases_claim(self, patch_claim, patch_release):
+        # a claim without a task would coalesce the following requests into a request that never runs
+        with patch.object(read_tf_stack_task, 'apply_async', side_effect=ConnectionError()):
+            with self.assertRaises(ConnectionError):
+                enqueue_coalesced(read_tf_stack_task, '/tf', '123')
+        patch_release.assert_called_once_with('read_tf_stack_task', '123', 'abc')
+
+    @patch('tfstack_blueprint.release_inflight_request')
+    @patch('tfstack_blueprint.claim_inflight_request', return_value=('abc', True))
+    @patch('tfstack_blueprint.register_callback', side_effect=InvalidCallback('request abc has 10 callbacks already'))
+    @patch('tfstack_blueprint.validate_callback_url', side_effect=lambda url: url)
+    def test_delete_tf_stack_callback_limit(self, patch_validate, patch_register, patch_claim, patch_release):
+        # the callback is rejected before the task is enqueued
+        with patch.object(delete_tf_stack_task, 'apply_async') as patch_apply:
+            response = self.client.delete('/tfstacks/123', json={'callback_url': 'https://hooks.example.com/a'})
+        self.assertEqual(response.status_code, 400)
+        patch_apply.assert_not_called()
+        patch_release.assert_called_once_with('delete_tf_stack_task', '123', 'abc')
+
+    @patch('tfstack_blueprint.release_inflight_request')
+    @patch('tfstack_blueprint.claim_inflight_request', return_value=('abc', False))
+    @patch('tfstack_blueprint.register_callback', side_effect=RedisConnectionError())
+    @patch('tfstack_blueprint.validate_callback_url', side_effect=lambda url: url)
+    def test_delete_tf_stack_callback_coalesced(self, patch_validate, patch_register, patch_claim, patch_release):
+        # the claim of the request in flight is kept
+        with self.assertRaises(RedisConnectionError):
+            enqueue_coalesced(delete_tf_stack_task, '/tf', '123', callback_url='https://hooks.example.com/a')
+        patch_release.assert_not_called()
+
+    @patch('tfstack_blueprint.get_cached_read', return_value=None)
+    @patch('tfstack_blueprint.state_reader_enabled', return_value=False)
+    @patch('tfstack_blueprint.enqueue_coalesced', return_value='abc')
+    def test_read_tf_stack(self, patch_enqueue, patch_state_reader, patch_cached_read):
+        response = self.client.get('/tfstacks/123')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.get_json(), {'request_id': 'abc'})
+        patch_enqueue.assert_called_once_with(read_tf_stack_task, tf_dir='/tf', resource_id='123')
+        self.admit.assert_called_once()
+
+    @patch('tfstack_blueprint.get_cached_read', return_value={'resources': []})
+    @patch('tfstack_blueprint.enqueue_coalesced')
+    def test_read_tf_stack_cached(self, patch_enqueue, patch_cached_read):
+        response = self.client.get('/tfstacks/123')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['request_result'], {'resources': []})
+        patch_enqueue.assert_not_called()
+        self.admit.assert_not_called()
+
+
+class Test_request_body(BlueprintTestCase):
+    @patch('tfstack_blueprint.enqueue_coalesced')
+    def test_invalid_request_body(self, patch_enqueue):
+        with patch.object(create_tf_stack_task, 'apply_async') as patch_apply:
+            for body in ([1], 'abc'):
+                self.assertEqual(self.client.post('/tfstacks', json=body).status_code, 400, body)
+                self.assertEqual(self.client.delete('/tfstacks/123', json=body).status_code, 400, body)
+        patch_apply.assert_not_called()
+        patch_enqueue.assert_not_called()
+        self.admit.assert_not_called()
+
+
+class Test_priority(BlueprintTestCase):
+    @patch('tfstack_blueprint.add_request_callback')
+    @patch('tfstack_blueprint.enqueue_coalesced')
+    def test_invalid_priority(self, patch_enqueue, patch_callback):
+        # an invalid priority is rejected before the request is charged or its callback is registered
+        with patch.object(create_tf_stack_task, 'apply_async') as patch_apply:
+            for method, path in (('post', '/tfstacks'), ('delete', '/tfstacks/123'), ('put', '/tfstacks/123')):
+                response = getattr(self.client, method)(path + '?priority=urgent')
+                self.assertEqual(response.status_code, 400, path)
+        self.admit.assert_not_called()
+        patch_callback.assert_not_called()
+        patch_enqueue.assert_not_called()
+        patch_apply.assert_not_called()
+
+
+class Test_batches(BlueprintTestCase):
+    def setUp(self):
+        super().setUp()
+        self.start_batch = patch('tfstack_blueprint.start_batch', return_value='batch-1').start()
+
+    def test_create_tf_stack_batch(self):
+        response = self.client.post('/tfstacks:batch?priority=low', json={'count': 3})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.get_json(), {'batch_id': 'batch-1'})
+        self.start_batch.assert_called_once_with(create_tf_stack_task, [{'tf_dir': '/tf'}] * 3, priority=9)
+        # every item of the batch is charged
+        self.assertEqual(self.admit.call_args[0][1:], ('create', 3))
+
+    def test_delete_tf_stack_batch(self):
+        response = self.client.delete('/tfstacks:batch', json={'resource_ids': ['1', '2', '1']})
+        self.assertEqual(response.status_code, 202)
+        items = self.start_batch.call_args[0][1]
+        self.assertEqual(sorted(item['resource_id'] for item in items), ['1', '2'])
+        self.assertEqual(self.admit.call_args[0][1:], ('delete', 2))
+
+    def test_tf_stack_batch_invalid(self):
+        for body in ({'count': True}, {'count': 0}, {'count': '3'}):
+            self.assertEqual(self.client.post('/tfstacks:batch', json=body).status_code, 400, body)
+        for resource_ids in ([{'id': '1'}], [['1']], [''], [1], []):
+            response = self.client.delete('/tfstacks:batch', json={'resource_ids': resource_ids})
+            self.assertEqual(response.status_code, 400, resource_ids)
+        for body in ([1], '3', 3):
+            self.assertEqual(self.client.post('/tfstacks:batch', json=body).status_code, 400, body)
+            self.assertEqual(self.client.delete('/tfstacks:batch', json=body).status_code, 400, body)
+        self.start_batch.assert_not_called()
+        self.admit.assert_not_called()
+
+    def test_tf_stack_batch_invalid_priority(self):
+        self.assertEqual(self.client.post('/tfstacks:batch?priority=urgent', json={'count': 3}).status_code, 400)
+        response = self.client.delete('/tfstacks:batch?priority=urgent', json={'resource_ids': ['1']})
+        self.assertEqual(response.status_code, 400)
+        self.admit.assert_not_called()
+
+    @patch('tfstack_blueprint.get_batch_status', return_value=None)
+    def test_batch_status_not_found(self, patch_status):
+        self.assertEqual(self.client.get('/tfstacks/batches/batch-1').status_code, 404)
+
+
+class Test_requests(BlueprintTestCase):
+    def setUp(self):
+        super().setUp()
+        self.request_known = patch('tfstack_blueprint.request_known', return_value=True).start()
+
+    @patch('tfstack_blueprint.cancel_request')
+    def test_cancel_request(self, patch_cancel):
+        with patch.object(create_tf_stack_task, 'AsyncResult') as patch_result:
+            patch_result.return_value.ready.return_value = False
+            response = self.client.delete('/tfstacks/requests/abc')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.get_json(), {'request_id': 'abc', 'request_status': 'CANCELLING'})
+        patch_cancel.assert_called_once_with('abc')
+        self.assertEqual(self.take_tokens.call_args[0][1], 'cancel')
+
+    @patch('tfstack_blueprint.cancel_request')
+    def test_cancel_unknown_request(self, patch_cancel):
+        self.request_known.return_value = False
+        with patch.object(create_tf_stack_task, 'AsyncResult') as patch_result:
+            patch_result.return_value.ready.return_value = False
+            response = self.client.delete('/tfstacks/requests/abc')
+        self.assertEqual(response.status_code, 404)
+        patch_cancel.assert_not_called()
+
+    @patch('tfstack_blueprint.cancel_request')
+    def test_cancel_request_rate_limited(self, patch_cancel):
+        self.take_tokens.side_effect = RateLimited('Rate limit of cancel exceeded', 3)
+        response = self.client.delete('/tfstacks/requests/abc')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '3')
+        patch_cancel.assert_not_called()
+
+    @patch('tfstack_blueprint.cancel_request')
+    def test_cancel_finished_request(self, patch_cancel):
+        with patch.object(create_tf_stack_task, 'AsyncResult') as patch_result:
+            patch_result.return_value.ready.return_value = True
+            patch_result.return_value.status = 'SUCCESS'
+            response = self.client.delete('/tfstacks/requests/abc')
+        self.assertEqual(response.status_code, 409)
+        patch_cancel.assert_not_called()
+
+
+    def test_requests_lookup_invalid(self):
+        with patch.object(create_tf_stack_task.backend, 'mget') as patch_mget:
+            for request_ids in ([{'id': 'abc'}], [['abc']], [1], [''], [], 'abc'):
+                response = self.client.post('/tfstacks/requests:lookup', json={'request_ids': request_ids})
+                self.assertEqual(response.status_code, 400, request_ids)
+            for body in ([1], 'abc'):
+                response = self.client.post('/tfstacks/requests:lookup', json=body)
+                self.assertEqual(response.status_code, 400, body)
+        patch_mget.assert_not_called()
+
+
+class Test_requests_stream(BlueprintTestCase):
+    def setUp(self):
+        super().setUp()
+        self.request_known = patch('tfstack_blueprint.request_known', return_value=True).start()
+        self.read_progress = patch('tfstack_blueprint.read_progress').start()
+        self.async_result = patch.object(create_tf_stack_task, 'AsyncResult').start()
+        self.async_result.return_value.ready.return_value = False
+
+    def test_stream(self):
+        self.read_progress.side_effect = [[('1-0', {'line': 'Creating...'})], [('2-0', {'end': 'SUCCESS'})]]
+
+        response = self.client.get('/tfstacks/requests/abc/stream', headers={'Last-Event-ID': '0-1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_data(as_text=True),
+                         'id: 1-0\ndata: Creating...\n\nid: 2-0\nevent: end\ndata: SUCCESS\n\n')
+        self.assertEqual(self.read_progress.call_args_list[0][1]['last_id'], '0-1')
+        self.assertEqual(self.read_progress.call_args_list[1][1]['last_id'], '1-0')
+
+    def test_stream_unknown_request(self):
+        self.request_known.return_value = False
+
+        self.assertEqual(self.client.get('/tfstacks/requests/abc/stream').status_code, 404)
+        self.read_progress.assert_not_called()
+
+    def test_stream_expired_progress_of_finished_request(self):
+        self.request_known.return_value = False
+        self.async_result.return_value.ready.return_value = True
+        self.async_result.return_value.status = 'FAILURE'
+        self.read_progress.return_value = []
+
+        response = self.client.get('/tfstacks/requests/abc/stream')
+        self.assertEqual(response.get_data(as_text=True), 'event: end\ndata: FAILURE\n\n')
+
+    @patch('tfstack_blueprint.PROGRESS_MAX_IDLE', 0)
+    def test_stream_idle_timeout(self):
+        self.read_progress.return_value = []
+
+        response = self.client.get('/tfstacks/requests/abc/stream')
+        self.assertEqual(response.get_data(as_text=True), 'event: timeout\ndata: no progress for 0 seconds\n\n')
+
+    def test_stream_redis_error(self):
+        self.read_progress.side_effect = [[('1-0', {'line': 'Creating...'})], RedisConnectionError()]
+
+        response = self.client.get('/tfstacks/requests/abc/stream')
+        self.assertTrue(response.get_data(as_text=True).endswith('event: error\ndata: progress unavailable\n\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import json
+import unittest
+
+from unittest.mock import patch
+from redis.exceptions import ConnectionError
+
+from tfstack_cache import get_cached_read, set_cached_read, invalidate_cached_read
+
+
+class Test_read_cache(unittest.TestCase):
+    @patch('tfstack_cache.get_redis_client')
+    def test_get_cached_read_hit(self, patch_client):
+        result = {'message': "TFstack read succesfully", 'content': ['foo']}
+        patch_client.return_value.get.return_value = json.dumps(result)
+
+        self.assertEqual(get_cached_read('123'), result)
+        patch_client.return_value.get.assert_called_with('tfstack:read:123')
+
+    @patch('tfstack_cache.get_redis_client')
+    def test_get_cached_read_miss(self, patch_client):
+        patch_client.return_value.get.return_value = None
+
+        self.assertEqual(get_cached_read('123'), None)
+
+    @patch('tfstack_cache.get_redis_client')
+    def test_get_cached_read_redis_unavailable(self, patch_client):
+        patch_client.return_value.get.side_effect = ConnectionError()
+
+        self.assertEqual(get_cached_read('123'), None)
+
+    @patch('tfstack_cache.READ_CACHE_MAX_ENTRIES', 2)
+    @patch('tfstack_cache.get_redis_client')
+    def test_set_cached_read_evicts_oldest(self, patch_client):
+        client = patch_client.return_value
+        client.pipeline.return_value.execute.return_value = [
+            True, 1, 0, 3]
+        client.zpopmin.return_value = [(b'old', 1.0)]
+
+        set_cached_read('123', {'content': []})
+        client.zpopmin.assert_called_with('tfstack:read:index', 1)
+        client.delete.assert_called_with('tfstack:read:old')
+
+    @patch('tfstack_cache.get_redis_client')
+    def test_invalidate_cached_read(self, patch_client):
+        pipeline = patch_client.return_value.pipeline.return_value
+
+        invalidate_cached_read('123')
+        pipeline.delete.assert_called_with('tfstack:read:123')
+        pipeline.zrem.assert_called_with('tfstack:read:index', '123')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import json
+import socket
+import unittest
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from unittest.mock import patch
+
+from tfstack_callbacks import SIGNATURE_HEADER, TIMESTAMP_HEADER, CallbackDeliveryError, InvalidCallback, \
+    callback_queue_full, completion_payload, deliver_callback, pop_callbacks, register_callback, retry_countdown, \
+    validate_callback_url, verify_signature
+
+SECRET = 'test-secret'
+
+
+class Receiver(BaseHTTPRequestHandler):
+    """
+    Stand-in receiver of the callbacks, answers with the statuses of the server in turn
+    """
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.deliveries.append((dict(self.headers), body))
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        if status == 302:
+            self.send_header('Location', 'http://127.0.0.1:1/elsewhere')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Test_callbacks(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), Receiver)
+        self.server.deliveries = list()
+        self.server.statuses = list()
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{}/hook'.format(self.server.server_port)
+        self.payload = completion_payload('abc', 'create', 'SUCCESS', {'resource_id': '123'})
+        # the receiver listens on a loopback address, which is only allowed when it is allowlisted
+        patch('tfstack_callbacks.CALLBACK_ALLOWED_HOSTS', ['127.0.0.1']).start()
+
+    def tearDown(self):
+        patch.stopall()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_deliver_callback(self):
+        self.assertEqual(deliver_callback(self.url, self.payload, secret=SECRET), 200)
+
+        headers, body = self.server.deliveries[0]
+        self.assertEqual(json.loads(body)['request_result'], {'resource_id': '123'})
+        self.assertTrue(verify_signature(body, headers[TIMESTAMP_HEADER], headers[SIGNATURE_HEADER], SECRET))
+        self.assertFalse(verify_signature(body + b' ', headers[TIMESTAMP_HEADER], headers[SIGNATURE_HEADER], SECRET))
+        self.assertFalse(verify_signature(body, headers[TIMESTAMP_HEADER], headers[SIGNATURE_HEADER], 'other'))
+        self.assertFalse(verify_signature(body, headers[TIMESTAMP_HEADER], headers[SIGNATURE_HEADER], SECRET,
+                                          now=int(headers[TIMESTAMP_HEADER]) + 3600))
+
+    def test_deliver_callback_errors(self):
+        self.server.statuses = [503, 404, 302]
+        for retryable in (True, False, False):
+            with self.assertRaises(CallbackDeliveryError) as cm:
+                deliver_callback(self.url, self.payload, secret=SECRET)
+            self.assertEqual(cm.exception.retryable, retryable)
+        # the redirect is not followed
+        self.assertEqual(len(self.server.deliveries), 3)
+
+    def test_deliver_callback_unreachable(self):
+        # a port that nothing listens on
+        closed = HTTPServer(('127.0.0.1', 0), Receiver)
+        closed.server_close()
+        with self.assertRaises(CallbackDeliveryError) as cm:
+            deliver_callback('http://127.0.0.1:{}/hook'.format(closed.server_port), self.payload,
+                             secret=SECRET, timeout=1)
+        self.assertTrue(cm.exception.retryable)
+
+    def test_deliver_callback_private_address(self):
+        with patch('tfstack_callbacks.CALLBACK_ALLOWED_HOSTS', []):
+            with self.assertRaises(CallbackDeliveryError) as cm:
+                deliver_callback(self.url, self.payload, secret=SECRET)
+        self.assertFalse(cm.exception.retryable)
+        self.assertEqual(self.server.deliveries, [])
+
+    def test_completion_payload(self):
+        payload = completion_payload('abc', 'delete', 'FAILURE', Exception('error:WorkspaceNotExist'), '123')
+        self.assertEqual(payload['request_result'], 'error:WorkspaceNotExist')
+        self.assertEqual(payload['resource_id'], '123')
+
+    @patch('tfstack_callbacks.CALLBACK_ALLOWED_HOSTS', ['hooks.example.com'])
+    @patch('tfstack_callbacks.CALLBACK_SECRET', SECRET)
+    def test_validate_callback_url(self):
+        self.assertIsNone(validate_callback_url(None))
+        self.assertEqual(validate_callback_url('https://hooks.example.com/a'), 'https://hooks.example.com/a')
+        for url in ('ftp://hooks.example.com/a', 'https://other.example.com/a', 'hooks.example.com', 42):
+            with self.assertRaises(InvalidCallback):
+                validate_callback_url(url)
+
+        with patch('tfstack_callbacks.CALLBACK_SECRET', None):
+            with self.assertRaises(InvalidCallback):
+                validate_callback_url('https://hooks.example.com/a')
+
+    @patch('tfstack_callbacks.CALLBACK_ALLOWED_HOSTS', [])
+    @patch('tfstack_callbacks.CALLBACK_SECRET', SECRET)
+    def test_validate_callback_url_private_address(self):
+        for url in ('http://169.254.169.254/latest/meta-data', 'http://10.0.0.1/a', 'http://127.0.0.1/a',
+                    'http://[::1]/a', 'http://[::ffff:192.168.0.1]/a', 'http://localhost/a'):
+            with self.assertRaises(InvalidCallback):
+                validate_callback_url(url)
+
+        with patch('tfstack_callbacks.socket.getaddrinfo') as patch_getaddrinfo:
+            patch_getaddrinfo.return_value = [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('93.184.216.34', 0))]
+            self.assertEqual(validate_callback_url('https://hooks.example.com/a'), 'https://hooks.example.com/a')
+            # a name of a cluster service
+            patch_getaddrinfo.return_value = [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('10.96.0.10', 0))]
+            with self.assertRaises(InvalidCallback):
+                validate_callback_url('http://redis:6379/')
+            patch_getaddrinfo.side_effect = socket.gaierror()
+            with self.assertRaises(InvalidCallback):
+                validate_callback_url('https://unknown.example.com/a')
+
+    @patch('tfstack_callbacks.CALLBACK_ALLOWED_HOSTS', ['127.0.0.1'])
+    @patch('tfstack_callbacks.CALLBACK_SECRET', SECRET)
+    def test_validate_callback_url_allowlisted_private_address(self):
+        self.assertEqual(validate_callback_url('http://127.0.0.1/a'), 'http://127.0.0.1/a')
+
+    @patch('tfstack_callbacks.CALLBACK_MAX_PER_REQUEST', 2)
+    @patch('tfstack_callbacks.get_redis_client')
+    def test_register_callback(self, patch_client):
+        patch_client.return_value.pipeline.return_value.execute.return_value = [1, 2, True]
+        register_callback('abc', self.url)
+
+        patch_client.return_value.pipeline.return_value.execute.return_value = [1, 3, True]
+        with self.assertRaises(InvalidCallback):
+            register_callback('abc', self.url)
+        patch_client.return_value.srem.assert_called_once_with('tfstack:callbacks:abc', self.url)
+
+    @patch('tfstack_callbacks.get_redis_client')
+    def test_pop_callbacks(self, patch_client):
+        patch_client.return_value.pipeline.return_value.execute.return_value = [{b'http://b', b'http://a'}, 1]
+        self.assertEqual(pop_callbacks('abc'), ['http://a', 'http://b'])
+
+    def test_retry_countdown(self):
+        for retries in range(10):
+            self.assertLessEqual(retry_countdown(retries, backoff=5, backoff_max=600), min(600, 5 * 2 ** retries))
+
+    @patch('tfstack_callbacks.CALLBACK_MAX_QUEUED', 10)
+    @patch('tfstack_callbacks.queue_lengths')
+    def test_callback_queue_full(self, patch_queue_lengths):
+        patch_queue_lengths.return_value = {'tfstack.callbacks': 10}
+        self.assertTrue(callback_queue_full())
+        patch_queue_lengths.return_value = {'tfstack.callbacks': 9}
+        self.assertFalse(callback_queue_full())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+from unittest.mock import patch
+
+from tfstack_drift import FINISHED, RUNNING, get_sweep, next_sweep_page, sweep_due
+
+
+class Test_drift_sweep(unittest.TestCase):
+    def test_sweep_due(self):
+        sweep = {'status': FINISHED, 'started_at': 1000.0}
+        self.assertTrue(sweep_due(None, 1000.0, interval=3600))
+        self.assertFalse(sweep_due(sweep, 2000.0, interval=3600))
+        self.assertTrue(sweep_due(sweep, 4600.0, interval=3600))
+        self.assertFalse(sweep_due(dict(sweep, status=RUNNING), 4600.0, interval=3600))
+
+    @patch('tfstack_drift.get_redis_client')
+    def test_get_sweep(self, patch_client):
+        patch_client.return_value.hgetall.return_value = {
+            b'sweep_id': b'abc', b'status': b'running', b'started_at': b'1000.0',
+            b'cursor': b'1500.5', b'batch_id': b'', b'enqueued': b'10', b'checked': b'4'}
+
+        sweep = get_sweep()
+        self.assertEqual(sweep['cursor'], '1500.5')
+        self.assertEqual(sweep['batch_id'], None)
+        self.assertEqual(sweep['finished_at'], None)
+        self.assertEqual((sweep['enqueued'], sweep['checked'], sweep['drifted']), (10, 4, 0))
+
+    @patch('tfstack_drift.get_redis_client')
+    def test_next_sweep_page_skips_recently_checked(self, patch_client):
+        client = patch_client.return_value
+        client.zrangebyscore.side_effect = [
+            [(b'a', 100.0), (b'b', 200.0)],
+            [(b'b', 200.0), (b'c', 300.0), (b'd', 400.0)],
+        ]
+        # 'a' was checked recently, 'b' long ago and 'c' and 'd' never
+        client.pipeline.return_value.execute.side_effect = [[9000.0, 1000.0], [None, None]]
+
+        resource_ids, skipped, cursor = next_sweep_page(None, 10000.0, page_size=2, check_interval=3600)
+        # the page stops at page_size, 'd' is left for the next page
+        self.assertEqual(resource_ids, ['b', 'c'])
+        self.assertEqual(skipped, 1)
+        self.assertEqual(cursor, '300.0 c')
+        self.assertEqual(client.zrangebyscore.call_args_list[0][0][1], '-inf')
+        self.assertEqual(client.zrangebyscore.call_args_list[1][0][1], '200.0')
+
+    @patch('tfstack_drift.get_redis_client')
+    def test_next_sweep_page_same_creation_time(self, patch_client):
+        # stacks created at the same time continue on the next page
+        client = patch_client.return_value
+        client.zrangebyscore.side_effect = [
+            [(b'a', 100.0), (b'b', 100.0)],
+            [(b'c', 100.0)],
+            [],
+        ]
+        client.pipeline.return_value.execute.return_value = [None]
+
+        self.assertEqual(next_sweep_page('100.0 b', 10000.0, page_size=2, check_interval=3600),
+                         (['c'], 0, '100.0 c'))
+        self.assertEqual([args[1]['start'] for args in client.zrangebyscore.call_args_list], [0, 2, 3])
+
+    @patch('tfstack_drift.get_redis_client')
+    def test_next_sweep_page_done(self, patch_client):
+        client = patch_client.return_value
+        client.zrangebyscore.side_effect = [[(b'a', 100.0)], []]
+        client.pipeline.return_value.execute.return_value = [9000.0]
+
+        self.assertEqual(next_sweep_page('50.0', 10000.0, check_interval=3600), ([], 1, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
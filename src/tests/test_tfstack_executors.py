@@ -5,7 +5,8 @@ import subprocess
 
 from unittest.mock import Mock, patch
 
-from tfstack_executors import parse_process_output, grep_script_error, grep_resource_id, create_tf_stack, delete_tf_stack, read_tf_stack
+from tfstack_executors import parse_process_output, grep_script_error, grep_resource_id, create_tf_stack, delete_tf_stack, read_tf_stack, list_tf_stacks, \
+    parse_resource_address, plan_tf_stack, script_env, drift_tf_stack
 
 
 class Test_executors_process(unittest.TestCase):
@@ -28,8 +29,11 @@ class Test_executors_process(unittest.TestCase):
         # We have to rewind to the beginning of the file for the next reading
         self.stdout_mock.seek(0)
 
-        expected_process_output = [
-            'mocked stdout line 1', 'mocked stdout line 2']
+        expected_process_outcome = {
+            'resource_id': None,
+            'script_error': None,
+            'tail': ['mocked stdout line 1', 'mocked stdout line 2'],
+        }
 
         # The fake standard stream attribute is set here
         patch_popen.return_value.stdout = self.stdout_mock
@@ -41,8 +45,32 @@ class Test_executors_process(unittest.TestCase):
                                    stdout=subprocess.PIPE)
 
         # Run your test(s) !
-        process_output_list = parse_process_output(process)
-        self.assertEqual(process_output_list, expected_process_output)
+        process_outcome = parse_process_output(process)
+        self.assertEqual(process_outcome, expected_process_outcome)
+
+    @patch('subprocess.Popen')
+    def test_parse_process_output_single_pass(self, patch_popen):
+        self.stdout_mock.write(b'error:WorkspaceNotExist\n')
+        self.stdout_mock.write(b'resource_id "123"\n')
+        self.stdout_mock.write(b'mocked stdout line 1\n')
+        self.stdout_mock.write(b'mocked stdout line 2\n')
+        self.stdout_mock.seek(0)
+
+        patch_popen.return_value.stdout = self.stdout_mock
+
+        process = subprocess.Popen('./create_tfstack.sh',
+                                   shell=True,
+                                   executable='/bin/sh',
+                                   stdout=subprocess.PIPE)
+
+        process_outcome = parse_process_output(
+            process, script_errors=['error:WorkspaceNotExist'],
+            resource_id_grep_pattern='resource_id', tail_size=2)
+        self.assertEqual(process_outcome, {
+            'resource_id': '123',
+            'script_error': 'error:WorkspaceNotExist',
+            'tail': ['mocked stdout line 1', 'mocked stdout line 2'],
+        })
 
     @patch('subprocess.Popen')
     def test_create_tf_stack(self, patch_popen):
@@ -61,6 +89,42 @@ class Test_executors_process(unittest.TestCase):
         self.assertEqual(create_tf_stack('some_dir'), {
                          'message': 'TFstack created succesfully', 'resource_id': '123'})
 
+    @patch('subprocess.Popen')
+    def test_create_tf_stack_variables(self, patch_popen):
+        self.stdout_mock.write(b'resource_id "123"\n')
+        self.stdout_mock.seek(0)
+        patch_popen.return_value.stdout = self.stdout_mock
+        patch_popen.return_value.returncode = 0
+
+        create_tf_stack('some_dir', variables={'cidr': '10.0.0.0/16'})
+        self.assertEqual(patch_popen.call_args[1]['env']['TF_VAR_cidr'], '10.0.0.0/16')
+
+    @patch('subprocess.Popen')
+    def test_create_tf_stack_initialized_workdir(self, patch_popen):
+        self.stdout_mock.write(b'resource_id "123"\n')
+        self.stdout_mock.seek(0)
+        patch_popen.return_value.stdout = self.stdout_mock
+        patch_popen.return_value.returncode = 0
+
+        # a warm working directory, the script skips its init
+        with patch('tfstack_executors.workdir_initialized', return_value=True):
+            create_tf_stack('some_dir')
+        self.assertEqual(patch_popen.call_args[1]['env']['TF_WORKDIR_INITIALIZED'], '1')
+
+    @patch('subprocess.Popen')
+    def test_create_tf_stack_on_line(self, patch_popen):
+        self.stdout_mock.write(b'mocked stdout line 1\n')
+        self.stdout_mock.write(b'resource_id "123"\n')
+        self.stdout_mock.seek(0)
+
+        patch_popen.return_value.stdout = self.stdout_mock
+        patch_popen.return_value.returncode = 0
+
+        published_lines = list()
+        create_tf_stack('some_dir', on_line=published_lines.append)
+        self.assertEqual(published_lines, [
+                         'mocked stdout line 1', 'resource_id "123"'])
+
     @patch('subprocess.Popen')
     def test_create_tf_stack_scripterror(self, patch_popen):
 
@@ -122,6 +186,7 @@ class Test_executors_process(unittest.TestCase):
     def test_read_tf_stack(self, patch_popen):
         # We store some data into the fake pipe here
         self.stdout_mock.write(b'mocked stdout line 1\n')
+        self.stdout_mock.write(b'module.network.aws_subnet.private[0]\n')
 
         # We have to rewind to the beginning of the file for the next reading
         self.stdout_mock.seek(0)
@@ -132,7 +197,8 @@ class Test_executors_process(unittest.TestCase):
 
         self.assertEqual(read_tf_stack('some_dir', '123'), {
             'message': "TFstack read succesfully",
-            'content': ['mocked stdout line 1'],
+            'resources': [{'address': 'module.network.aws_subnet.private[0]', 'module': 'module.network',
+                           'mode': 'managed', 'type': 'aws_subnet', 'name': 'private', 'index': 0}],
         })
 
     @patch('subprocess.Popen')
@@ -155,6 +221,85 @@ class Test_executors_process(unittest.TestCase):
             str(cm.exception)
         )
 
+    @patch('subprocess.Popen')
+    def test_list_tf_stacks(self, patch_popen):
+        self.stdout_mock.write(b'  default\n')
+        self.stdout_mock.write(b'* 123\n')
+        self.stdout_mock.write(b'  456\n')
+        self.stdout_mock.seek(0)
+
+        patch_popen.return_value.stdout = self.stdout_mock
+        patch_popen.return_value.returncode = 0
+
+        self.assertEqual(list_tf_stacks('some_dir'), {
+            'message': "TFstacks listed succesfully",
+            'resource_ids': ['123', '456'],
+        })
+
+    @patch('subprocess.Popen')
+    def test_plan_tf_stack_changes(self, patch_popen):
+        self.stdout_mock.write(b'Terraform will perform the following actions:\n')
+        self.stdout_mock.write(b'Plan: 1 to add, 2 to change, 0 to destroy.\n')
+        self.stdout_mock.seek(0)
+
+        patch_popen.return_value.stdout = self.stdout_mock
+        patch_popen.return_value.returncode = 2
+
+        self.assertEqual(plan_tf_stack('some_dir', '123'), {
+            'message': "TFstack planned succesfully",
+            'changes': True,
+            'summary': {'add': 1, 'change': 2, 'destroy': 0},
+        })
+
+    @patch('subprocess.Popen')
+    def test_plan_tf_stack_no_changes(self, patch_popen):
+        self.stdout_mock.write(b'No changes. Your infrastructure matches the configuration.\n')
+        self.stdout_mock.seek(0)
+
+        patch_popen.return_value.stdout = self.stdout_mock
+        patch_popen.return_value.returncode = 0
+
+        self.assertEqual(plan_tf_stack('some_dir', '123')['changes'], False)
+
+    @patch('subprocess.Popen')
+    def test_plan_tf_stack_error(self, patch_popen):
+        self.stdout_mock.write(b'error:WorkspaceNotExist\n')
+        self.stdout_mock.seek(0)
+
+        patch_popen.return_value.stdout = self.stdout_mock
+        patch_popen.return_value.returncode = 1
+
+        with self.assertRaises(Exception) as cm:
+            plan_tf_stack('some_dir', '123')
+        self.assertEqual('error:WorkspaceNotExist', str(cm.exception))
+
+
+    @patch('subprocess.Popen')
+    def test_drift_tf_stack(self, patch_popen):
+        self.stdout_mock.write(b'Note: Objects have changed outside of Terraform\n')
+        self.stdout_mock.write(b'  # aws_instance.this has changed\n')
+        self.stdout_mock.write(b'  # module.network.aws_subnet.private[0] has been deleted\n')
+        self.stdout_mock.seek(0)
+        patch_popen.return_value.stdout = self.stdout_mock
+        patch_popen.return_value.returncode = 2
+
+        self.assertEqual(drift_tf_stack('some_dir', '123'), {
+            'message': 'TFstack drift checked succesfully',
+            'drifted': True,
+            'resources': [
+                {'address': 'aws_instance.this', 'change': 'changed'},
+                {'address': 'module.network.aws_subnet.private[0]', 'change': 'deleted'},
+            ]})
+
+    @patch('subprocess.Popen')
+    def test_drift_tf_stack_in_sync(self, patch_popen):
+        self.stdout_mock.write(b'No changes. Your infrastructure still matches the configuration.\n')
+        self.stdout_mock.seek(0)
+        patch_popen.return_value.stdout = self.stdout_mock
+        patch_popen.return_value.returncode = 0
+
+        self.assertEqual(drift_tf_stack('some_dir', '123')['drifted'], False)
+
 
 class Test_executors_other(unittest.TestCase):
     def test_grep_script_error_match(self):
@@ -179,6 +324,29 @@ class Test_executors_other(unittest.TestCase):
             process_output=process_output, resource_id_grep_pattern='resource_id')
         self.assertEqual(found_resource_id, None)
 
+    def test_parse_resource_address(self):
+        self.assertEqual(parse_resource_address('module.a["x"].data.aws_ami.ubuntu'), {
+            'address': 'module.a["x"].data.aws_ami.ubuntu', 'module': 'module.a["x"]',
+            'mode': 'data', 'type': 'aws_ami', 'name': 'ubuntu', 'index': None})
+        self.assertEqual(parse_resource_address('aws_iam_role.this["a.b"]')['index'], 'a.b')
+
+    def test_script_env(self):
+        self.assertEqual(script_env(None), None)
+        env = script_env({'name': 'web', 'count': 2, 'public': True, 'tags': {'team': 'a'}})
+        self.assertEqual(env['TF_VAR_name'], 'web')
+        self.assertEqual(env['TF_VAR_count'], '2')
+        self.assertEqual(env['TF_VAR_public'], 'true')
+        self.assertEqual(env['TF_VAR_tags'], '{"team": "a"}')
+        self.assertEqual(env['PATH'], os.environ['PATH'])
+        self.assertNotIn('TF_WORKDIR_INITIALIZED', env)
+
+        env = script_env(None, initialized=True)
+        self.assertEqual(env['TF_WORKDIR_INITIALIZED'], '1')
+
+    def test_parse_resource_address_no_address(self):
+        self.assertEqual(parse_resource_address('Initializing the backend...'), None)
+        self.assertEqual(parse_resource_address('module.a.b'), None)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+
+from unittest.mock import call, patch
+from redis.exceptions import ConnectionError
+
+from tfstack_inventory import get_stack_spec, list_stacks, reconcile_inventory, record_stack, remove_stack
+
+
+class Test_inventory(unittest.TestCase):
+    @patch('tfstack_inventory.time.time', return_value=2000.0)
+    @patch('tfstack_inventory.get_redis_client')
+    def test_record_stack(self, patch_client, patch_time):
+        # a stack that is recorded again keeps its creation time
+        patch_client.return_value.hget.return_value = b'1000.0'
+
+        record_stack('123', 'present', template='small', variables={'size': 2})
+        pipeline = patch_client.return_value.pipeline.return_value
+        self.assertEqual(pipeline.hset.call_args[1]['mapping'], {
+            'resource_id': '123', 'created_at': 1000.0, 'updated_at': 2000.0, 'state': 'present',
+            'template': 'small', 'variables': '{"size": 2}'})
+        pipeline.zadd.assert_has_calls([call('tfstack:inventory', {'123': 1000.0}),
+                                        call('tfstack:inventory:state:present', {'123': 1000.0})])
+        pipeline.zrem.assert_has_calls([call('tfstack:inventory:state:created', '123'),
+                                        call('tfstack:inventory:state:reconciled', '123')])
+
+    @patch('tfstack_inventory.get_redis_client')
+    def test_record_stack_redis_unavailable(self, patch_client):
+        patch_client.return_value.hget.side_effect = ConnectionError()
+
+        record_stack('123', 'created')
+
+    @patch('tfstack_inventory.get_redis_client')
+    def test_remove_stack(self, patch_client):
+        remove_stack('123')
+        pipeline = patch_client.return_value.pipeline.return_value
+        pipeline.delete.assert_called_once_with('tfstack:inventory:stack:123')
+        self.assertEqual(pipeline.zrem.call_count, 4)
+
+    @patch('tfstack_inventory.get_redis_client')
+    def test_get_stack_spec(self, patch_client):
+        patch_client.return_value.hmget.return_value = [b'small', b'{"size": 2}']
+        self.assertEqual(get_stack_spec('123'), ('small', {'size': 2}))
+
+        patch_client.return_value.hmget.return_value = [None, None]
+        self.assertEqual(get_stack_spec('123'), (None, None))
+
+        patch_client.return_value.hmget.side_effect = ConnectionError()
+        self.assertEqual(get_stack_spec('123'), (None, None))
+
+    @patch('tfstack_inventory.INVENTORY_MAX_LIMIT', 50)
+    @patch('tfstack_inventory.get_redis_client')
+    def test_list_stacks(self, patch_client):
+        pipeline = patch_client.return_value.pipeline.return_value
+        pipeline.execute.side_effect = [
+            [2, [b'123', b'456']],
+            [{b'resource_id': b'123', b'created_at': b'1000.0', b'updated_at': b'2000.0', b'state': b'created',
+              b'variables': b'{"password": "secret"}'}, {}],
+        ]
+
+        stacks = list_stacks(offset=10, limit=500, state='created', created_after=900.0)
+        pipeline.zrangebyscore.assert_called_once_with('tfstack:inventory:state:created', 900.0, '+inf',
+                                                       start=10, num=50)
+        # the variables are not listed, a stack removed in between is skipped
+        self.assertEqual(stacks, {'total': 2, 'stacks': [
+            {'resource_id': '123', 'created_at': 1000.0, 'updated_at': 2000.0, 'state': 'created'}]})
+
+    @patch('tfstack_inventory.get_redis_client')
+    def test_list_stacks_invalid_page(self, patch_client):
+        for offset, limit in ((0, -1), (0, 0), (-1, 10)):
+            with self.assertRaises(ValueError):
+                list_stacks(offset=offset, limit=limit)
+        patch_client.return_value.pipeline.assert_not_called()
+
+    @patch('tfstack_inventory.record_stack')
+    @patch('tfstack_inventory.remove_stack')
+    @patch('tfstack_inventory.get_redis_client')
+    def test_reconcile_inventory(self, patch_client, patch_remove, patch_record):
+        # '456' is gone, '789' was recorded after the workspaces were listed
+        patch_client.return_value.zrange.return_value = [(b'123', 1000.0), (b'456', 1000.0), (b'789', 5000.0)]
+
+        self.assertEqual(reconcile_inventory(['123', 'abc'], started_at=4000.0), {'added': ['abc'], 'removed': ['456']})
+        patch_record.assert_called_once_with('abc', 'reconciled')
+        patch_remove.assert_called_once_with('456')
+
+
+if __name__ == '__main__':
+    unittest.main()
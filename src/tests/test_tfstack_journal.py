@@ -0,0 +1,105 @@
+import json
+import time
+import unittest
+
+from unittest.mock import patch
+
+from tfstack_journal import ExecutionInProgress, TaskJournal
+
+
+class Test_journal(unittest.TestCase):
+    @patch('tfstack_journal.get_redis_client')
+    def test_start_first_execution(self, patch_client):
+        patch_client.return_value.hgetall.return_value = {}
+
+        journal = TaskJournal('task-1', 'create')
+        self.assertEqual(journal.start(), None)
+        self.assertFalse(journal.interrupted)
+
+        fields = patch_client.return_value.pipeline.return_value.hset.call_args[1]['mapping']
+        self.assertEqual(fields['status'], 'started')
+        self.assertEqual(fields['interruptions'], 0)
+
+    @patch('tfstack_journal.get_redis_client')
+    def test_start_interrupted_execution(self, patch_client):
+        patch_client.return_value.hgetall.return_value = {
+            b'operation': b'create', b'status': b'started', b'stage': b'apply',
+            b'resource_id': b'123', b'interruptions': b'0', b'output_offset': b'150',
+        }
+
+        journal = TaskJournal('task-1', 'create')
+        previous = journal.start()
+        self.assertTrue(journal.interrupted)
+        self.assertEqual(previous['stage'], 'apply')
+        self.assertEqual(journal.resource_id, '123')
+        self.assertEqual(journal.output_offset, 150)
+
+    @patch('tfstack_journal.time.time', return_value=1100.0)
+    @patch('tfstack_journal.get_redis_client')
+    def test_start_running_execution(self, patch_client, patch_time):
+        # a duplicate delivery while the execution still runs, its heartbeat is recent
+        patch_client.return_value.hgetall.return_value = {
+            b'operation': b'create', b'status': b'started', b'owner': b'worker-1:42', b'updated_at': b'1000.0',
+        }
+
+        with self.assertRaises(ExecutionInProgress):
+            TaskJournal('task-1', 'create').start()
+        patch_client.return_value.pipeline.assert_not_called()
+
+        # no heartbeat for longer than JOURNAL_HEARTBEAT_TIMEOUT, the worker was lost
+        patch_time.return_value = 1200.0
+        journal = TaskJournal('task-1', 'create')
+        journal.start()
+        self.assertTrue(journal.interrupted)
+
+    @patch('tfstack_journal.get_redis_client')
+    def test_heartbeat(self, patch_client):
+        hset = patch_client.return_value.pipeline.return_value.hset
+
+        with TaskJournal('task-1', 'create').heartbeat(interval=0.01):
+            time.sleep(0.1)
+        beats = hset.call_count
+        self.assertGreater(beats, 2)
+        self.assertIn('updated_at', hset.call_args[1]['mapping'])
+        time.sleep(0.05)
+        self.assertEqual(hset.call_count, beats)
+
+    @patch('tfstack_journal.JOURNAL_MAX_INTERRUPTIONS', 1)
+    @patch('tfstack_journal.get_redis_client')
+    def test_start_interrupted_too_often(self, patch_client):
+        patch_client.return_value.hgetall.return_value = {
+            b'operation': b'create', b'status': b'started', b'interruptions': b'1',
+        }
+
+        with self.assertRaises(Exception):
+            TaskJournal('task-1', 'create').start()
+
+    @patch('tfstack_journal.get_redis_client')
+    def test_start_finished_execution(self, patch_client):
+        result = {'message': "TFstack created succesfully", 'resource_id': '123'}
+        patch_client.return_value.hgetall.return_value = {
+            b'operation': b'create', b'status': b'finished', b'result': json.dumps(result).encode('utf8'),
+        }
+
+        journal = TaskJournal('task-1', 'create')
+        self.assertEqual(journal.start()['result'], result)
+        self.assertFalse(journal.interrupted)
+        patch_client.return_value.pipeline.assert_not_called()
+
+    @patch('tfstack_journal.JOURNAL_OFFSET_INTERVAL', 2)
+    @patch('tfstack_journal.get_redis_client')
+    def test_on_line_writes_stage_changes_and_offset_interval(self, patch_client):
+        hset = patch_client.return_value.pipeline.return_value.hset
+
+        journal = TaskJournal('task-1', 'create')
+        journal.on_line('Initializing the backend...', 'init')
+        journal.on_line('Initializing provider plugins...', 'init')
+        journal.on_line('Initializing provider plugins...', 'init')
+
+        self.assertEqual(hset.call_count, 2)
+        self.assertEqual(hset.call_args_list[0][1]['mapping']['stage'], 'init')
+        self.assertEqual(hset.call_args_list[1][1]['mapping']['output_offset'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
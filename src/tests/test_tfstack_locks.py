@@ -0,0 +1,56 @@
+import time
+import unittest
+
+from unittest.mock import MagicMock, patch
+from redis.exceptions import ConnectionError, LockNotOwnedError
+
+from tfstack_locks import claim_inflight_request, renewed_lock
+
+
+class Test_inflight_requests(unittest.TestCase):
+    @patch('tfstack_locks.get_redis_client')
+    def test_claim_inflight_request_new(self, patch_client):
+        patch_client.return_value.set.return_value = True
+
+        self.assertEqual(claim_inflight_request(
+            'read_tf_stack_task', '123', 'request-1'), ('request-1', True))
+
+    @patch('tfstack_locks.get_redis_client')
+    def test_claim_inflight_request_coalesced(self, patch_client):
+        patch_client.return_value.set.return_value = None
+        patch_client.return_value.get.return_value = b'request-0'
+
+        self.assertEqual(claim_inflight_request(
+            'read_tf_stack_task', '123', 'request-1'), ('request-0', False))
+        patch_client.return_value.get.assert_called_with(
+            'tfstack:inflight:read_tf_stack_task:123')
+
+
+class Test_stack_lock(unittest.TestCase):
+    def test_renewed_lock(self):
+        # the lock is renewed while the operation runs, past its expiry
+        lock = MagicMock()
+
+        def reacquire():
+            # redis is unavailable for a moment
+            if lock.reacquire.call_count == 2:
+                raise ConnectionError()
+            return True
+        lock.reacquire.side_effect = reacquire
+        with renewed_lock(lock, interval=0.01):
+            time.sleep(0.1)
+        renewals = lock.reacquire.call_count
+        self.assertGreater(renewals, 2)
+        time.sleep(0.05)
+        self.assertEqual(lock.reacquire.call_count, renewals)
+
+    def test_renewed_lock_lost(self):
+        lock = MagicMock()
+        lock.reacquire.side_effect = LockNotOwnedError()
+        with renewed_lock(lock, interval=0.01):
+            time.sleep(0.1)
+        lock.reacquire.assert_called_once_with()
+
+
+if __name__ == '__main__':
+    unittest.main()
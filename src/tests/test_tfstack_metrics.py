@@ -0,0 +1,32 @@
+import unittest
+
+from prometheus_client import REGISTRY
+
+from tfstack_metrics import StageTimer
+
+
+class Test_stage_timer(unittest.TestCase):
+    def stage_count(self, stage):
+        return REGISTRY.get_sample_value('tfstack_executor_stage_duration_seconds_count',
+                                         {'operation': 'test', 'stage': stage}) or 0
+
+    def test_stage_timer(self):
+        counts = {stage: self.stage_count(stage)
+                  for stage in ('init', 'plan', 'apply')}
+
+        stage_timer = StageTimer('test')
+        for line in ['Initializing the backend...',
+                     'Initializing provider plugins...',
+                     'Terraform will perform the following actions:',
+                     'aws_instance.this: Creating...',
+                     'aws_instance.this: Creating...',
+                     'Apply complete! Resources: 1 added, 0 changed, 0 destroyed.']:
+            stage_timer.on_line(line)
+        stage_timer.finish()
+
+        for stage in ('init', 'plan', 'apply'):
+            self.assertEqual(self.stage_count(stage), counts[stage] + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from unittest.mock import patch
+
+from tfstack_plans import config_revision, get_cached_plan, set_cached_plan
+
+
+class Test_config_revision(unittest.TestCase):
+    def setUp(self):
+        self.tf_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.tf_dir, 'main.tf'), 'w') as f:
+            f.write('resource "aws_instance" "this" {}\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tf_dir)
+
+    def test_config_revision_changes_with_content(self):
+        revision = config_revision(self.tf_dir)
+        self.assertEqual(config_revision(self.tf_dir), revision)
+
+        with open(os.path.join(self.tf_dir, 'main.tf'), 'a') as f:
+            f.write('output "resource_id" {}\n')
+        self.assertNotEqual(config_revision(self.tf_dir), revision)
+
+    def test_config_revision_ignores_terraform_dir(self):
+        revision = config_revision(self.tf_dir)
+        os.makedirs(os.path.join(self.tf_dir, '.terraform'))
+        with open(os.path.join(self.tf_dir, '.terraform', 'plugin'), 'w') as f:
+            f.write('binary')
+
+        self.assertEqual(config_revision(self.tf_dir), revision)
+
+
+class Test_plan_cache(unittest.TestCase):
+    plan = {'message': "TFstack planned succesfully", 'changes': False,
+            'summary': {'add': 0, 'change': 0, 'destroy': 0}}
+
+    @patch('tfstack_plans.get_redis_client')
+    def test_get_cached_plan_same_revision(self, patch_client):
+        patch_client.return_value.get.return_value = json.dumps(
+            {'revision': 'abc', 'plan': self.plan})
+
+        self.assertEqual(get_cached_plan('123', 'abc'), self.plan)
+        patch_client.return_value.get.assert_called_with('tfstack:plan:123')
+
+    @patch('tfstack_plans.get_redis_client')
+    def test_get_cached_plan_other_revision(self, patch_client):
+        patch_client.return_value.get.return_value = json.dumps(
+            {'revision': 'abc', 'plan': self.plan})
+
+        self.assertEqual(get_cached_plan('123', 'def'), None)
+
+    @patch('tfstack_plans.PLAN_CACHE_TTL', 60)
+    @patch('tfstack_plans.get_redis_client')
+    def test_set_cached_plan(self, patch_client):
+        set_cached_plan('123', 'abc', self.plan)
+
+        patch_client.return_value.setex.assert_called_with(
+            'tfstack:plan:123', 60, json.dumps({'revision': 'abc', 'plan': self.plan}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import json
+import time
+import unittest
+
+from unittest.mock import patch
+
+from tfstack_queues import PRIORITY_STEPS, oldest_message_ages, task_throughput, get_backlog
+
+
+def message(published_at):
+    return json.dumps({'body': '', 'headers': {'tfstack_published_at': published_at}}).encode('utf8')
+
+
+class Test_queues(unittest.TestCase):
+    @patch('tfstack_queues.get_broker_client')
+    def test_oldest_message_ages(self, patch_client):
+        now = time.time()
+        messages = [None] * len(PRIORITY_STEPS)
+        messages[0] = message(now - 10)
+        messages[5] = message(now - 30)
+        patch_client.return_value.pipeline.return_value.execute.return_value = messages + \
+            [None] * len(PRIORITY_STEPS)
+
+        ages = oldest_message_ages(['tfstack.create', 'tfstack.read'])
+        self.assertAlmostEqual(ages['tfstack.create'], 30, delta=1)
+        self.assertEqual(ages['tfstack.read'], None)
+
+    @patch('tfstack_queues.get_redis_client')
+    def test_task_throughput(self, patch_client):
+        buckets = 900 // 60
+        counters = [[None, None]] * (6 * buckets)
+        counters[0] = [b'3', b'600.0']
+        counters[1] = [b'1', b'300.0']
+        patch_client.return_value.pipeline.return_value.execute.return_value = counters
+
+        self.assertEqual(task_throughput(window=900), {
+            'create': {'tasks_per_minute': 4 * 60.0 / 900, 'average_task_duration': 225.0},
+            'read': {'tasks_per_minute': 0.0, 'average_task_duration': None},
+            'delete': {'tasks_per_minute': 0.0, 'average_task_duration': None},
+            'update': {'tasks_per_minute': 0.0, 'average_task_duration': None},
+            'drift': {'tasks_per_minute': 0.0, 'average_task_duration': None},
+            'callback': {'tasks_per_minute': 0.0, 'average_task_duration': None},
+        })
+
+    @patch('tfstack_queues.task_throughput')
+    @patch('tfstack_queues.oldest_message_ages')
+    @patch('tfstack_queues.queue_lengths')
+    @patch('tfstack_queues.get_broker_client')
+    def test_get_backlog(self, patch_client, patch_lengths, patch_ages, patch_throughput):
+        patch_lengths.return_value = {'tfstack.create': 6, 'tfstack.read': 0, 'tfstack.delete': 2,
+                                      'tfstack.update': 0, 'tfstack.drift': 0, 'tfstack.callbacks': 0}
+        patch_ages.return_value = {'tfstack.create': 120.0, 'tfstack.delete': 20.0}
+        patch_throughput.return_value = {
+            'create': {'tasks_per_minute': 2.0, 'average_task_duration': 240.0},
+            'read': {'tasks_per_minute': 0.0, 'average_task_duration': None},
+            'delete': {'tasks_per_minute': 0.0, 'average_task_duration': None},
+            'update': {'tasks_per_minute': 0.0, 'average_task_duration': None},
+            'drift': {'tasks_per_minute': 0.0, 'average_task_duration': None},
+            'callback': {'tasks_per_minute': 0.0, 'average_task_duration': None},
+        }
+
+        backlog = get_backlog(['tfstack.create', 'tfstack.delete'])
+        self.assertEqual(backlog['total'], {'length': 8, 'oldest_message_age': 120.0})
+        self.assertEqual(backlog['queues']['tfstack.create']['estimated_drain_time'], 180.0)
+        self.assertEqual(backlog['queues']['tfstack.delete']['estimated_drain_time'], None)
+        self.assertNotIn('tfstack.read', backlog['queues'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+from unittest.mock import patch
+from redis.exceptions import ConnectionError
+
+import tfstack_ratelimit
+from tfstack_ratelimit import CostExceedsRateLimit, RateLimited, client_key, parse_rate_limit, take_tokens, check_queued_tasks
+
+
+class Test_rate_limits(unittest.TestCase):
+    def test_parse_rate_limit(self):
+        self.assertEqual(parse_rate_limit('20/60'), (20, 20 / 60.0))
+        self.assertEqual(parse_rate_limit('0'), None)
+        self.assertEqual(parse_rate_limit(''), None)
+
+    @patch('tfstack_ratelimit.API_KEYS', frozenset(['secret']))
+    def test_client_key(self):
+        self.assertEqual(client_key(None, '10.0.0.1'), 'addr:10.0.0.1')
+        self.assertTrue(client_key('secret', '10.0.0.1').startswith('key:'))
+        self.assertNotIn('secret', client_key('secret', '10.0.0.1'))
+        # a key that is not known doesn't get a bucket of its own
+        self.assertEqual(client_key('made-up', '10.0.0.1'), 'addr:10.0.0.1')
+
+    @patch('tfstack_ratelimit.get_redis_client')
+    def test_take_tokens_admitted(self, patch_client):
+        patch_client.return_value.eval.return_value = [1, 0]
+
+        self.assertTrue(take_tokens('addr:10.0.0.1', 'create'))
+        self.assertEqual(patch_client.return_value.eval.call_args[0][2],
+                         'tfstack:ratelimit:create:addr:10.0.0.1')
+
+    @patch('tfstack_ratelimit.get_redis_client')
+    def test_take_tokens_rate_limited(self, patch_client):
+        patch_client.return_value.eval.return_value = [0, 2500]
+
+        with self.assertRaises(RateLimited) as cm:
+            take_tokens('addr:10.0.0.1', 'create')
+        self.assertEqual(cm.exception.retry_after, 3)
+
+    @patch('tfstack_ratelimit.RATE_LIMITS', {'create': '20/60'})
+    @patch('tfstack_ratelimit.get_redis_client')
+    def test_take_tokens_exceeds_capacity(self, patch_client):
+        # a batch larger than the bucket would never be admitted
+        with self.assertRaises(CostExceedsRateLimit):
+            take_tokens('addr:10.0.0.1', 'create', cost=21)
+        patch_client.return_value.eval.assert_not_called()
+
+    @patch('tfstack_ratelimit.get_redis_client')
+    def test_take_tokens_redis_unavailable(self, patch_client):
+        patch_client.return_value.eval.side_effect = ConnectionError()
+
+        self.assertTrue(take_tokens('addr:10.0.0.1', 'create'))
+
+    @patch('tfstack_ratelimit.MAX_QUEUED_TASKS', 10)
+    @patch('tfstack_ratelimit.pending_batch_items', return_value=3)
+    @patch('tfstack_ratelimit.queue_lengths')
+    def test_check_queued_tasks(self, patch_lengths, patch_pending):
+        # the callbacks don't count, the pending items of the batches do
+        patch_lengths.return_value = {'tfstack.create': 5, 'tfstack.read': 1, 'tfstack.callbacks': 100}
+
+        with patch.dict(tfstack_ratelimit._queue_depth, {'checked_at': 0.0}):
+            check_queued_tasks(1)
+            with self.assertRaises(RateLimited):
+                check_queued_tasks(2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from tfstack_readiness import clear_ready, get_readiness, mark_ready, process_start_time, wait_until
+
+
+class Test_readiness(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'ready')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_mark_ready(self):
+        self.assertIsNone(get_readiness(self.path))
+
+        cold_start = mark_ready(time.time() - 2, True, self.path)
+        readiness = get_readiness(self.path)
+
+        self.assertGreaterEqual(cold_start, 2)
+        self.assertEqual(readiness['cold_start_seconds'], cold_start)
+        self.assertTrue(readiness['warm'])
+        self.assertEqual(os.listdir(self.tmp_dir), ['ready'])
+
+        clear_ready(self.path)
+        self.assertIsNone(get_readiness(self.path))
+        clear_ready(self.path)
+
+    def test_process_start_time(self):
+        started_at = process_start_time()
+        self.assertLessEqual(started_at, time.time())
+        self.assertGreater(started_at, time.time() - 24 * 3600)
+
+    def test_wait_until(self):
+        checks = []
+
+        def condition():
+            checks.append(1)
+            return len(checks) == 3
+
+        self.assertTrue(wait_until(condition, 5, interval=0.01))
+        self.assertFalse(wait_until(lambda: False, 0.05, interval=0.01))
+
+
+if __name__ == '__main__':
+    unittest.main()
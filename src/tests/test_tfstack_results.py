@@ -0,0 +1,95 @@
+import unittest
+
+from unittest.mock import patch
+
+from tfstack_results import claim_result_compaction, compact_result, dumps, expire_result, get_memory_usage, loads, \
+    memory_usage, select_fields
+
+
+class Test_results(unittest.TestCase):
+    def test_dumps_loads(self):
+        result = {'message': "TFstack read succesfully", 'resources': [{'index': 0}]}
+        encoded = dumps(result, compression_threshold=1024)
+
+        self.assertEqual(encoded[:1], b'\x00')
+        self.assertEqual(loads(encoded), result)
+
+    def test_dumps_loads_compressed(self):
+        result = {'resources': ['aws_instance.this'] * 1000}
+        encoded = dumps(result, compression_threshold=1024)
+
+        self.assertEqual(encoded[:1], b'\x01')
+        self.assertLess(len(encoded), 1024)
+        self.assertEqual(loads(encoded), result)
+
+    def test_loads_unknown_encoding(self):
+        with self.assertRaises(Exception):
+            loads(b'\x02\x81\xa4json\xc3')
+
+    def test_loads_json_result(self):
+        # a result as the json serializer stored it before the upgrade
+        stored = b'{"status": "SUCCESS", "result": {"message": "TFstack created succesfully", "resource_id": "123"}, ' \
+                 b'"traceback": null, "children": [], "date_done": "2021-09-19T12:00:00.000000", ' \
+                 b'"task_id": "9b1f2c4e-0d0a-4c59-9a1e-2f4b1d7c8e6a"}'
+
+        meta = loads(stored)
+        self.assertEqual(meta['status'], 'SUCCESS')
+        self.assertEqual(meta['result'], {'message': "TFstack created succesfully", 'resource_id': '123'})
+
+    def test_select_fields(self):
+        document = {'request_id': '1', 'request_status': 'SUCCESS',
+                    'request_result': {'message': 'foo', 'resources': []}}
+
+        self.assertEqual(select_fields(document, ['request_status', 'request_result.resources', 'unknown.field']), {
+            'request_status': 'SUCCESS', 'request_result': {'resources': []}})
+
+
+    def test_compact_result(self):
+        result = {'message': "TFstack read succesfully", 'resources': [{'index': 0}, {'index': 1}]}
+        compacted = compact_result(result)
+
+        self.assertEqual(compacted, {'message': "TFstack read succesfully", 'resources_count': 2, 'compacted': True})
+        self.assertIsNone(compact_result(compacted))
+        self.assertIsNone(compact_result({'message': "TFstack created succesfully", 'resource_id': '123'}))
+        self.assertIsNone(compact_result("error:WorkspaceNotExist"))
+
+    @patch('tfstack_results.get_redis_client')
+    def test_claim_result_compaction(self, patch_client):
+        patch_client.return_value.set.return_value = True
+        self.assertTrue(claim_result_compaction('abc', {'resources': []}))
+        self.assertEqual(patch_client.return_value.set.call_args[1]['nx'], True)
+
+        patch_client.return_value.set.return_value = None
+        self.assertFalse(claim_result_compaction('abc', {'resources': []}))
+        self.assertFalse(claim_result_compaction('abc', {'message': 'foo'}))
+
+    @patch('tfstack_results.RESULT_EXPIRES_PER_OPERATION', {'read': 3600, 'create': 86400})
+    @patch('tfstack_results.RESULT_EXPIRES', 86400)
+    @patch('tfstack_results.get_results_client')
+    def test_expire_result(self, patch_client):
+        expire_result('abc', 'read')
+        patch_client.return_value.expire.assert_called_once_with('celery-task-meta-abc', 3600)
+
+        expire_result('def', 'create')
+        expire_result('ghi', 'reconcile')
+        self.assertEqual(patch_client.return_value.expire.call_count, 1)
+
+    @patch('tfstack_results.get_broker_client')
+    @patch('tfstack_results.get_results_client')
+    def test_get_memory_usage(self, patch_client, patch_broker_client):
+        patch_broker_client.return_value = patch_client.return_value
+        patch_client.return_value.info.return_value = {
+            'used_memory': 1024, 'used_memory_peak': 2048, 'maxmemory': 4096, 'maxmemory_policy': 'volatile-lru',
+            'evicted_keys': 1, 'expired_keys': 5, 'db0': {'keys': 10, 'expires': 4}, 'db1': {'keys': 2, 'expires': 0}}
+
+        usage = get_memory_usage()
+        self.assertTrue(usage['shared'])
+        self.assertEqual(usage['broker'], usage['backend'])
+        self.assertEqual(usage['backend']['keys'], 12)
+        self.assertEqual(usage['backend']['maxmemory_policy'], 'volatile-lru')
+        self.assertEqual(patch_client.return_value.info.call_count, 1)
+        self.assertEqual(memory_usage(patch_client.return_value)['evicted_keys'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import json
+import hashlib
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from unittest.mock import patch
+
+import tfstack_state
+from tfstack_state import parse_state_resources, read_state
+
+
+STATE = {
+    'version': 4,
+    'resources': [
+        {'mode': 'managed', 'type': 'aws_instance', 'name': 'this',
+         'instances': [{'attributes': {}}]},
+        {'module': 'module.network', 'mode': 'managed', 'type': 'aws_subnet', 'name': 'private',
+         'instances': [{'index_key': 0}, {'index_key': 1}]},
+        {'mode': 'data', 'type': 'aws_ami', 'name': 'ubuntu',
+         'instances': [{'index_key': 'a'}]},
+    ],
+}
+
+
+class S3StandIn(BaseHTTPRequestHandler):
+    """
+    Serves GET object of a path-style S3 bucket, with ETag and If-None-Match
+    """
+    objects = dict()
+    requests = list()
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get('If-None-Match')))
+        body = self.objects.get(self.path)
+        if body is None:
+            self.send_response(404)
+            error = b'<Error><Code>NoSuchKey</Code><Message>The specified key does not exist.</Message></Error>'
+            self.send_header('Content-Type', 'application/xml')
+            self.send_header('Content-Length', str(len(error)))
+            self.end_headers()
+            self.wfile.write(error)
+            return
+
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Test_state_reader(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), S3StandIn)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.environ = patch.dict(os.environ, {'AWS_ACCESS_KEY_ID': 'test', 'AWS_SECRET_ACCESS_KEY': 'test'})
+        cls.environ.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.environ.stop()
+
+    def setUp(self):
+        S3StandIn.objects.clear()
+        S3StandIn.requests.clear()
+        tfstack_state._snapshots.clear()
+        patches = [
+            patch('tfstack_state._s3_client', None),
+            patch('tfstack_state.TF_STATE_ENDPOINT_URL',
+                  'http://127.0.0.1:{}'.format(self.server.server_port)),
+            patch('tfstack_state.TF_STATE_REGION', 'us-east-1'),
+            patch('tfstack_state.TF_STATE_BUCKET', 'tfstate'),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_read_state_conditional_get(self):
+        S3StandIn.objects['/tfstate/env%3A/123/terraform.tfstate'] = json.dumps(STATE).encode('utf8')
+
+        first = read_state('123')
+        second = read_state('123')
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(first['resources']), 4)
+        self.assertEqual(S3StandIn.requests[0][1], None)
+        self.assertIsNotNone(S3StandIn.requests[1][1])
+
+    def test_read_state_workspace_not_exist(self):
+        with self.assertRaises(Exception) as cm:
+            read_state('456')
+        self.assertEqual('error:WorkspaceNotExist', str(cm.exception))
+
+
+class Test_parse_state(unittest.TestCase):
+    def test_parse_state_resources(self):
+        self.assertEqual([resource['address'] for resource in parse_state_resources(STATE)], [
+            'aws_instance.this',
+            'module.network.aws_subnet.private[0]',
+            'module.network.aws_subnet.private[1]',
+            'data.aws_ami.ubuntu["a"]',
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
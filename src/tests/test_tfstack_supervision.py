@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from unittest.mock import patch
+
+from tfstack_executors import read_tf_stack
+from tfstack_supervision import TIME_LIMITS, TERMINATE_GRACE_PERIOD, process_group_alive, reap_processes, \
+    reap_workdirs, register_process, task_time_limits
+
+
+def dead_pid():
+    process = subprocess.Popen(['true'])
+    process.wait()
+    return process.pid
+
+
+class Test_supervision(unittest.TestCase):
+    def setUp(self):
+        # This temporary directory holds stand-ins for the terraform shell scripts
+        self.tf_dir = tempfile.mkdtemp()
+        self.process_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tf_dir)
+        shutil.rmtree(self.process_dir)
+
+    def write_script(self, name, content):
+        path = os.path.join(self.tf_dir, name)
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\n' + content)
+        os.chmod(path, 0o755)
+
+    def test_task_time_limits(self):
+        soft_time_limit, time_limit = task_time_limits(['plan', 'update'])
+        self.assertEqual(soft_time_limit, TIME_LIMITS['plan'] + TIME_LIMITS['update'] + TERMINATE_GRACE_PERIOD)
+        self.assertGreater(time_limit, soft_time_limit + TERMINATE_GRACE_PERIOD)
+
+    @patch('tfstack_supervision.TERMINATE_GRACE_PERIOD', 1)
+    def test_read_tf_stack_timeout(self):
+        self.write_script('read_tfstack.sh', 'sleep 30\n')
+
+        started = time.time()
+        with patch('tfstack_supervision.TF_PROCESS_DIR', self.process_dir):
+            with self.assertRaises(Exception) as cm:
+                read_tf_stack(self.tf_dir, '123', timeout=1)
+        self.assertEqual('Timeout during execution of Terraform executor', str(cm.exception))
+        self.assertLess(time.time() - started, 10)
+        self.assertEqual(os.listdir(self.process_dir), [])
+
+    @patch('tfstack_supervision.CANCEL_CHECK_INTERVAL', 0.1)
+    @patch('tfstack_supervision.TERMINATE_GRACE_PERIOD', 1)
+    def test_read_tf_stack_cancelled(self):
+        self.write_script('read_tfstack.sh', 'echo started\nsleep 30\n')
+        checks = []
+
+        def cancelled():
+            checks.append(1)
+            return len(checks) > 2
+
+        started = time.time()
+        with patch('tfstack_supervision.TF_PROCESS_DIR', self.process_dir):
+            with self.assertRaises(Exception) as cm:
+                read_tf_stack(self.tf_dir, '123', cancelled=cancelled)
+        self.assertEqual('error:Cancelled', str(cm.exception))
+        self.assertLess(time.time() - started, 10)
+
+    @patch('tfstack_supervision.TERMINATE_GRACE_PERIOD', 1)
+    def test_interrupted_output_terminates_script(self):
+        self.write_script('read_tfstack.sh', 'echo started\nsleep 30\n')
+
+        def on_line(line):
+            raise KeyboardInterrupt()
+
+        started = time.time()
+        with patch('tfstack_supervision.TF_PROCESS_DIR', self.process_dir):
+            with self.assertRaises(KeyboardInterrupt):
+                read_tf_stack(self.tf_dir, '123', on_line=on_line)
+        self.assertLess(time.time() - started, 10)
+
+    def test_reap_processes(self):
+        process = subprocess.Popen(['sleep', '30'], start_new_session=True)
+        register_process(process.pid, 'read', self.process_dir)
+        alive = subprocess.Popen(['sleep', '30'], start_new_session=True)
+        register_process(alive.pid, 'read', self.process_dir)
+
+        # the worker process that owned the first script is gone
+        with open(os.path.join(self.process_dir, str(process.pid))) as f:
+            registration = json.load(f)
+        with open(os.path.join(self.process_dir, str(process.pid)), 'w') as f:
+            json.dump(dict(registration, owner=dead_pid()), f)
+
+        self.assertEqual(reap_processes(self.process_dir, grace_period=0), 1)
+        process.wait(5)
+        self.assertFalse(process_group_alive(process.pid))
+        self.assertIsNone(alive.poll())
+
+        reap_processes(self.process_dir, grace_period=0)
+        self.assertEqual(os.listdir(self.process_dir), [str(alive.pid)])
+        alive.kill()
+        alive.wait()
+
+    def test_reap_workdirs(self):
+        orphaned = 'tmp-{}-abc'.format(dead_pid())
+        owned = 'warm-{}-def'.format(os.getpid())
+        for name in (orphaned, owned, 'other'):
+            os.makedirs(os.path.join(self.process_dir, name, 'tf'))
+
+        self.assertEqual(reap_workdirs([self.process_dir, '/nonexistent']), 1)
+        self.assertEqual(sorted(os.listdir(self.process_dir)), sorted([owned, 'other']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,394 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from unittest.mock import ANY, MagicMock, call, patch
+
+from celery.app.trace import reset_worker_optimizations, setup_worker_optimizations
+from celery.exceptions import SoftTimeLimitExceeded
+
+import tfstack_tasks
+from tfstack_tasks import create_tf_stack_task, delete_tf_stack_task, read_tf_stack_task, enqueue_next_batch_item, \
+    start_batch, cancel_request, finish_revoked_request, add_published_at_header, reap_batches_task, \
+    drift_tf_stack_task
+
+
+class TaskTestCase(unittest.TestCase):
+    """
+    Runs the tasks eagerly, on stand-ins for the terraform shell scripts, with the redis state of the tasks mocked
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # like a worker, so TfStackTask.__call__ keeps the request of the task when it calls super
+        setup_worker_optimizations(tfstack_tasks.celery)
+
+    @classmethod
+    def tearDownClass(cls):
+        reset_worker_optimizations()
+
+    def setUp(self):
+        self.tf_dir = tempfile.mkdtemp()
+        self.redis = MagicMock()
+        self.redis.hgetall.return_value = {}
+        self.patches = {name: patch('tfstack_tasks.' + name) for name in (
+            'publish_progress', 'publish_progress_end', 'expire_result', 'pop_callbacks', 'release_inflight_request',
+            'record_task_duration', 'set_cached_read', 'invalidate_cached_read', 'invalidate_cached_plan',
+            'record_stack', 'remove_stack', 'remove_drift', 'record_drift', 'StageTimer',
+            'record_batch_result', 'claim_batch_item')}
+        self.mocks = {name: p.start() for name, p in self.patches.items()}
+        self.mocks['pop_callbacks'].return_value = []
+        self.mocks['claim_batch_item'].return_value = None
+        for name, return_value in (('cancel_requested', False), ('get_stack_spec', (None, None))):
+            p = patch('tfstack_tasks.' + name, return_value=return_value)
+            self.mocks[name] = p.start()
+            self.patches[name] = p
+        self.patches['journal'] = patch('tfstack_journal.get_redis_client', return_value=self.redis)
+        self.patches['journal'].start()
+        self.patches['stack_lock'] = patch('tfstack_tasks.stack_lock')
+        self.stack_lock = self.patches['stack_lock'].start()
+        self.stack_lock.return_value.acquire.return_value = True
+
+    def tearDown(self):
+        patch.stopall()
+        shutil.rmtree(self.tf_dir)
+
+    def write_script(self, name, content):
+        path = os.path.join(self.tf_dir, name)
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\n' + content)
+        os.chmod(path, 0o755)
+
+    def journal_writes(self):
+        return [c[1]['mapping'] for c in self.redis.pipeline.return_value.hset.call_args_list]
+
+
+class Test_tasks_async(TaskTestCase):
+    @patch('tfstack_tasks.EXECUTOR_MODE', 'async')
+    def test_on_line_async(self):
+        self.write_script('read_tfstack.sh', 'echo aws_instance.stack_$1\n')
+
+        result = read_tf_stack_task.apply(kwargs={'tf_dir': self.tf_dir, 'resource_id': '123'}, task_id='abc')
+        self.assertEqual(result.state, 'SUCCESS')
+        # the output line callback runs on a thread of the event loop, bound to the request of the task
+        self.mocks['publish_progress'].assert_called_once_with('abc', 'aws_instance.stack_123')
+        self.mocks['StageTimer'].return_value.on_line.assert_called_once_with('aws_instance.stack_123')
+        self.assertIn(1, [fields.get('output_offset') for fields in self.journal_writes()])
+
+    @patch('tfstack_tasks.EXECUTOR_MODE', 'async')
+    def test_on_line_async_create_journals_resource_id(self):
+        self.write_script('create_tfstack.sh', 'echo \'resource_id "123"\'\n')
+
+        with patch('tfstack_tasks.warm_workdir') as patch_workdir:
+            patch_workdir.return_value.__enter__.return_value = self.tf_dir
+            result = create_tf_stack_task.apply(kwargs={'tf_dir': self.tf_dir}, task_id='abc')
+        self.assertEqual(result.result, {'message': 'TFstack created succesfully', 'resource_id': '123'})
+        self.assertEqual(self.mocks['publish_progress'].call_args_list, [call('abc', 'resource_id "123"')])
+        self.assertIn('123', [fields.get('resource_id') for fields in self.journal_writes()])
+
+
+class Test_tasks_coalescing(TaskTestCase):
+    def test_finish_request_releases_inflight_request(self):
+        self.write_script('read_tfstack.sh', 'echo aws_instance.stack_$1\n')
+
+        result = read_tf_stack_task.apply(kwargs={'tf_dir': self.tf_dir, 'resource_id': '123'}, task_id='abc')
+        self.assertEqual(result.state, 'SUCCESS')
+        self.mocks['release_inflight_request'].assert_called_once_with('read_tf_stack_task', '123', 'abc')
+        self.mocks['publish_progress_end'].assert_called_once_with('abc', 'SUCCESS')
+
+    def test_finish_request_releases_inflight_request_on_failure(self):
+        self.write_script('read_tfstack.sh', 'echo error:WorkspaceNotExist\nexit 1\n')
+
+        result = read_tf_stack_task.apply(kwargs={'tf_dir': self.tf_dir, 'resource_id': '123'}, task_id='abc')
+        self.assertEqual(result.state, 'FAILURE')
+        self.assertEqual(str(result.result), 'error:WorkspaceNotExist')
+        self.mocks['release_inflight_request'].assert_called_once_with('read_tf_stack_task', '123', 'abc')
+        self.mocks['remove_stack'].assert_called_once_with('123')
+
+    def test_serialized_retries_while_locked(self):
+        # another operation holds the stack lock at the first attempt, an eager retry runs right away
+        self.stack_lock.return_value.acquire.side_effect = [False, True]
+        self.write_script('read_tfstack.sh', 'echo aws_instance.stack_$1\n')
+
+        result = read_tf_stack_task.apply(kwargs={'tf_dir': self.tf_dir, 'resource_id': '123'}, task_id='abc')
+        self.assertEqual(result.state, 'SUCCESS')
+        self.assertEqual(self.stack_lock.return_value.acquire.call_count, 2)
+        self.stack_lock.return_value.release.assert_called_once_with()
+        self.assertIn('retrying', [fields.get('status') for fields in self.journal_writes()])
+        # the request is finished once, by the attempt that ran
+        self.mocks['release_inflight_request'].assert_called_once_with('read_tf_stack_task', '123', 'abc')
+
+    @patch('tfstack_tasks.STACK_LOCK_MAX_RETRIES', 0)
+    def test_serialized_gives_up(self):
+        self.stack_lock.return_value.acquire.return_value = False
+
+        result = read_tf_stack_task.apply(kwargs={'tf_dir': self.tf_dir, 'resource_id': '123'}, task_id='abc')
+        self.assertEqual(result.state, 'FAILURE')
+        self.stack_lock.return_value.release.assert_not_called()
+
+
+class Test_tasks_batches(TaskTestCase):
+    def setUp(self):
+        super().setUp()
+        self.pending = list()
+        self.claimed = list()
+        self.mocks['claim_batch_item'].side_effect = self.claim_batch_item
+        p = patch('tfstack_tasks.create_batch', return_value='batch-1')
+        self.create_batch = p.start()
+
+    def claim_batch_item(self, batch_id, request_id):
+        if not self.pending:
+            return None
+        self.claimed.append(request_id)
+        return self.pending.pop(0)
+
+    def test_start_batch_chains_items(self):
+        # every finished item enqueues the next pending item, here eagerly, so all run in turn
+        self.write_script('delete_tfstack.sh', 'echo destroyed $1\n')
+        items = [{'tf_dir': self.tf_dir, 'resource_id': resource_id} for resource_id in ('1', '2', '3')]
+        self.pending = list(items)
+
+        tfstack_tasks.celery.conf.task_always_eager = True
+        self.addCleanup(setattr, tfstack_tasks.celery.conf, 'task_always_eager', False)
+        self.assertEqual(start_batch(delete_tf_stack_task, items, max_parallel=1), 'batch-1')
+        self.create_batch.assert_called_once_with('delete_tf_stack_task', items, priority=None)
+        # every item ran with the request id it was registered with
+        self.assertEqual(self.mocks['record_batch_result'].call_args_list,
+                         [call('batch-1', request_id, True) for request_id in self.claimed])
+        self.assertEqual(len(self.claimed), 3)
+        self.assertEqual(self.mocks['remove_stack'].call_args_list, [call('1'), call('2'), call('3')])
+
+    def test_start_batch_max_parallel(self):
+        self.pending = [{'resource_id': resource_id} for resource_id in ('1', '2', '3')]
+
+        with patch('tfstack_tasks.group') as patch_group:
+            start_batch(delete_tf_stack_task, list(self.pending), priority=9, max_parallel=2)
+        signatures = list(patch_group.call_args[0][0])
+        self.assertEqual([signature['kwargs'] for signature in signatures],
+                         [{'resource_id': '1', 'batch_id': 'batch-1'}, {'resource_id': '2', 'batch_id': 'batch-1'}])
+        self.assertEqual(signatures[0]['options']['priority'], 9)
+        self.assertEqual([signature['options']['task_id'] for signature in signatures], self.claimed)
+        self.assertEqual(len(self.pending), 1)
+
+    def test_enqueue_next_batch_item(self):
+        self.pending = [{'resource_id': '2'}]
+
+        with patch.object(delete_tf_stack_task, 'apply_async') as patch_apply:
+            enqueue_next_batch_item(delete_tf_stack_task, 'batch-1', priority=9)
+            enqueue_next_batch_item(delete_tf_stack_task, 'batch-1', priority=9)
+        # the item is registered with the request id of its task before it is enqueued
+        patch_apply.assert_called_once_with(kwargs={'resource_id': '2', 'batch_id': 'batch-1'},
+                                            task_id=self.claimed[0], priority=9)
+
+    def test_failed_item_enqueues_next_item(self):
+        self.write_script('delete_tfstack.sh', 'echo error:IdNotSpecified\nexit 1\n')
+        self.pending = [{'tf_dir': self.tf_dir, 'resource_id': '2'}]
+
+        with patch.object(delete_tf_stack_task, 'apply_async') as patch_apply:
+            result = delete_tf_stack_task.apply(
+                kwargs={'tf_dir': self.tf_dir, 'resource_id': '1', 'batch_id': 'batch-1'}, task_id='abc')
+        self.assertEqual(result.state, 'FAILURE')
+        self.mocks['record_batch_result'].assert_called_once_with('batch-1', 'abc', False)
+        patch_apply.assert_called_once_with(kwargs={'tf_dir': self.tf_dir, 'resource_id': '2', 'batch_id': 'batch-1'},
+                                            task_id=ANY, priority=None)
+
+    def test_reaped_item_doesnt_enqueue_next_item(self):
+        # the reaper counted the item and enqueued the next one already
+        self.write_script('delete_tfstack.sh', 'echo destroyed $1\n')
+        self.mocks['record_batch_result'].return_value = False
+        self.pending = [{'tf_dir': self.tf_dir, 'resource_id': '2'}]
+
+        with patch.object(delete_tf_stack_task, 'apply_async') as patch_apply:
+            delete_tf_stack_task.apply(
+                kwargs={'tf_dir': self.tf_dir, 'resource_id': '1', 'batch_id': 'batch-1'}, task_id='abc')
+        patch_apply.assert_not_called()
+
+    @patch('tfstack_tasks.cancel_request')
+    @patch('tfstack_tasks.get_batch_operation', return_value=('delete_tf_stack_task', 9))
+    @patch('tfstack_tasks.expired_batch_requests', return_value=[('batch-1', 'lost'), ('batch-1', 'finished')])
+    def test_reap_batches(self, patch_expired, patch_operation, patch_cancel):
+        self.pending = [{'resource_id': '3'}, {'resource_id': '4'}]
+        results = {'lost': MagicMock(), 'finished': MagicMock(status='SUCCESS')}
+        results['lost'].ready.return_value = False
+        results['finished'].ready.return_value = True
+
+        with patch.object(delete_tf_stack_task, 'AsyncResult', side_effect=results.get), \
+                patch.object(delete_tf_stack_task, 'apply_async') as patch_apply:
+            self.assertEqual(reap_batches_task(), 2)
+        # the lost item is cancelled, in case it still runs, and counted as failed
+        patch_cancel.assert_called_once_with('lost')
+        self.assertEqual(self.mocks['record_batch_result'].call_args_list,
+                         [call('batch-1', 'lost', False), call('batch-1', 'finished', True)])
+        self.assertEqual(patch_apply.call_args_list, [
+            call(kwargs={'resource_id': '3', 'batch_id': 'batch-1'}, task_id=ANY, priority=9),
+            call(kwargs={'resource_id': '4', 'batch_id': 'batch-1'}, task_id=ANY, priority=9)])
+
+
+class Test_tasks_drift(TaskTestCase):
+    def setUp(self):
+        super().setUp()
+        patch('tfstack_tasks.take_tokens').start()
+
+    def test_drifted_stack_invalidates_cached_plan(self):
+        # a cached plan without changes would answer the next update, the drift wouldn't be fixed
+        self.write_script('drift_tfstack.sh', 'echo "  # aws_instance.this has changed"\nexit 2\n')
+
+        result = drift_tf_stack_task.apply(kwargs={'tf_dir': self.tf_dir, 'resource_id': '123'}, task_id='abc')
+        self.assertEqual(result.state, 'SUCCESS')
+        self.assertTrue(result.result['drifted'])
+        self.mocks['invalidate_cached_plan'].assert_called_once_with('123')
+
+    def test_stack_in_sync_keeps_cached_plan(self):
+        self.write_script('drift_tfstack.sh', 'echo "No changes."\nexit 0\n')
+
+        result = drift_tf_stack_task.apply(kwargs={'tf_dir': self.tf_dir, 'resource_id': '123'}, task_id='abc')
+        self.assertFalse(result.result['drifted'])
+        self.mocks['invalidate_cached_plan'].assert_not_called()
+
+
+class Test_tasks_journal(TaskTestCase):
+    def previous_execution(self, status, **fields):
+        self.redis.hgetall.return_value = {key.encode('utf8'): str(value).encode('utf8')
+                                           for key, value in dict(fields, status=status).items()}
+
+    def test_finished_execution_returns_journaled_result(self):
+        # the worker was lost after the execution finished, before the task was acknowledged
+        self.previous_execution('finished', operation='read', resource_id='123',
+                                result='{"message": "TFstack read succesfully", "resources": []}')
+        self.write_script('read_tfstack.sh', 'exit 1\n')
+
+        result = read_tf_stack_task.apply(kwargs={'tf_dir': self.tf_dir, 'resource_id': '123'}, task_id='abc')
+        self.assertEqual(result.state, 'SUCCESS')
+        self.assertEqual(result.result, {'message': 'TFstack read succesfully', 'resources': []})
+        self.mocks['set_cached_read'].assert_not_called()
+
+    def test_interrupted_create_resumes_in_allocated_workspace(self):
+        self.previous_execution('started', operation='create', resource_id='123', output_offset=5)
+        self.write_script('create_tfstack.sh', 'exit 1\n')
+        self.write_script('update_tfstack.sh', 'echo updating $1\n')
+
+        with patch('tfstack_tasks.template_workdir') as patch_workdir:
+            patch_workdir.return_value.__enter__.return_value = self.tf_dir
+            result = create_tf_stack_task.apply(kwargs={'tf_dir': self.tf_dir}, task_id='abc')
+        self.assertEqual(result.result, {'message': 'TFstack created succesfully', 'resource_id': '123'})
+        self.mocks['publish_progress'].assert_called_once_with('abc', 'updating 123')
+        self.mocks['record_stack'].assert_called_once_with('123', 'created', None, None)
+        self.assertEqual(self.journal_writes()[0]['interruptions'], 1)
+        self.assertEqual(self.journal_writes()[-1]['status'], 'finished')
+
+    def test_duplicate_delivery_waits_on_running_execution(self):
+        # the message is redelivered while its execution still runs, then the execution finishes
+        running = {b'operation': b'create', b'status': b'started', b'updated_at': str(time.time()).encode('utf8')}
+        finished = {b'operation': b'create', b'status': b'finished',
+                    b'result': b'{"message": "TFstack created succesfully", "resource_id": "123"}'}
+        self.redis.hgetall.side_effect = [running, finished]
+        self.write_script('create_tfstack.sh', 'echo creating\n')
+
+        result = create_tf_stack_task.apply(kwargs={'tf_dir': self.tf_dir}, task_id='abc')
+        self.assertEqual(result.result, {'message': 'TFstack created succesfully', 'resource_id': '123'})
+        # the duplicate neither ran the script nor touched the journal of the running execution
+        self.mocks['publish_progress'].assert_not_called()
+        self.assertEqual(self.journal_writes(), [])
+
+    def test_interrupted_delete_of_deleted_workspace_succeeds(self):
+        self.previous_execution('started', operation='delete', resource_id='123')
+        self.write_script('delete_tfstack.sh', 'echo error:WorkspaceNotExist\nexit 1\n')
+
+        result = delete_tf_stack_task.apply(kwargs={'tf_dir': self.tf_dir, 'resource_id': '123'}, task_id='abc')
+        self.assertEqual(result.state, 'SUCCESS')
+        self.assertEqual(result.result, {'message': 'TFstack deleted succesfully'})
+        self.mocks['remove_stack'].assert_called_with('123')
+
+    def test_delete_of_missing_workspace_fails(self):
+        self.write_script('delete_tfstack.sh', 'echo error:WorkspaceNotExist\nexit 1\n')
+
+        result = delete_tf_stack_task.apply(kwargs={'tf_dir': self.tf_dir, 'resource_id': '123'}, task_id='abc')
+        self.assertEqual(result.state, 'FAILURE')
+        self.assertEqual(str(result.result), 'error:WorkspaceNotExist')
+        # a failed execution doesn't leave a journal behind
+        self.redis.delete.assert_called_once_with('tfstack:journal:abc')
+
+    @patch('tfstack_journal.JOURNAL_MAX_INTERRUPTIONS', 3)
+    def test_interrupted_too_often(self):
+        self.previous_execution('started', operation='read', resource_id='123', interruptions=3)
+        self.write_script('read_tfstack.sh', 'echo aws_instance.stack_$1\n')
+
+        result = read_tf_stack_task.apply(kwargs={'tf_dir': self.tf_dir, 'resource_id': '123'}, task_id='abc')
+        self.assertEqual(result.state, 'FAILURE')
+        self.assertEqual(str(result.result), 'Execution interrupted too often, giving up')
+        self.mocks['publish_progress'].assert_not_called()
+
+
+class Test_tasks_cancellation(TaskTestCase):
+    def test_cancelled_before_start(self):
+        self.mocks['cancel_requested'].return_value = True
+        self.write_script('read_tfstack.sh', 'echo aws_instance.stack_$1\n')
+
+        result = read_tf_stack_task.apply(kwargs={'tf_dir': self.tf_dir, 'resource_id': '123'}, task_id='abc')
+        self.assertEqual(result.state, 'FAILURE')
+        self.assertEqual(str(result.result), 'error:Cancelled')
+        self.mocks['publish_progress'].assert_not_called()
+        self.mocks['release_inflight_request'].assert_called_once_with('read_tf_stack_task', '123', 'abc')
+
+    def test_cancelled_while_running(self):
+        # a cancellation of a running task raises SoftTimeLimitExceeded in the task
+        self.mocks['cancel_requested'].side_effect = [False, True]
+
+        with patch('tfstack_tasks.read_tf_stack', side_effect=SoftTimeLimitExceeded()):
+            result = read_tf_stack_task.apply(kwargs={'tf_dir': self.tf_dir, 'resource_id': '123'}, task_id='abc')
+        self.assertEqual(str(result.result), 'error:Cancelled')
+        self.redis.delete.assert_called_once_with('tfstack:journal:abc')
+
+    def test_time_limit_exceeded(self):
+        with patch('tfstack_tasks.read_tf_stack', side_effect=SoftTimeLimitExceeded()):
+            result = read_tf_stack_task.apply(kwargs={'tf_dir': self.tf_dir, 'resource_id': '123'}, task_id='abc')
+        self.assertEqual(str(result.result), 'error:TimeLimitExceeded')
+
+    def test_finish_revoked_request(self):
+        request = MagicMock(id='abc', kwargs={'tf_dir': self.tf_dir, 'resource_id': '123'},
+                            delivery_info={'priority': 0})
+        # a terminated task finishes its request itself
+        finish_revoked_request(sender=read_tf_stack_task, request=request, terminated=True)
+        self.mocks['publish_progress_end'].assert_not_called()
+
+        finish_revoked_request(sender=read_tf_stack_task, request=request, terminated=False)
+        self.mocks['publish_progress_end'].assert_called_once_with('abc', 'REVOKED')
+        self.mocks['release_inflight_request'].assert_called_once_with('read_tf_stack_task', '123', 'abc')
+
+    @patch('tfstack_tasks.request_cancel')
+    def test_cancel_request(self, patch_request_cancel):
+        with patch.object(tfstack_tasks.celery.control, 'revoke') as patch_revoke:
+            cancel_request('abc')
+        patch_request_cancel.assert_called_once_with('abc')
+        patch_revoke.assert_called_once_with('abc', terminate=True, signal='SIGUSR1')
+
+
+class Test_publish(unittest.TestCase):
+    @patch('tfstack_tasks.register_request')
+    def test_add_published_at_header(self, patch_register):
+        headers = {'id': 'abc'}
+        add_published_at_header(sender='read_tf_stack_task', headers=headers)
+        self.assertIn('tfstack_published_at', headers)
+        # the requests of the tfstack operations are known to the progress stream
+        patch_register.assert_called_once_with('abc')
+
+        add_published_at_header(sender='compact_result_task', headers={'id': 'def'})
+        patch_register.assert_called_once_with('abc')
+
+
+class Test_result_backend(unittest.TestCase):
+    def test_decode_json_result(self):
+        # a failed result as the json serializer stored it before the upgrade
+        stored = b'{"status": "FAILURE", "result": {"exc_type": "Exception", "exc_message": ["error:WorkspaceNotExist"], ' \
+                 b'"exc_module": "builtins"}, "traceback": null, "children": [], ' \
+                 b'"date_done": "2021-09-19T12:00:00.000000", "task_id": "abc"}'
+
+        meta = tfstack_tasks.celery.backend.decode_result(stored)
+        self.assertEqual(meta['status'], 'FAILURE')
+        self.assertEqual(str(meta['result']), 'error:WorkspaceNotExist')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest.mock import patch
+
+import tfstack_templates
+from tfstack_templates import InvalidTemplate, compile_config, list_templates, parse_providers, stack_revision, \
+    template_dir, template_workdir, validate_template_request
+from tfstack_workdirs import workdir_initialized
+
+
+LOCK_FILE = '''provider "registry.terraform.io/hashicorp/aws" {
+  version     = "3.50.0"
+  constraints = "~> 3.0"
+}
+'''
+
+# stand-in for terraform init, that writes a dependency lock file and a .terraform directory
+INIT_CMD = "mkdir .terraform && printf '{}' > .terraform.lock.hcl".format(LOCK_FILE.replace('\n', '\\n'))
+
+
+class Test_templates(unittest.TestCase):
+    def setUp(self):
+        self.tf_dir = tempfile.mkdtemp()
+        self.templates_dir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.warm_dir = tempfile.mkdtemp()
+        for tf_dir in (self.tf_dir, os.path.join(self.templates_dir, 'network')):
+            os.makedirs(tf_dir, exist_ok=True)
+            with open(os.path.join(tf_dir, 'main.tf'), 'w') as f:
+                f.write('variable "cidr" {}\n')
+
+        patches = [
+            patch('tfstack_templates.TF_TEMPLATES_DIR', self.templates_dir),
+            patch('tfstack_templates.TF_CONFIG_CACHE_DIR', self.cache_dir),
+            patch('tfstack_templates.TF_INIT_CMD', INIT_CMD),
+            patch('tfstack_templates.TF_VALIDATE_CMD', 'true'),
+            patch('tfstack_workdirs.TF_WARM_POOL_DIR', self.warm_dir),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def tearDown(self):
+        for path in (self.tf_dir, self.templates_dir, self.cache_dir, self.warm_dir):
+            shutil.rmtree(path)
+
+    def test_list_templates(self):
+        os.makedirs(os.path.join(self.templates_dir, '.hidden'))
+        self.assertEqual(list_templates(self.tf_dir), {
+            'default': self.tf_dir,
+            'network': os.path.join(self.templates_dir, 'network'),
+        })
+
+    def test_template_dir(self):
+        self.assertEqual(template_dir(None, self.tf_dir), self.tf_dir)
+        self.assertEqual(template_dir('network', self.tf_dir), os.path.join(self.templates_dir, 'network'))
+        for template in ('compute', '../network'):
+            with self.assertRaises(Exception) as cm:
+                template_dir(template, self.tf_dir)
+            self.assertEqual('error:TemplateNotExist', str(cm.exception))
+
+    def test_validate_template_request(self):
+        self.assertEqual(validate_template_request({}, self.tf_dir), (None, None))
+        self.assertEqual(validate_template_request({'template': 'default', 'variables': {}}, self.tf_dir),
+                         (None, None))
+        self.assertEqual(validate_template_request(
+            {'template': 'network', 'variables': {'cidr': '10.0.0.0/16', 'subnets': 3}}, self.tf_dir),
+            ('network', {'cidr': '10.0.0.0/16', 'subnets': 3}))
+
+        for body in ({'template': 'compute'}, {'template': 1}, {'variables': ['cidr']},
+                     {'variables': {'cidr; rm -rf /': 'x'}}):
+            with self.assertRaises(InvalidTemplate):
+                validate_template_request(body, self.tf_dir)
+
+    def test_stack_revision(self):
+        revision = stack_revision(self.tf_dir)
+        self.assertNotEqual(stack_revision(self.tf_dir, {'cidr': '10.0.0.0/16'}), revision)
+        self.assertEqual(stack_revision(self.tf_dir, {'a': 1, 'b': 2}), stack_revision(self.tf_dir, {'b': 2, 'a': 1}))
+
+    def test_compile_config(self):
+        network_dir = template_dir('network', self.tf_dir)
+        compiled = compile_config(network_dir)
+
+        self.assertEqual(compiled['providers'], {'registry.terraform.io/hashicorp/aws': '3.50.0'})
+        self.assertTrue(os.path.isdir(os.path.join(compiled['path'], '.terraform')))
+
+        # the same revision is not compiled again
+        with patch('tfstack_templates.TF_INIT_CMD', 'exit 1'):
+            self.assertEqual(compile_config(network_dir), compiled)
+        self.assertEqual(os.listdir(self.cache_dir), [compiled['revision']])
+
+    def test_compile_config_invalid(self):
+        with patch('tfstack_templates.TF_VALIDATE_CMD', 'exit 1'):
+            with self.assertRaises(Exception) as cm:
+                compile_config(self.tf_dir)
+        self.assertEqual('error:InvalidConfig', str(cm.exception))
+
+        # the validation is cached per revision
+        with self.assertRaises(Exception):
+            compile_config(self.tf_dir)
+
+    def test_compile_config_init_error(self):
+        with patch('tfstack_templates.TF_INIT_CMD', 'exit 1'):
+            with self.assertRaises(Exception):
+                compile_config(self.tf_dir)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_template_workdir(self):
+        with template_workdir(None, self.tf_dir) as workdir:
+            self.assertEqual(workdir, self.tf_dir)
+
+        with template_workdir('network', self.tf_dir) as workdir:
+            self.assertTrue(workdir.startswith(self.warm_dir))
+            self.assertTrue(os.path.exists(os.path.join(workdir, 'main.tf')))
+            self.assertTrue(os.path.isdir(os.path.join(workdir, '.terraform')))
+            # a copy of the compiled config is initialized, the scripts skip their init
+            self.assertTrue(workdir_initialized(workdir))
+        self.assertFalse(os.path.exists(workdir))
+
+    def test_parse_providers_without_lock_file(self):
+        self.assertEqual(parse_providers(os.path.join(self.tf_dir, '.terraform.lock.hcl')), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest.mock import patch
+
+import tfstack_workdirs
+from tfstack_workdirs import WorkdirPool, warm_workdir, warm_pool_ready, clear_warm_marker, temporary_workdir, \
+    workdir_initialized
+
+
+class Test_workdir_pool(unittest.TestCase):
+    def setUp(self):
+        self.tf_dir = tempfile.mkdtemp()
+        self.base_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.tf_dir, 'create_tfstack.sh'), 'w') as f:
+            f.write('#!/bin/sh\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tf_dir)
+        shutil.rmtree(self.base_dir)
+
+    # stand-in for terraform init, that writes a dependency lock file
+    @patch('tfstack_workdirs.TF_INIT_CMD', 'touch .terraform.lock.hcl')
+    def test_prepare(self):
+        pool = WorkdirPool(self.tf_dir, 1, base_dir=self.base_dir)
+
+        workdir = pool._prepare()
+        self.assertTrue(os.path.exists(
+            os.path.join(workdir, 'create_tfstack.sh')))
+        self.assertTrue(os.path.exists(pool.shared_lock_file))
+        self.assertTrue(workdir_initialized(workdir))
+        self.assertFalse(workdir_initialized(self.tf_dir))
+
+    @patch('tfstack_workdirs.TF_INIT_CMD', 'true')
+    def test_warm_pool_ready(self):
+        pool = WorkdirPool(self.tf_dir, 1, base_dir=self.base_dir)
+        self.assertFalse(warm_pool_ready(1, self.base_dir))
+        self.assertTrue(warm_pool_ready(0, self.base_dir))
+
+        pool._prepare()
+        self.assertTrue(warm_pool_ready(1, self.base_dir))
+
+        clear_warm_marker(self.base_dir)
+        self.assertFalse(warm_pool_ready(1, self.base_dir))
+
+    @patch('tfstack_workdirs.TF_INIT_CMD', 'exit 1')
+    def test_prepare_init_error(self):
+        pool = WorkdirPool(self.tf_dir, 1, base_dir=self.base_dir)
+
+        with self.assertRaises(Exception):
+            pool._prepare()
+        self.assertEqual(os.listdir(self.base_dir), [])
+
+    @patch('tfstack_workdirs.TF_INIT_CMD', 'true')
+    def test_warm_workdir(self):
+        pool = WorkdirPool(self.tf_dir, 1, base_dir=self.base_dir)
+        pool._warm_workdirs.put(pool._prepare())
+
+        with patch.object(tfstack_workdirs, '_workdir_pool', pool):
+            with warm_workdir(self.tf_dir) as workdir:
+                self.assertNotEqual(workdir, self.tf_dir)
+                self.assertTrue(os.path.exists(workdir))
+            self.assertFalse(os.path.exists(workdir))
+
+            # the pool is empty now
+            with warm_workdir(self.tf_dir) as workdir:
+                self.assertEqual(workdir, self.tf_dir)
+
+    @patch('tfstack_workdirs.TF_INIT_CMD', 'true')
+    def test_temporary_workdir_initialized(self):
+        pool = WorkdirPool(self.tf_dir, 1, base_dir=self.base_dir)
+        workdir = pool._prepare()
+
+        # a copy without the .terraform directory is not initialized
+        with patch('tfstack_workdirs.TF_WARM_POOL_DIR', self.base_dir):
+            with temporary_workdir(workdir) as copy:
+                self.assertFalse(workdir_initialized(copy))
+            with temporary_workdir(workdir, include_terraform_dir=True) as copy:
+                self.assertTrue(workdir_initialized(copy))
+
+    def test_warm_workdir_disabled(self):
+        with warm_workdir(self.tf_dir) as workdir:
+            self.assertEqual(workdir, self.tf_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,371 @@
+import os
+import time
+import signal
+import asyncio
+import threading
+
+from tfstack_executors import OutputScanner, CREATE_SCRIPT_ERRORS, DELETE_SCRIPT_ERRORS, READ_SCRIPT_ERRORS, \
+    PLAN_SCRIPT_ERRORS, UPDATE_SCRIPT_ERRORS, DRIFT_SCRIPT_ERRORS, evaluate_create_tf_stack, evaluate_delete_tf_stack, \
+    evaluate_read_tf_stack, evaluate_plan_tf_stack, evaluate_update_tf_stack, evaluate_drift_tf_stack, \
+    script_env
+from tfstack_metrics import EXECUTOR_STAGE_DURATION, SUBPROCESSES_IN_FLIGHT
+from tfstack_supervision import CANCEL_CHECK_INTERVAL, TERMINATE_GRACE_PERIOD, register_process, unregister_process
+from tfstack_workdirs import workdir_initialized
+from utils import get_logger
+
+
+"""Asyncio based executors for the Terraform shell scripts.
+
+A single event loop per worker process supervises all running Terraform shell scripts,
+bounded by a semaphore, with a timeout per execution. Cancelled or timed out executions
+first get SIGINT, so Terraform is able to release the state lock, and SIGKILL after a grace period,
+see tfstack_supervision.
+"""
+
+ASYNC_EXECUTOR_CONCURRENCY = int(
+    os.environ.get("ASYNC_EXECUTOR_CONCURRENCY", "50"))
+ASYNC_EXECUTOR_TIMEOUT = int(os.environ.get("ASYNC_EXECUTOR_TIMEOUT", "3600"))
+
+_async_runner = None
+_async_runner_lock = threading.Lock()
+
+
+async def run_script_async(args: list, cwd: str, scanner: OutputScanner, operation: str, on_line=None,
+                           timeout: int = ASYNC_EXECUTOR_TIMEOUT, semaphore: asyncio.Semaphore = None,
+                           variables: dict = None):
+    """
+    Executes a Terraform shell script and scans its output while it is streamed
+
+    Args:
+        args (list): the script and its arguments
+        cwd (str): the path to the directory containing terraform execution shell scripts
+        scanner (OutputScanner): scanner for the output lines
+        operation (str): name of the operation for the metrics: create, read, delete
+        on_line (callable): optional callback that receives every output line, called outside of the event loop
+        timeout (int): seconds after which the script is terminated
+        semaphore (asyncio.Semaphore): bounds the amount of concurrently running scripts
+        variables (dict): input variables of the stack, passed as TF_VAR_<name>
+
+    Raises:
+        Exception: "Unable to execute Terraform executor"
+        Exception: "Timeout during execution of Terraform executor"
+
+    Returns:
+        int: return code of the script process
+    """
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(1)
+
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            # a new session makes the script the leader of a process group, that includes terraform
+            process = await asyncio.create_subprocess_exec(*args,
+                                                           cwd=cwd,
+                                                           env=script_env(variables, workdir_initialized(cwd)),
+                                                           stdout=asyncio.subprocess.PIPE,
+                                                           start_new_session=True)
+        except Exception:
+            error_message = "Unable to execute Terraform executor"
+            raise Exception(error_message)
+        EXECUTOR_STAGE_DURATION.labels(operation, 'fork').observe(
+            time.perf_counter() - started)
+
+        register_process(process.pid, operation)
+        try:
+            with SUBPROCESSES_IN_FLIGHT.labels(operation).track_inprogress():
+                await asyncio.wait_for(_scan_output(process, scanner, on_line), timeout)
+        except asyncio.TimeoutError:
+            await terminate_process_group(process)
+            error_message = "Timeout during execution of Terraform executor"
+            raise Exception(error_message)
+        except BaseException:
+            # cancelled, or an error of the output callback
+            await terminate_process_group(process)
+            raise
+        finally:
+            unregister_process(process.pid)
+
+    EXECUTOR_STAGE_DURATION.labels(
+        operation, 'parse').observe(scanner.parse_seconds)
+    return process.returncode
+
+
+async def _scan_output(process, scanner: OutputScanner, on_line=None):
+    logger = get_logger()
+    loop = asyncio.get_event_loop()
+
+    while True:
+        line = await _read_line(process.stdout)
+        if not line:
+            break
+        line_stripped = line.decode('utf8', errors='strict').strip()
+        logger.info(line_stripped)
+        scanner.scan(line_stripped)
+        if on_line:
+            await loop.run_in_executor(None, on_line, line_stripped)
+
+    await process.wait()
+
+
+async def _read_line(stream):
+    """
+    Like StreamReader.readline, for lines of any length: a line beyond the limit of the stream
+    (64 KiB by default) is read in chunks
+
+    Args:
+        stream (asyncio.StreamReader): the output of a script
+
+    Returns:
+        bytes: the line, empty at the end of the output
+    """
+    chunks = list()
+    while True:
+        try:
+            chunks.append(await stream.readuntil(b'\n'))
+            break
+        except asyncio.IncompleteReadError as e:
+            # the last line, without a newline
+            chunks.append(e.partial)
+            break
+        except asyncio.LimitOverrunError as e:
+            chunks.append(await stream.readexactly(e.consumed))
+    return b''.join(chunks)
+
+
+async def terminate_process_group(process):
+    """
+    Terminates the process group of a script, SIGINT first and SIGKILL after TERMINATE_GRACE_PERIOD
+
+    Args:
+        process (asyncio.subprocess.Process): the script process
+    """
+    if process.returncode is not None:
+        return
+
+    try:
+        os.killpg(process.pid, signal.SIGINT)
+        await asyncio.wait_for(process.wait(), TERMINATE_GRACE_PERIOD)
+    except ProcessLookupError:
+        pass
+    except asyncio.TimeoutError:
+        get_logger().warning(
+            "Terraform executor did not stop after SIGINT, killing it")
+        os.killpg(process.pid, signal.SIGKILL)
+        await process.wait()
+
+
+async def create_tf_stack_async(tf_dir: str, on_line=None, timeout: int = ASYNC_EXECUTOR_TIMEOUT,
+                                semaphore: asyncio.Semaphore = None, variables: dict = None):
+    """
+    Asyncio variant of tfstack_executors.create_tf_stack
+
+    Args:
+        tf_dir (str): the path to the directory containing terraform execution shell scripts
+        on_line (callable): optional callback that receives every output line
+        timeout (int): seconds after which the script is terminated
+        semaphore (asyncio.Semaphore): bounds the amount of concurrently running scripts
+        variables (dict): input variables of the stack, passed as TF_VAR_<name>
+
+    Returns:
+        str: 'message': "TFstack created succesfully"
+    """
+    scanner = OutputScanner(script_errors=CREATE_SCRIPT_ERRORS,
+                            resource_id_grep_pattern='resource_id')
+    returncode = await run_script_async(['./create_tfstack.sh'], tf_dir, scanner, 'create', on_line=on_line,
+                                        timeout=timeout, semaphore=semaphore, variables=variables)
+    return evaluate_create_tf_stack(returncode, scanner.outcome())
+
+
+async def delete_tf_stack_async(tf_dir: str, resource_id: str, on_line=None, timeout: int = ASYNC_EXECUTOR_TIMEOUT,
+                                semaphore: asyncio.Semaphore = None, variables: dict = None):
+    """
+    Asyncio variant of tfstack_executors.delete_tf_stack
+
+    Args:
+        tf_dir (str): the path to the directory containing terraform execution shell scripts
+        resource_id (str): stack/resource id
+        on_line (callable): optional callback that receives every output line
+        timeout (int): seconds after which the script is terminated
+        semaphore (asyncio.Semaphore): bounds the amount of concurrently running scripts
+        variables (dict): input variables of the stack, passed as TF_VAR_<name>
+
+    Returns:
+        str: "TFstack" + " deleted succesfully"
+    """
+    scanner = OutputScanner(script_errors=DELETE_SCRIPT_ERRORS)
+    returncode = await run_script_async(['./delete_tfstack.sh', resource_id], tf_dir, scanner, 'delete', on_line=on_line,
+                                        timeout=timeout, semaphore=semaphore, variables=variables)
+    return evaluate_delete_tf_stack(returncode, scanner.outcome())
+
+
+async def read_tf_stack_async(tf_dir: str, resource_id: str, on_line=None, timeout: int = ASYNC_EXECUTOR_TIMEOUT,
+                              semaphore: asyncio.Semaphore = None, variables: dict = None):
+    """
+    Asyncio variant of tfstack_executors.read_tf_stack
+
+    Args:
+        tf_dir (str): the path to the directory containing terraform execution shell scripts
+        resource_id (str): stack/resource id
+        on_line (callable): optional callback that receives every output line
+        timeout (int): seconds after which the script is terminated
+        semaphore (asyncio.Semaphore): bounds the amount of concurrently running scripts
+        variables (dict): input variables of the stack, passed as TF_VAR_<name>
+
+    Returns:
+        dict : containing message of status of succesful terraform operation, including result
+    """
+    scanner = OutputScanner(script_errors=READ_SCRIPT_ERRORS,
+                            collect_output=True)
+    returncode = await run_script_async(['./read_tfstack.sh', resource_id], tf_dir, scanner, 'read', on_line=on_line,
+                                        timeout=timeout, semaphore=semaphore, variables=variables)
+    return evaluate_read_tf_stack(returncode, scanner.outcome())
+
+
+async def plan_tf_stack_async(tf_dir: str, resource_id: str, on_line=None, timeout: int = ASYNC_EXECUTOR_TIMEOUT,
+                              semaphore: asyncio.Semaphore = None, variables: dict = None):
+    """
+    Asyncio variant of tfstack_executors.plan_tf_stack
+
+    Args:
+        tf_dir (str): the path to the directory containing terraform execution shell scripts
+        resource_id (str): stack/resource id
+        on_line (callable): optional callback that receives every output line
+        timeout (int): seconds after which the script is terminated
+        semaphore (asyncio.Semaphore): bounds the amount of concurrently running scripts
+        variables (dict): input variables of the stack, passed as TF_VAR_<name>
+
+    Returns:
+        dict : containing message of status of succesful terraform plan, whether it has changes and its summary
+    """
+    scanner = OutputScanner(script_errors=PLAN_SCRIPT_ERRORS)
+    returncode = await run_script_async(['./plan_tfstack.sh', resource_id], tf_dir, scanner, 'plan', on_line=on_line,
+                                        timeout=timeout, semaphore=semaphore, variables=variables)
+    return evaluate_plan_tf_stack(returncode, scanner.outcome())
+
+
+async def update_tf_stack_async(tf_dir: str, resource_id: str, on_line=None, timeout: int = ASYNC_EXECUTOR_TIMEOUT,
+                                semaphore: asyncio.Semaphore = None, variables: dict = None):
+    """
+    Asyncio variant of tfstack_executors.update_tf_stack
+
+    Args:
+        tf_dir (str): the path to the directory containing terraform execution shell scripts
+        resource_id (str): stack/resource id
+        on_line (callable): optional callback that receives every output line
+        timeout (int): seconds after which the script is terminated
+        semaphore (asyncio.Semaphore): bounds the amount of concurrently running scripts
+        variables (dict): input variables of the stack, passed as TF_VAR_<name>
+
+    Returns:
+        dict : containing message of status of succesful terraform apply
+    """
+    scanner = OutputScanner(script_errors=UPDATE_SCRIPT_ERRORS)
+    returncode = await run_script_async(['./update_tfstack.sh', resource_id], tf_dir, scanner, 'update', on_line=on_line,
+                                        timeout=timeout, semaphore=semaphore, variables=variables)
+    return evaluate_update_tf_stack(returncode, scanner.outcome())
+
+
+async def drift_tf_stack_async(tf_dir: str, resource_id: str, on_line=None, timeout: int = ASYNC_EXECUTOR_TIMEOUT,
+                               semaphore: asyncio.Semaphore = None, variables: dict = None):
+    """
+    Asyncio variant of tfstack_executors.drift_tf_stack
+
+    Args:
+        tf_dir (str): the path to the directory containing terraform execution shell scripts
+        resource_id (str): stack/resource id
+        on_line (callable): optional callback that receives every output line
+        timeout (int): seconds after which the script is terminated
+        semaphore (asyncio.Semaphore): bounds the amount of concurrently running scripts
+        variables (dict): input variables of the stack, passed as TF_VAR_<name>
+
+    Returns:
+        dict : containing message of status of succesful drift check, whether the stack drifted and the drifted resources
+    """
+    scanner = OutputScanner(script_errors=DRIFT_SCRIPT_ERRORS,
+                            collect_output=True)
+    returncode = await run_script_async(['./drift_tfstack.sh', resource_id], tf_dir, scanner, 'drift', on_line=on_line,
+                                        timeout=timeout, semaphore=semaphore, variables=variables)
+    return evaluate_drift_tf_stack(returncode, scanner.outcome())
+
+
+class AsyncExecutorRunner:
+    """
+    Event loop in a background thread, that runs the asyncio executors
+    of all tasks of a worker process
+    """
+
+    def __init__(self, concurrency: int = ASYNC_EXECUTOR_CONCURRENCY):
+        """
+        Args:
+            concurrency (int): maximum amount of concurrently running scripts
+        """
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.semaphore = asyncio.run_coroutine_threadsafe(
+            self._create_semaphore(concurrency), self.loop).result()
+
+    async def _create_semaphore(self, concurrency):
+        return asyncio.Semaphore(concurrency)
+
+    def run(self, async_executor, *args, cancelled=None, **kwargs):
+        """
+        Runs an asyncio executor and waits for its result.
+        The executor is cancelled when the waiting thread is interrupted, or when the request is cancelled.
+
+        Args:
+            async_executor (coroutine function): one of the asyncio executors
+            cancelled (callable): returns True when the request is cancelled
+
+        Raises:
+            Exception: "error:Cancelled"
+
+        Returns:
+            the result of the executor
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self._supervise(async_executor(*args, semaphore=self.semaphore, **kwargs), cancelled), self.loop)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+    async def _supervise(self, coroutine, cancelled=None):
+        task = asyncio.ensure_future(coroutine)
+        if cancelled is None:
+            return await task
+
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=CANCEL_CHECK_INTERVAL)
+                if done:
+                    return task.result()
+                if await self.loop.run_in_executor(None, cancelled):
+                    break
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+
+        # waits until the script is terminated
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        error_message = 'error:Cancelled'
+        raise Exception(error_message)
+
+
+def get_async_runner():
+    """
+    Returns:
+        AsyncExecutorRunner: the runner of this process, created on first use
+    """
+    global _async_runner
+
+    # the threads of a worker process share a single runner, and its semaphore
+    with _async_runner_lock:
+        if _async_runner is None:
+            _async_runner = AsyncExecutorRunner()
+    return _async_runner
@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import uuid
+
+from redis.exceptions import RedisError
+
+from utils import get_logger, get_redis_client
+
+
+"""Bookkeeping of batches of operations on stacks.
+
+A batch keeps the items that are not yet enqueued, the request ids of the enqueued items
+and aggregated counters. Only BATCH_MAX_PARALLEL items of a batch are enqueued at a time,
+every finished item enqueues the next pending item.
+The batches that are not done are kept in a sorted set by expiry, so the pending items
+count towards the cap on the queued tasks, and the enqueued items that are not finished are kept
+per batch by enqueue time. An item is counted once: by its task, or by the reaper when it didn't finish
+within BATCH_ITEM_TIMEOUT seconds, so a lost task doesn't stall its batch.
+"""
+
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "1000"))
+BATCH_MAX_PARALLEL = int(os.environ.get("BATCH_MAX_PARALLEL", "10"))
+BATCH_TTL = int(os.environ.get("BATCH_TTL", "86400"))
+# seconds after which an enqueued item that didn't finish is reaped, it must exceed the longest wait and execution
+BATCH_ITEM_TIMEOUT = int(os.environ.get("BATCH_ITEM_TIMEOUT", "10800"))
+# 0 disables the reaper
+BATCH_REAP_INTERVAL = int(os.environ.get("BATCH_REAP_INTERVAL", "300"))
+
+BATCH_KEY = "tfstack:batch:{batch_id}"
+BATCH_PENDING_KEY = "tfstack:batch:{batch_id}:pending"
+BATCH_REQUESTS_KEY = "tfstack:batch:{batch_id}:requests"
+BATCH_INFLIGHT_KEY = "tfstack:batch:{batch_id}:inflight"
+ACTIVE_BATCHES_KEY = "tfstack:batches:active"
+
+# moves the next pending item of a batch to the enqueued items, returns the item
+CLAIM_BATCH_ITEM_SCRIPT = """
+local item = redis.call('lpop', KEYS[1])
+if not item then
+    return false
+end
+redis.call('rpush', KEYS[2], ARGV[1])
+redis.call('zadd', KEYS[3], ARGV[2], ARGV[1])
+redis.call('expire', KEYS[2], ARGV[3])
+redis.call('expire', KEYS[3], ARGV[3])
+return item
+"""
+
+
+def create_batch(operation: str, items: list, priority: int = None):
+    """
+    Create a batch of operations
+
+    Args:
+        operation (str): name of the operation, the Celery task name
+        items (list): kwargs (dict) of the Celery task per item
+        priority (int): message priority of the items, None for the default priority
+
+    Returns:
+        str: batch id
+    """
+    batch_id = str(uuid.uuid4())
+
+    batch = {
+        'operation': operation,
+        'total': len(items),
+        'succeeded': 0,
+        'failed': 0,
+    }
+    if priority is not None:
+        batch['priority'] = priority
+
+    pipeline = get_redis_client().pipeline()
+    pipeline.hset(BATCH_KEY.format(batch_id=batch_id), mapping=batch)
+    pipeline.rpush(BATCH_PENDING_KEY.format(batch_id=batch_id),
+                   *[json.dumps(item) for item in items])
+    for key in (BATCH_KEY, BATCH_PENDING_KEY, BATCH_REQUESTS_KEY):
+        pipeline.expire(key.format(batch_id=batch_id), BATCH_TTL)
+    pipeline.zadd(ACTIVE_BATCHES_KEY, {batch_id: time.time() + BATCH_TTL})
+    pipeline.execute()
+
+    return batch_id
+
+
+def get_batch_operation(batch_id: str):
+    """
+    Args:
+        batch_id (str): batch id
+
+    Returns:
+        tuple: the operation (str) and the message priority (int) of the items of a batch,
+            None for either when unknown
+    """
+    operation, priority = get_redis_client().hmget(BATCH_KEY.format(batch_id=batch_id), 'operation', 'priority')
+    return (operation.decode('utf8') if operation is not None else None,
+            int(priority) if priority is not None else None)
+
+
+def claim_batch_item(batch_id: str, request_id: str):
+    """
+    Take the next pending item of a batch and register it as enqueued with the request id of its Celery task,
+    in one step and before the task is enqueued, so the task can't finish before it is registered
+    and an item that is not enqueued after all is reaped like a lost task
+
+    Args:
+        batch_id (str): batch id
+        request_id (str): request id for the Celery task of the item
+
+    Returns:
+        dict: kwargs of the Celery task or None when there are no pending items
+    """
+    item = get_redis_client().eval(
+        CLAIM_BATCH_ITEM_SCRIPT, 3, BATCH_PENDING_KEY.format(batch_id=batch_id),
+        BATCH_REQUESTS_KEY.format(batch_id=batch_id), BATCH_INFLIGHT_KEY.format(batch_id=batch_id),
+        request_id, time.time(), BATCH_TTL)
+    if item is None:
+        return None
+    return json.loads(item)
+
+
+def pending_batch_items():
+    """
+    Returns:
+        int: amount of items of all batches that are not yet enqueued, 0 when redis is unavailable
+    """
+    try:
+        client = get_redis_client()
+        client.zremrangebyscore(ACTIVE_BATCHES_KEY, '-inf', time.time())
+        batch_ids = client.zrange(ACTIVE_BATCHES_KEY, 0, -1)
+        if not batch_ids:
+            return 0
+        pipeline = client.pipeline()
+        for batch_id in batch_ids:
+            pipeline.llen(BATCH_PENDING_KEY.format(batch_id=batch_id.decode('utf8')))
+        return sum(pipeline.execute())
+    except RedisError as e:
+        get_logger().warning("Unable to count the pending batch items: %s", e)
+        return 0
+
+
+def record_batch_result(batch_id: str, request_id: str, succeeded: bool):
+    """
+    Count a finished item of a batch, once: an item that was reaped already isn't counted again
+
+    Args:
+        batch_id (str): batch id
+        request_id (str): request id of the Celery task of the item
+        succeeded (bool): whether the Celery task succeeded
+
+    Returns:
+        bool: whether the item was counted, the caller enqueues the next pending item when it was
+    """
+    client = get_redis_client()
+    if not client.zrem(BATCH_INFLIGHT_KEY.format(batch_id=batch_id), request_id):
+        return False
+
+    key = BATCH_KEY.format(batch_id=batch_id)
+    pipeline = client.pipeline()
+    pipeline.hincrby(key, 'succeeded' if succeeded else 'failed', 1)
+    pipeline.hmget(key, 'total', 'succeeded', 'failed')
+    _, counters = pipeline.execute()
+    total, done = int(counters[0] or 0), sum(int(counter or 0) for counter in counters[1:])
+    if done >= total:
+        client.zrem(ACTIVE_BATCHES_KEY, batch_id)
+    return True
+
+
+def expired_batch_requests(timeout: int = BATCH_ITEM_TIMEOUT, now: float = None):
+    """
+    Args:
+        timeout (int): seconds after which an enqueued item that didn't finish expires
+        now (float): epoch time
+
+    Returns:
+        list: the batch id and the request id (tuple) of the expired items of all batches
+    """
+    now = time.time() if now is None else now
+    client = get_redis_client()
+    client.zremrangebyscore(ACTIVE_BATCHES_KEY, '-inf', now)
+    batch_ids = [batch_id.decode('utf8') for batch_id in client.zrange(ACTIVE_BATCHES_KEY, 0, -1)]
+    if not batch_ids:
+        return list()
+
+    pipeline = client.pipeline()
+    for batch_id in batch_ids:
+        pipeline.zrangebyscore(BATCH_INFLIGHT_KEY.format(batch_id=batch_id), '-inf', now - timeout)
+    return [(batch_id, request_id.decode('utf8'))
+            for batch_id, request_ids in zip(batch_ids, pipeline.execute())
+            for request_id in request_ids]
+
+
+def get_batch_status(batch_id: str):
+    """
+    Get the aggregated status of a batch
+
+    Args:
+        batch_id (str): batch id
+
+    Returns:
+        dict: aggregated status or None when the batch doesn't exist (anymore)
+    """
+    pipeline = get_redis_client().pipeline()
+    pipeline.hgetall(BATCH_KEY.format(batch_id=batch_id))
+    pipeline.lrange(BATCH_REQUESTS_KEY.format(batch_id=batch_id), 0, -1)
+    batch, request_ids = pipeline.execute()
+
+    if not batch:
+        return None
+
+    batch = {k.decode('utf8'): v.decode('utf8') for k, v in batch.items()}
+    total = int(batch['total'])
+    succeeded = int(batch['succeeded'])
+    failed = int(batch['failed'])
+    return {
+        'batch_id': batch_id,
+        'operation': batch['operation'],
+        'total': total,
+        'succeeded': succeeded,
+        'failed': failed,
+        'done': succeeded + failed,
+        'request_ids': [request_id.decode('utf8') for request_id in request_ids],
+    }
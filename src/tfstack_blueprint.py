@@ -1,12 +1,289 @@
-import subprocess
-from flask import current_app, render_template, Blueprint, jsonify, request
+import os
+import math
+import time
+import uuid
+from flask import current_app, Blueprint, jsonify, request, Response, stream_with_context
+from redis.exceptions import RedisError
 
-from tfstack_tasks import create_tf_stack_task, delete_tf_stack_task, read_tf_stack_task
+from tfstack_batches import BATCH_MAX_SIZE, get_batch_status
+from tfstack_cache import get_cached_read
+from tfstack_callbacks import InvalidCallback, register_callback, validate_callback_url
+from tfstack_drift import get_drift_report
+from tfstack_inventory import INVENTORY_MAX_LIMIT, STACK_STATES, list_stacks
+from tfstack_locks import claim_inflight_request, release_inflight_request
+from tfstack_progress import read_progress, request_known
+from tfstack_ratelimit import CostExceedsRateLimit, RateLimited, admit, client_key, take_tokens
+from tfstack_results import select_fields
+from tfstack_state import read_state, state_reader_enabled
+from tfstack_templates import InvalidTemplate, list_templates, validate_template_request
+from tfstack_tasks import PRIORITIES, create_tf_stack_task, delete_tf_stack_task, read_tf_stack_task, update_tf_stack_task, \
+    start_batch, cancel_request, schedule_result_compaction, notify_callbacks
 from utils import get_logger
 
 
 tfstack_blueprint = Blueprint('ec2instance_blueprint', __name__)
 
+PROGRESS_BLOCK_MS = int(os.environ.get("PROGRESS_BLOCK_MS", "15000"))
+# seconds without progress after which a progress stream ends, clients resume with the Last-Event-ID header
+PROGRESS_MAX_IDLE = int(os.environ.get("PROGRESS_MAX_IDLE", "900"))
+REQUESTS_LOOKUP_MAX_SIZE = int(
+    os.environ.get("REQUESTS_LOOKUP_MAX_SIZE", "1000"))
+
+
+class InvalidPriority(Exception):
+    """
+    Raised when a request has an unknown 'priority' query parameter
+    """
+
+
+class InvalidQueryParameter(Exception):
+    """
+    Raised when a request has an invalid paging or filter query parameter
+    """
+
+
+class InvalidRequestBody(Exception):
+    """
+    Raised when a request has a JSON body that is not an object
+    """
+
+
+def request_body():
+    """
+    Reads the optional JSON body of the request
+
+    Raises:
+        InvalidRequestBody: when the body is JSON, but not an object
+
+    Returns:
+        dict: the body, empty when there is no JSON body
+    """
+    body = request.get_json(silent=True)
+    if body is None:
+        return {}
+    if not isinstance(body, dict):
+        raise InvalidRequestBody("the request body must be a JSON object")
+    return body
+
+
+def request_priority():
+    """
+    Reads the optional 'priority' query parameter of the request
+
+    Raises:
+        InvalidPriority: when the priority is not one of PRIORITIES
+
+    Returns:
+        int: message priority or None for the default priority
+    """
+    priority = request.args.get('priority')
+    if priority is None:
+        return None
+    if priority not in PRIORITIES:
+        raise InvalidPriority(
+            "priority must be one of {}".format(", ".join(PRIORITIES)))
+    return PRIORITIES[priority]
+
+
+def request_page():
+    """
+    Reads the optional 'offset' and 'limit' query parameters of a listing
+
+    Raises:
+        InvalidQueryParameter: when the offset is negative or the limit is not positive
+
+    Returns:
+        tuple: (offset, limit), the limit at most INVENTORY_MAX_LIMIT
+    """
+    try:
+        offset = int(request.args.get('offset', 0))
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        raise InvalidQueryParameter("offset and limit must be integers")
+    if offset < 0 or limit < 1:
+        raise InvalidQueryParameter("offset must be at least 0 and limit at least 1")
+    return offset, min(limit, INVENTORY_MAX_LIMIT)
+
+
+def request_epoch_time(name):
+    """
+    Reads an optional epoch time query parameter
+
+    Args:
+        name (str): name of the query parameter
+
+    Raises:
+        InvalidQueryParameter: when the parameter is not a number
+
+    Returns:
+        float: epoch time or None when not given
+    """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        epoch_time = float(value)
+    except ValueError:
+        epoch_time = math.nan
+    if not math.isfinite(epoch_time):
+        raise InvalidQueryParameter("{} must be an epoch time".format(name))
+    return epoch_time
+
+
+@tfstack_blueprint.errorhandler(InvalidPriority)
+def handle_invalid_priority(e):
+    return jsonify({"error": str(e)}), 400
+
+
+@tfstack_blueprint.errorhandler(InvalidQueryParameter)
+def handle_invalid_query_parameter(e):
+    return jsonify({"error": str(e)}), 400
+
+
+@tfstack_blueprint.errorhandler(InvalidRequestBody)
+def handle_invalid_request_body(e):
+    return jsonify({"error": str(e)}), 400
+
+
+@tfstack_blueprint.errorhandler(InvalidTemplate)
+def handle_invalid_template(e):
+    return jsonify({"error": str(e)}), 400
+
+
+@tfstack_blueprint.errorhandler(InvalidCallback)
+def handle_invalid_callback(e):
+    return jsonify({"error": str(e)}), 400
+
+
+@tfstack_blueprint.errorhandler(RateLimited)
+def handle_rate_limited(e):
+    return jsonify({"error": str(e)}), 429, {'Retry-After': str(e.retry_after)}
+
+
+@tfstack_blueprint.errorhandler(CostExceedsRateLimit)
+def handle_cost_exceeds_rate_limit(e):
+    return jsonify({"error": str(e)}), 400
+
+
+def admit_request(operation, cost=1):
+    """
+    Admission control of a request that enqueues tasks,
+    the client is identified by a known X-API-Key header or the remote address
+
+    Args:
+        operation (str): name of the operation: create, read, delete, update
+        cost (int): amount of tasks the request enqueues
+
+    Raises:
+        RateLimited: when the request is not admitted
+        CostExceedsRateLimit: when the request costs more than the rate limit allows at once
+    """
+    admit(client_key(request.headers.get('X-API-Key'), request.remote_addr), operation, cost)
+
+
+def limit_request(operation):
+    """
+    Rate limit of a request that doesn't enqueue tasks, e.g. a cancellation
+
+    Args:
+        operation (str): name of the operation, e.g. cancel
+
+    Raises:
+        RateLimited: when the request is not admitted
+    """
+    take_tokens(client_key(request.headers.get('X-API-Key'), request.remote_addr), operation)
+
+
+def request_callback_url(body=None):
+    """
+    Reads the optional 'callback_url' of the request body, or of the query parameters
+
+    Args:
+        body (dict): the request body
+
+    Raises:
+        InvalidCallback: when callbacks are not enabled or the URL is invalid
+
+    Returns:
+        str: the callback URL or None
+    """
+    callback_url = (body or {}).get('callback_url')
+    if callback_url is None:
+        callback_url = request.args.get('callback_url')
+    return validate_callback_url(callback_url)
+
+
+def add_request_callback(celery_task, request_id, callback_url, resource_id=None):
+    """
+    Registers the callback of a request. The callback of a request that already finished
+    (e.g. an identical request that was in flight) is notified right away.
+
+    Args:
+        celery_task (celery.Task): the Celery task of the operation
+        request_id (str): request id of the Celery task
+        callback_url (str): the callback URL, None for no callback
+        resource_id (str): stack/resource id, None for a create
+    """
+    if callback_url is None:
+        return
+    register_callback(request_id, callback_url)
+    request_result = celery_task.AsyncResult(request_id)
+    if request_result.ready():
+        notify_callbacks(request_id, celery_task.operation, request_result.status,
+                         request_result.result, resource_id)
+
+
+def template_kwargs(tf_dir, template=None, variables=None):
+    """
+    Args:
+        tf_dir (str): the path to the directory containing terraform execution shell scripts
+        template (str): template name, None for the default template
+        variables (dict): input variables
+
+    Returns:
+        dict: the kwargs of create_tf_stack_task, without the defaults
+    """
+    kwargs = {'tf_dir': tf_dir}
+    if template:
+        kwargs['template'] = template
+    if variables:
+        kwargs['variables'] = variables
+    return kwargs
+
+
+def enqueue_coalesced(celery_task, tf_dir, resource_id, priority=None, callback_url=None):
+    """
+    Creates an async Celery task for an operation on a resource_id,
+    unless an identical request is already in flight.
+    The callback is registered before the task is enqueued, a request with a callback that is not accepted
+    doesn't enqueue a task.
+
+    Args:
+        celery_task (celery.Task): the Celery task of the operation
+        tf_dir (str): the path to the directory containing terraform execution shell scripts
+        resource_id (str): stack/resource id
+        priority (int): message priority, one of PRIORITIES
+        callback_url (str): the callback URL, None for no callback
+
+    Raises:
+        InvalidCallback: when the request has CALLBACK_MAX_PER_REQUEST callbacks already
+
+    Returns:
+        str: request id of the Celery task that handles the operation
+    """
+    request_id, is_new = claim_inflight_request(
+        celery_task.name, resource_id, str(uuid.uuid4()))
+    try:
+        add_request_callback(celery_task, request_id, callback_url, resource_id)
+        if is_new:
+            celery_task.apply_async(
+                kwargs={'tf_dir': tf_dir, 'resource_id': resource_id}, task_id=request_id, priority=priority)
+    except Exception:
+        if is_new:
+            release_inflight_request(celery_task.name, resource_id, request_id)
+        raise
+    return request_id
+
 
 @tfstack_blueprint.route('/', methods=['GET'])
 def home():
@@ -26,31 +303,181 @@ def create_tf_stack():
        The uniqueness is determined by the Terraform shell scripts that
        uses a randomly generated 'resource_id'
 
-       Creates the related async Celery task.
+       Creates the related async Celery task, with the optional
+       'priority' query parameter (high, normal or low).
+       The optional body selects the 'template' of the stack and its input 'variables',
+       and a 'callback_url' that is notified when the task finishes.
 
     Returns:
         json: json datastructure
     """
     tf_dir = current_app.config['TF_DIR']
-    celery_task = create_tf_stack_task.delay(tf_dir=tf_dir)
+    body = request_body()
+    template, variables = validate_template_request(body, tf_dir)
+    callback_url = request_callback_url(body)
+    priority = request_priority()
+    admit_request('create')
+    request_id = str(uuid.uuid4())
+    add_request_callback(create_tf_stack_task, request_id, callback_url)
+    celery_task = create_tf_stack_task.apply_async(
+        kwargs=template_kwargs(tf_dir, template, variables), task_id=request_id, priority=priority)
     return jsonify({"request_id": celery_task.id}), 202
 
 
+@tfstack_blueprint.route('/templates', methods=['GET'])
+def list_tf_stack_templates():
+    """Flask blueprint.
+       Lists the templates that stacks can be created from.
+
+    Returns:
+        json: json datastructure
+    """
+    return jsonify({"templates": list(list_templates(current_app.config['TF_DIR']))}), 200
+
+
+@tfstack_blueprint.route('/tfstacks', methods=['GET'])
+def list_tf_stacks():
+    """Flask blueprint.
+       Lists the stacks from the stack inventory, ordered by creation time.
+       Query parameters: offset, limit (at most INVENTORY_MAX_LIMIT), state, created_after and created_before (epoch time).
+
+    Returns:
+        json: json datastructure
+    """
+    offset, limit = request_page()
+    created_after = request_epoch_time('created_after')
+    created_before = request_epoch_time('created_before')
+
+    state = request.args.get('state')
+    if state is not None and state not in STACK_STATES:
+        return jsonify({"error": "state must be one of {}".format(", ".join(STACK_STATES))}), 400
+
+    stacks = list_stacks(offset=offset, limit=limit, state=state,
+                         created_after=created_after, created_before=created_before)
+    stacks.update({"offset": offset, "limit": limit})
+    return jsonify(stacks), 200
+
+
+@tfstack_blueprint.route('/drift', methods=['GET'])
+def tfstacks_drift_report():
+    """Flask blueprint.
+       The drift report: the current or last drift sweep and the drifted stacks, most recently checked first.
+       Query parameters: offset, limit and all (also the stacks that didn't drift).
+
+    Returns:
+        json: json datastructure
+    """
+    offset, limit = request_page()
+
+    report = get_drift_report(offset=offset, limit=limit,
+                              drifted_only=request.args.get('all', 'false').lower() != 'true')
+    report.update({"offset": offset, "limit": limit})
+    return jsonify(report), 200
+
+
+@tfstack_blueprint.route('/tfstacks:batch', methods=['POST'])
+def create_tf_stack_batch():
+    """Flask blueprint.
+       This is the batch Create operation, which creates 'count' new terraform stacks,
+       of the optional 'template' with its input 'variables'.
+
+       Creates a batch of async Celery tasks, with a bounded amount running in parallel.
+
+    Returns:
+        json: json datastructure
+    """
+    tf_dir = current_app.config['TF_DIR']
+    body = request_body()
+    template, variables = validate_template_request(body, tf_dir)
+
+    count = body.get('count')
+    # a JSON boolean is an int in Python
+    if not isinstance(count, int) or isinstance(count, bool) or not 0 < count <= BATCH_MAX_SIZE:
+        return jsonify({"error": "count must be between 1 and {}".format(BATCH_MAX_SIZE)}), 400
+    priority = request_priority()
+    # every item of a batch is charged, the items are enqueued later on without admission
+    admit_request('create', cost=count)
+
+    batch_id = start_batch(create_tf_stack_task, [
+                           template_kwargs(tf_dir, template, variables) for _ in range(count)],
+                           priority=priority)
+    return jsonify({"batch_id": batch_id}), 202
+
+
+@tfstack_blueprint.route('/tfstacks:batch', methods=['DELETE'])
+def delete_tf_stack_batch():
+    """Flask blueprint.
+       This is the batch Delete operation, which deletes the terraform stacks of 'resource_ids'.
+
+       Creates a batch of async Celery tasks, with a bounded amount running in parallel.
+
+    Returns:
+        json: json datastructure
+    """
+    tf_dir = current_app.config['TF_DIR']
+    body = request_body()
+
+    resource_ids = body.get('resource_ids')
+    if not isinstance(resource_ids, list) or not 0 < len(resource_ids) <= BATCH_MAX_SIZE \
+            or not all(isinstance(resource_id, str) and resource_id for resource_id in resource_ids):
+        return jsonify({"error": "resource_ids must be a list of 1 to {} ids".format(BATCH_MAX_SIZE)}), 400
+    priority = request_priority()
+    admit_request('delete', cost=len(set(resource_ids)))
+
+    batch_id = start_batch(delete_tf_stack_task, [
+                           {'tf_dir': tf_dir, 'resource_id': resource_id} for resource_id in set(resource_ids)],
+                           priority=priority)
+    return jsonify({"batch_id": batch_id}), 202
+
+
+@tfstack_blueprint.route('/tfstacks/batches/<batch_id>', methods=['GET'])
+def tfstacks_batches_status(batch_id):
+    """Flask blueprint.
+       Retrieves the aggregated status of a batch.
+
+    Returns:
+        json: json datastructure of the status
+    """
+    batch_status = get_batch_status(batch_id)
+    if batch_status is None:
+        return jsonify({"error": "batch not found"}), 404
+    return jsonify(batch_status), 200
+
+
 @tfstack_blueprint.route('/tfstacks/<resource_id>', methods=['GET'])
 def read_tf_stack(resource_id):
     """Flask blueprint.
        This is the Read operation, which results in a terraform state list
        of an existing terraform stack/state.
 
-       Creates the related async Celery task.
+       Answers from the read cache or, when the state backend is configured,
+       from the remote state of the stack when possible (200), otherwise
+       creates the related async Celery task (202), or returns the
+       request_id of an identical read that is already in flight.
+       The query parameter 'refresh=true' bypasses the read cache and the remote state.
 
     Returns:
         json: json datastructure
     """
+    if request.args.get('refresh', 'false').lower() != 'true':
+        cached_result = get_cached_read(resource_id)
+        if cached_result is None and state_reader_enabled():
+            try:
+                cached_result = read_state(resource_id)
+            except Exception as e:
+                if str(e) == 'error:WorkspaceNotExist':
+                    return jsonify({"error": "stack not found"}), 404
+                get_logger().warning("Unable to read the remote state of %s: %s", resource_id, e)
+        if cached_result is not None:
+            return jsonify({"resource_id": resource_id,
+                            "request_status": "SUCCESS",
+                            "request_result": cached_result}), 200
+
     tf_dir = current_app.config['TF_DIR']
-    celery_task = read_tf_stack_task.delay(
-        tf_dir=tf_dir, resource_id=resource_id)
-    return jsonify({"request_id": celery_task.id}), 202
+    admit_request('read')
+    request_id = enqueue_coalesced(
+        read_tf_stack_task, tf_dir=tf_dir, resource_id=resource_id)
+    return jsonify({"request_id": request_id}), 202
 
 
 @tfstack_blueprint.route('/tfstacks/<resource_id>', methods=['DELETE'])
@@ -59,21 +486,53 @@ def delete_tf_stack(resource_id):
        This is the Delete operation, which results in a terraform destroy
        of an existing terraform stack/state.
 
-       Creates the related async Celery task.
+       Creates the related async Celery task, with the optional
+       'priority' query parameter (high, normal or low), or returns
+       the request_id of an identical delete that is already in flight.
+       The optional 'callback_url' (body or query parameter) is notified when the task finishes.
 
     Returns:
         json: json datastructure
     """
     tf_dir = current_app.config['TF_DIR']
-    celery_task = delete_tf_stack_task.delay(
-        tf_dir=tf_dir, resource_id=resource_id)
-    return jsonify({"request_id": celery_task.id}), 202
+    callback_url = request_callback_url(request_body())
+    priority = request_priority()
+    admit_request('delete')
+    request_id = enqueue_coalesced(delete_tf_stack_task, tf_dir=tf_dir, resource_id=resource_id,
+                                   priority=priority, callback_url=callback_url)
+    return jsonify({"request_id": request_id}), 202
+
+
+@tfstack_blueprint.route('/tfstacks/<resource_id>', methods=['PUT'])
+def update_tf_stack(resource_id):
+    """Flask blueprint.
+       This is the Update operation, which reconciles an existing terraform stack
+       with the terraform config: a terraform plan, followed by a terraform apply
+       only when the plan has changes.
+
+       Creates the related async Celery task, with the optional
+       'priority' query parameter (high, normal or low), or returns
+       the request_id of an identical update that is already in flight.
+
+    Returns:
+        json: json datastructure
+    """
+    tf_dir = current_app.config['TF_DIR']
+    priority = request_priority()
+    admit_request('update')
+    request_id = enqueue_coalesced(
+        update_tf_stack_task, tf_dir=tf_dir, resource_id=resource_id, priority=priority)
+    return jsonify({"request_id": request_id}), 202
 
 
 @tfstack_blueprint.route("/tfstacks/requests/<request_id>", methods=["GET"])
 def tfstacks_requests_AsyncResult(request_id):
     """Flask blueprint.
        Retrieves the status of a created async Celery task.
+       The result of a succeeded task is returned as is, the error of a failed task as a string.
+       The verbose content of a result (e.g. the resources of a read) is compacted a while after the first fetch.
+       The optional query parameter 'fields' selects fields of the response,
+       e.g. 'request_status,request_result.resources'.
 
     Returns:
         json: json datastructure of the result
@@ -83,7 +542,127 @@ def tfstacks_requests_AsyncResult(request_id):
     result = {
         "request_id": request_id,
         "request_status": request_result.status,
-        #  very important to convert to str, in case it's the exception
-        "request_result": str(request_result.result)
+        "request_result": request_result.result
     }
+    if request_result.status != "SUCCESS" and request_result.result is not None:
+        #  very important to convert to str, in case it's the exception
+        result["request_result"] = str(request_result.result)
+    if request_result.status == "SUCCESS":
+        schedule_result_compaction(request_id, request_result.result)
+
+    fields = request.args.get('fields')
+    if fields:
+        result = select_fields(result, fields.split(','))
     return jsonify(result), 200
+
+
+@tfstack_blueprint.route("/tfstacks/requests/<request_id>", methods=["DELETE"])
+def tfstacks_requests_cancel(request_id):
+    """Flask blueprint.
+       Cancels a created async Celery task. A queued task is revoked, the Terraform process group
+       of a running task gets SIGINT first, so Terraform releases the state lock, and SIGKILL after a grace period.
+       The task fails with 'error:Cancelled'.
+
+    Returns:
+        json: json datastructure with the request_id and status, 409 when the task already finished,
+            404 for an unknown or expired request_id
+    """
+    # every cancellation broadcasts a revoke to the workers
+    limit_request('cancel')
+    request_result = create_tf_stack_task.AsyncResult(request_id)
+    if not request_known(request_id) and not request_result.ready():
+        return jsonify({"error": "request not found"}), 404
+    if request_result.ready():
+        return jsonify({"request_id": request_id, "request_status": request_result.status}), 409
+
+    cancel_request(request_id)
+    get_logger().info("Cancelled request %s", request_id)
+    return jsonify({"request_id": request_id, "request_status": "CANCELLING"}), 202
+
+
+@tfstack_blueprint.route("/tfstacks/requests:lookup", methods=["POST"])
+def tfstacks_requests_lookup():
+    """Flask blueprint.
+       Retrieves the status of many created async Celery tasks at once,
+       with a single MGET on the result backend.
+       Only the status is returned, and the error in case of a failure.
+
+    Returns:
+        json: json datastructure with the status per request_id
+    """
+    body = request_body()
+
+    request_ids = body.get('request_ids')
+    if not isinstance(request_ids, list) or not 0 < len(request_ids) <= REQUESTS_LOOKUP_MAX_SIZE \
+            or not all(isinstance(request_id, str) and request_id for request_id in request_ids):
+        return jsonify({"error": "request_ids must be a list of 1 to {} ids".format(REQUESTS_LOOKUP_MAX_SIZE)}), 400
+
+    backend = create_tf_stack_task.backend
+    request_metas = backend.mget(
+        [backend.get_key_for_task(request_id) for request_id in request_ids])
+
+    requests = list()
+    for request_id, request_meta in zip(request_ids, request_metas):
+        request_status = {"request_id": request_id,
+                          "request_status": "PENDING"}
+        if request_meta is not None:
+            request_meta = backend.decode_result(request_meta)
+            request_status["request_status"] = request_meta['status']
+            if request_meta['status'] == "FAILURE":
+                request_status["request_error"] = str(request_meta['result'])
+        requests.append(request_status)
+
+    return jsonify({"requests": requests}), 200
+
+
+@tfstack_blueprint.route("/tfstacks/requests/<request_id>/stream", methods=["GET"])
+def tfstacks_requests_stream(request_id):
+    """Flask blueprint.
+       Streams the output of a created async Celery task as Server-Sent Events,
+       until the task has finished, or PROGRESS_MAX_IDLE seconds passed without output.
+       Clients can resume with the Last-Event-ID header.
+
+    Returns:
+        text/event-stream: an event per output line and a final 'end' event with the status,
+            a final 'timeout' event after PROGRESS_MAX_IDLE seconds without output or an 'error' event
+            when the progress can't be read. 404 for an unknown or expired request_id.
+    """
+    if not request_known(request_id) and not create_tf_stack_task.AsyncResult(request_id).ready():
+        return jsonify({"error": "request not found"}), 404
+    last_id = request.headers.get('Last-Event-ID', '0')
+
+    def generate_events(last_id):
+        idle_since = time.time()
+        while True:
+            try:
+                entries = read_progress(
+                    request_id, last_id=last_id, block_ms=PROGRESS_BLOCK_MS)
+                # the stream may have expired or was never published
+                request_result = create_tf_stack_task.AsyncResult(request_id) if not entries else None
+                ready = request_result is not None and request_result.ready()
+            except RedisError as e:
+                get_logger().warning("Unable to read the progress of %s: %s", request_id, e)
+                yield "event: error\ndata: progress unavailable\n\n"
+                return
+
+            if not entries:
+                if ready:
+                    yield "event: end\ndata: {}\n\n".format(request_result.status)
+                    return
+                if time.time() - idle_since >= PROGRESS_MAX_IDLE:
+                    yield "event: timeout\ndata: no progress for {} seconds\n\n".format(PROGRESS_MAX_IDLE)
+                    return
+                yield ": keep-alive\n\n"
+                continue
+
+            idle_since = time.time()
+            for entry_id, fields in entries:
+                last_id = entry_id
+                if 'end' in fields:
+                    yield "id: {}\nevent: end\ndata: {}\n\n".format(entry_id, fields['end'])
+                    return
+                yield "id: {}\ndata: {}\n\n".format(entry_id, fields['line'])
+
+    return Response(stream_with_context(generate_events(last_id)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -0,0 +1,95 @@
+import os
+import json
+import time
+
+from redis.exceptions import RedisError
+
+from utils import get_logger, get_redis_client
+
+
+"""Cache of read_tf_stack results, keyed by resource_id.
+
+The cache is best effort: when redis is unavailable the API and the workers
+simply fall back to running the terraform shell scripts.
+"""
+
+READ_CACHE_TTL = int(os.environ.get("READ_CACHE_TTL", "60"))
+READ_CACHE_MAX_ENTRIES = int(os.environ.get("READ_CACHE_MAX_ENTRIES", "1000"))
+
+READ_CACHE_KEY = "tfstack:read:{resource_id}"
+READ_CACHE_INDEX_KEY = "tfstack:read:index"
+
+
+def get_cached_read(resource_id: str):
+    """
+    Get a cached read_tf_stack result
+
+    Args:
+        resource_id (str): stack/resource id
+
+    Returns:
+        dict: the cached result or None
+    """
+    if READ_CACHE_TTL <= 0:
+        return None
+
+    try:
+        cached = get_redis_client().get(
+            READ_CACHE_KEY.format(resource_id=resource_id))
+    except RedisError as e:
+        get_logger().warning("Unable to read from the read cache: %s", e)
+        return None
+
+    if cached is None:
+        return None
+    return json.loads(cached)
+
+
+def set_cached_read(resource_id: str, result: dict):
+    """
+    Store a read_tf_stack result, evicting the oldest entries
+    when the cache grows beyond READ_CACHE_MAX_ENTRIES
+
+    Args:
+        resource_id (str): stack/resource id
+        result (dict): result of read_tf_stack
+    """
+    if READ_CACHE_TTL <= 0:
+        return
+
+    now = time.time()
+    try:
+        client = get_redis_client()
+        pipeline = client.pipeline()
+        pipeline.setex(READ_CACHE_KEY.format(resource_id=resource_id),
+                       READ_CACHE_TTL, json.dumps(result))
+        pipeline.zadd(READ_CACHE_INDEX_KEY, {resource_id: now})
+        # entries that already expired don't count against the bound
+        pipeline.zremrangebyscore(
+            READ_CACHE_INDEX_KEY, 0, now - READ_CACHE_TTL)
+        pipeline.zcard(READ_CACHE_INDEX_KEY)
+        cache_size = pipeline.execute()[-1]
+
+        if cache_size > READ_CACHE_MAX_ENTRIES:
+            evicted = client.zpopmin(
+                READ_CACHE_INDEX_KEY, cache_size - READ_CACHE_MAX_ENTRIES)
+            client.delete(*[READ_CACHE_KEY.format(resource_id=member.decode('utf8'))
+                            for member, _ in evicted])
+    except RedisError as e:
+        get_logger().warning("Unable to write to the read cache: %s", e)
+
+
+def invalidate_cached_read(resource_id: str):
+    """
+    Remove a read_tf_stack result from the cache
+
+    Args:
+        resource_id (str): stack/resource id
+    """
+    try:
+        pipeline = get_redis_client().pipeline()
+        pipeline.delete(READ_CACHE_KEY.format(resource_id=resource_id))
+        pipeline.zrem(READ_CACHE_INDEX_KEY, resource_id)
+        pipeline.execute()
+    except RedisError as e:
+        get_logger().warning("Unable to invalidate the read cache: %s", e)
@@ -0,0 +1,314 @@
+import os
+import hmac
+import json
+import time
+import random
+import socket
+import hashlib
+import ipaddress
+import urllib.error
+import urllib.request
+from urllib.parse import urlsplit
+
+from redis.exceptions import RedisError
+
+from tfstack_queues import CALLBACK_QUEUE, queue_lengths
+from utils import get_logger, get_redis_client
+
+
+"""Completion callbacks: a request can name a callback URL that is notified when its task finishes,
+instead of polling the request status.
+
+The callback URLs of a request are kept in redis until its task finishes, so coalesced requests
+each get their callback. The completion payload is the request status, like GET /tfstacks/requests/<request_id>,
+and is delivered by a task on CALLBACK_QUEUE with retries and an exponential backoff.
+New deliveries are dropped while CALLBACK_MAX_QUEUED deliveries are waiting.
+
+Callbacks to private, loopback and link-local addresses (e.g. the metadata service or the services of the cluster)
+are denied, unless their host is one of CALLBACK_ALLOWED_HOSTS.
+Every delivery is signed with CALLBACK_SECRET, callbacks are only accepted when it is set.
+The signature is the HMAC-SHA256 of '<timestamp>.<body>', in the X-Tfstack-Signature header
+as 'sha256=<hex digest>', with the timestamp in the X-Tfstack-Timestamp header.
+"""
+
+CALLBACK_SECRET = os.environ.get("CALLBACK_SECRET")
+# comma separated host names, empty allows any host with public addresses
+CALLBACK_ALLOWED_HOSTS = [host.strip().lower() for host in os.environ.get("CALLBACK_ALLOWED_HOSTS", "").split(",")
+                          if host.strip()]
+CALLBACK_MAX_PER_REQUEST = int(os.environ.get("CALLBACK_MAX_PER_REQUEST", "10"))
+CALLBACK_MAX_URL_LENGTH = 2048
+# seconds the callbacks of a request are kept for its task, it must exceed the longest wait and execution
+CALLBACK_EXPIRES = int(os.environ.get("CALLBACK_EXPIRES", "86400"))
+
+CALLBACK_TIMEOUT = float(os.environ.get("CALLBACK_TIMEOUT", "10"))
+CALLBACK_MAX_RETRIES = int(os.environ.get("CALLBACK_MAX_RETRIES", "8"))
+CALLBACK_RETRY_BACKOFF = int(os.environ.get("CALLBACK_RETRY_BACKOFF", "5"))
+CALLBACK_RETRY_BACKOFF_MAX = int(os.environ.get("CALLBACK_RETRY_BACKOFF_MAX", "600"))
+# 0 disables the bound
+CALLBACK_MAX_QUEUED = int(os.environ.get("CALLBACK_MAX_QUEUED", "10000"))
+
+CALLBACKS_KEY = "tfstack:callbacks:{request_id}"
+
+SIGNATURE_HEADER = 'X-Tfstack-Signature'
+TIMESTAMP_HEADER = 'X-Tfstack-Timestamp'
+REQUEST_ID_HEADER = 'X-Tfstack-Request-Id'
+SIGNATURE_TOLERANCE = 300
+
+# responses after which a delivery is retried
+RETRYABLE_STATUSES = (408, 425, 429)
+
+
+class InvalidCallback(Exception):
+    """
+    Raised when a request has an invalid callback URL
+    """
+
+
+class CallbackDeliveryError(Exception):
+    """
+    Raised when a callback is not delivered
+    """
+
+    def __init__(self, message: str, retryable: bool):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class _NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    # a redirect could lead a delivery to a host that is not allowed
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_opener = urllib.request.build_opener(_NoRedirectHandler)
+
+
+def validate_callback_host(hostname: str):
+    """
+    Args:
+        hostname (str): host of a callback URL
+
+    Raises:
+        InvalidCallback: when the host is not allowed, or resolves to an address that is not public
+            while the host isn't one of CALLBACK_ALLOWED_HOSTS
+    """
+    hostname = hostname.lower()
+    if hostname in CALLBACK_ALLOWED_HOSTS:
+        return
+    if CALLBACK_ALLOWED_HOSTS:
+        raise InvalidCallback("callback_url host must be one of {}".format(", ".join(CALLBACK_ALLOWED_HOSTS)))
+
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(hostname, None, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError):
+        raise InvalidCallback("callback_url host {} doesn't resolve".format(hostname))
+    for address in addresses:
+        # the scope of a link-local IPv6 address
+        ip = ipaddress.ip_address(address.split('%')[0])
+        if getattr(ip, 'ipv4_mapped', None) is not None:
+            ip = ip.ipv4_mapped
+        if not ip.is_global or ip.is_multicast:
+            raise InvalidCallback("callback_url host {} resolves to a private address".format(hostname))
+
+
+def validate_callback_url(url):
+    """
+    Args:
+        url (str): the callback URL of a request, None when not given
+
+    Raises:
+        InvalidCallback: when callbacks are not enabled or the URL is invalid
+
+    Returns:
+        str: the callback URL, None when not given
+    """
+    if url is None:
+        return None
+    if not CALLBACK_SECRET:
+        raise InvalidCallback("callbacks are not enabled")
+    if not isinstance(url, str) or len(url) > CALLBACK_MAX_URL_LENGTH:
+        raise InvalidCallback("callback_url must be a URL of at most {} characters".format(CALLBACK_MAX_URL_LENGTH))
+
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise InvalidCallback("callback_url must be an http or https URL")
+    validate_callback_host(parts.hostname)
+    return url
+
+
+def register_callback(request_id: str, url: str):
+    """
+    Register a callback URL to notify when the task of a request finishes
+
+    Args:
+        request_id (str): request id of the Celery task
+        url (str): the callback URL, see validate_callback_url
+
+    Raises:
+        InvalidCallback: when the request has CALLBACK_MAX_PER_REQUEST callbacks already
+    """
+    key = CALLBACKS_KEY.format(request_id=request_id)
+    pipeline = get_redis_client().pipeline()
+    pipeline.sadd(key, url)
+    pipeline.scard(key)
+    pipeline.expire(key, CALLBACK_EXPIRES)
+    added, callbacks, _ = pipeline.execute()
+
+    if added and callbacks > CALLBACK_MAX_PER_REQUEST:
+        get_redis_client().srem(key, url)
+        raise InvalidCallback("request {} has {} callbacks already".format(request_id, CALLBACK_MAX_PER_REQUEST))
+
+
+def pop_callbacks(request_id: str):
+    """
+    Take the callback URLs of a finished request, only one caller gets them
+
+    Args:
+        request_id (str): request id of the Celery task
+
+    Returns:
+        list: the callback URLs, empty when there are none or redis is unavailable
+    """
+    key = CALLBACKS_KEY.format(request_id=request_id)
+    try:
+        pipeline = get_redis_client().pipeline()
+        pipeline.smembers(key)
+        pipeline.delete(key)
+        urls, _ = pipeline.execute()
+    except RedisError as e:
+        get_logger().warning("Unable to get the callbacks of %s: %s", request_id, e)
+        return list()
+    return sorted(url.decode('utf8') for url in urls)
+
+
+def completion_payload(request_id: str, operation: str, status: str, result=None, resource_id: str = None):
+    """
+    Args:
+        request_id (str): request id of the Celery task
+        operation (str): name of the operation: create, read, delete, update
+        status (str): the final state of the task
+        result: the result of a succeeded task, the exception of a failed task
+        resource_id (str): stack/resource id, None for a create
+
+    Returns:
+        dict: the completion payload, with the request_status and request_result of GET /tfstacks/requests/<request_id>
+    """
+    if status != 'SUCCESS' and result is not None:
+        result = str(result)
+    return {
+        'request_id': request_id,
+        'operation': operation,
+        'resource_id': resource_id,
+        'request_status': status,
+        'request_result': result,
+        'finished_at': time.time(),
+    }
+
+
+def sign_payload(body: bytes, timestamp: int, secret: str):
+    """
+    Args:
+        body (bytes): the encoded payload
+        timestamp (int): epoch time of the delivery
+        secret (str): the shared secret
+
+    Returns:
+        str: the value of the signature header
+    """
+    message = '{}.'.format(timestamp).encode('utf8') + body
+    return 'sha256=' + hmac.new(secret.encode('utf8'), message, hashlib.sha256).hexdigest()
+
+
+def verify_signature(body: bytes, timestamp: str, signature: str, secret: str,
+                     tolerance: int = SIGNATURE_TOLERANCE, now: float = None):
+    """
+    Verification of a delivery by a receiver
+
+    Args:
+        body (bytes): the request body
+        timestamp (str): the value of the timestamp header
+        signature (str): the value of the signature header
+        secret (str): the shared secret
+        tolerance (int): maximum age of the delivery in seconds, against replays
+        now (float): epoch time
+
+    Returns:
+        bool: whether the signature is valid
+    """
+    try:
+        timestamp = int(timestamp)
+    except (TypeError, ValueError):
+        return False
+    now = time.time() if now is None else now
+    if abs(now - timestamp) > tolerance or not signature:
+        return False
+    return hmac.compare_digest(sign_payload(body, timestamp, secret), signature)
+
+
+def deliver_callback(url: str, payload: dict, secret: str = None, timeout: float = CALLBACK_TIMEOUT):
+    """
+    POST the signed payload to a callback URL, every attempt is signed with its own timestamp
+
+    Args:
+        url (str): the callback URL
+        payload (dict): the completion payload
+        secret (str): the shared secret, CALLBACK_SECRET by default
+        timeout (float): seconds
+
+    Raises:
+        CallbackDeliveryError: when the receiver is unreachable or doesn't answer with a 2xx status
+
+    Returns:
+        int: the response status
+    """
+    # the host resolves again, its addresses could have changed since the callback was registered
+    try:
+        validate_callback_host(urlsplit(url).hostname or '')
+    except InvalidCallback as e:
+        raise CallbackDeliveryError(str(e), retryable=False)
+
+    body = json.dumps(payload, sort_keys=True, default=str).encode('utf8')
+    timestamp = int(time.time())
+    request = urllib.request.Request(url, data=body, method='POST', headers={
+        'Content-Type': 'application/json',
+        'User-Agent': 'tfstack-api',
+        SIGNATURE_HEADER: sign_payload(body, timestamp, secret or CALLBACK_SECRET),
+        TIMESTAMP_HEADER: str(timestamp),
+        REQUEST_ID_HEADER: payload['request_id'],
+    })
+
+    try:
+        with _opener.open(request, timeout=timeout) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        e.close()
+        raise CallbackDeliveryError("Callback answered with status {}".format(e.code),
+                                    retryable=e.code >= 500 or e.code in RETRYABLE_STATUSES)
+    except (urllib.error.URLError, OSError) as e:
+        raise CallbackDeliveryError("Callback unreachable: {}".format(getattr(e, 'reason', e)), retryable=True)
+
+
+def retry_countdown(retries: int, backoff: int = CALLBACK_RETRY_BACKOFF,
+                    backoff_max: int = CALLBACK_RETRY_BACKOFF_MAX):
+    """
+    Exponential backoff with full jitter, like the retry_backoff of Celery
+
+    Args:
+        retries (int): amount of retries so far
+        backoff (int): seconds before the first retry, at most
+        backoff_max (int): maximum seconds before a retry
+
+    Returns:
+        int: seconds before the next retry
+    """
+    return random.randint(0, min(backoff_max, backoff * 2 ** retries))
+
+
+def callback_queue_full():
+    """
+    Returns:
+        bool: whether CALLBACK_MAX_QUEUED deliveries are waiting, False when the bound is disabled
+    """
+    if CALLBACK_MAX_QUEUED <= 0:
+        return False
+    return queue_lengths(queues=[CALLBACK_QUEUE])[CALLBACK_QUEUE] >= CALLBACK_MAX_QUEUED
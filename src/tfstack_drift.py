@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import uuid
+
+from redis.exceptions import RedisError
+
+from tfstack_inventory import INVENTORY_KEY
+from utils import get_logger, get_redis_client
+
+
+"""Drift detection of the stacks: the sweep of the stack inventory and the drift report, in redis.
+
+A sweep walks the inventory in order of creation, a page at a time. The checkpoint of the sweep
+(the creation time and resource_id of the last stack that was walked) lets every step, and a sweep that was interrupted,
+continue where the previous step stopped. Stacks that were checked less than DRIFT_CHECK_INTERVAL seconds ago
+are skipped, that includes stacks of which a plan or apply found no changes, so a sweep only checks
+what is not known to be in sync.
+
+The drift report keeps the last drift check per stack, and an index of the drifted stacks.
+"""
+
+# seconds between the start of two sweeps, 0 disables the sweeps
+DRIFT_SWEEP_INTERVAL = int(os.environ.get("DRIFT_SWEEP_INTERVAL", "0"))
+# seconds between the steps of a sweep (the celery beat schedule)
+DRIFT_SWEEP_TICK = int(os.environ.get("DRIFT_SWEEP_TICK", "60"))
+DRIFT_SWEEP_PAGE_SIZE = int(os.environ.get("DRIFT_SWEEP_PAGE_SIZE", "100"))
+# drift checks that run at a time, over all workers
+DRIFT_MAX_PARALLEL = int(os.environ.get("DRIFT_MAX_PARALLEL", "5"))
+DRIFT_CHECK_INTERVAL = int(os.environ.get("DRIFT_CHECK_INTERVAL", "43200"))
+
+DRIFT_SWEEP_KEY = "tfstack:drift:sweep"
+DRIFT_REPORT_KEY = "tfstack:drift:report"
+DRIFT_CHECKED_KEY = "tfstack:drift:checked"
+DRIFT_DRIFTED_KEY = "tfstack:drift:drifted"
+
+# status of a sweep
+RUNNING = 'running'
+FINISHED = 'finished'
+
+
+def get_sweep():
+    """
+    Get the current or last sweep
+
+    Returns:
+        dict: the sweep or None when there was none
+    """
+    sweep = get_redis_client().hgetall(DRIFT_SWEEP_KEY)
+    if not sweep:
+        return None
+    sweep = {k.decode('utf8'): v.decode('utf8') for k, v in sweep.items()}
+    return {
+        'sweep_id': sweep['sweep_id'],
+        'status': sweep['status'],
+        'started_at': float(sweep['started_at']),
+        'finished_at': float(sweep['finished_at']) if sweep.get('finished_at') else None,
+        'cursor': sweep.get('cursor') or None,
+        'batch_id': sweep.get('batch_id') or None,
+        'enqueued': int(sweep.get('enqueued', 0)),
+        'skipped': int(sweep.get('skipped', 0)),
+        'checked': int(sweep.get('checked', 0)),
+        'drifted': int(sweep.get('drifted', 0)),
+        'failed': int(sweep.get('failed', 0)),
+    }
+
+
+def sweep_due(sweep: dict, now: float, interval: int = DRIFT_SWEEP_INTERVAL):
+    """
+    Args:
+        sweep (dict): the current or last sweep, see get_sweep
+        now (float): epoch time
+        interval (int): seconds between the start of two sweeps
+
+    Returns:
+        bool: whether a new sweep is due
+    """
+    if sweep is None:
+        return True
+    return sweep['status'] == FINISHED and now - sweep['started_at'] >= interval
+
+
+def start_sweep(now: float):
+    """
+    Start a new sweep from the start of the inventory
+
+    Args:
+        now (float): epoch time
+
+    Returns:
+        dict: the new sweep
+    """
+    pipeline = get_redis_client().pipeline()
+    pipeline.delete(DRIFT_SWEEP_KEY)
+    pipeline.hset(DRIFT_SWEEP_KEY, mapping={
+        'sweep_id': str(uuid.uuid4()),
+        'status': RUNNING,
+        'started_at': now,
+    })
+    pipeline.execute()
+    return get_sweep()
+
+
+def parse_sweep_cursor(cursor: str):
+    """
+    Args:
+        cursor (str): '<creation time> <resource_id>' of the last stack that was walked, None at the start of a sweep
+
+    Returns:
+        tuple: (creation time, resource_id), None at the start of a sweep
+    """
+    if not cursor:
+        return None
+    score, _, resource_id = cursor.partition(' ')
+    return float(score), resource_id
+
+
+def next_sweep_page(cursor: str, now: float, page_size: int = DRIFT_SWEEP_PAGE_SIZE,
+                    check_interval: int = DRIFT_CHECK_INTERVAL):
+    """
+    Walks the inventory from the checkpoint of a sweep, up to page_size stacks that need a drift check.
+    Stacks are ordered by creation time and resource_id, like the inventory, so stacks that were created
+    at the same time are neither skipped nor walked twice.
+
+    Args:
+        cursor (str): the cursor after the previous page, see parse_sweep_cursor, None at the start of a sweep
+        now (float): epoch time
+        page_size (int): maximum amount of stacks
+        check_interval (int): seconds after which a stack needs another drift check
+
+    Returns:
+        tuple: (resource_ids, amount of skipped stacks, the cursor after the page, None when the sweep is done)
+    """
+    client = get_redis_client()
+    resource_ids, skipped = list(), 0
+    after = parse_sweep_cursor(cursor)
+    offset = 0
+
+    while len(resource_ids) < page_size:
+        start = after[0] if after else None
+        page = client.zrangebyscore(INVENTORY_KEY, repr(start) if after else '-inf', '+inf',
+                                    start=offset, num=page_size, withscores=True)
+        if not page:
+            break
+        # the stacks created at the time of the cursor, up to the cursor, were walked already
+        stacks = [stack for stack in ((score, resource_id.decode('utf8')) for resource_id, score in page)
+                  if after is None or stack > after]
+
+        pipeline = client.pipeline()
+        for _, resource_id in stacks:
+            pipeline.zscore(DRIFT_CHECKED_KEY, resource_id)
+        for stack, checked_at in zip(stacks, pipeline.execute()):
+            if len(resource_ids) == page_size:
+                break
+            after = stack
+            if checked_at is not None and now - checked_at < check_interval:
+                skipped += 1
+            else:
+                resource_ids.append(stack[1])
+        # the next range starts at the creation time of the cursor, past the stacks of that time that were walked
+        offset = offset + len(page) if after is not None and after[0] == start else 0
+
+    if not resource_ids:
+        return resource_ids, skipped, None
+    return resource_ids, skipped, '{!r} {}'.format(*after)
+
+
+def update_sweep(fields: dict, increments: dict = None):
+    """
+    Update the checkpoint and counters of the current sweep
+
+    Args:
+        fields (dict): fields to set, e.g. 'cursor' and 'batch_id'
+        increments (dict): counters to increment, e.g. 'enqueued' and 'skipped'
+    """
+    pipeline = get_redis_client().pipeline()
+    if fields:
+        pipeline.hset(DRIFT_SWEEP_KEY, mapping=fields)
+    for field, amount in (increments or {}).items():
+        pipeline.hincrby(DRIFT_SWEEP_KEY, field, amount)
+    pipeline.execute()
+
+
+def finish_sweep(now: float):
+    """
+    Finish the current sweep
+
+    Args:
+        now (float): epoch time
+    """
+    update_sweep({'status': FINISHED, 'finished_at': now, 'cursor': '', 'batch_id': ''})
+
+
+def record_drift(resource_id: str, result: dict = None, error: str = None, sweep_id: str = None):
+    """
+    Record the drift check of a stack in the drift report
+
+    Args:
+        resource_id (str): stack/resource id
+        result (dict): result of drift_tf_stack, or of a plan or apply that found the stack in sync
+        error (str): the error of a failed drift check
+        sweep_id (str): the sweep the drift check is part of
+    """
+    now = time.time()
+    drifted = bool(result and result['drifted'])
+    report = {
+        'resource_id': resource_id,
+        'checked_at': now,
+        'drifted': drifted,
+        'resources': result['resources'] if result else [],
+        'error': error,
+    }
+    try:
+        client = get_redis_client()
+        current_sweep_id = client.hget(DRIFT_SWEEP_KEY, 'sweep_id')
+
+        pipeline = client.pipeline()
+        pipeline.hset(DRIFT_REPORT_KEY, resource_id, json.dumps(report))
+        if error is None:
+            pipeline.zadd(DRIFT_CHECKED_KEY, {resource_id: now})
+        if drifted:
+            pipeline.zadd(DRIFT_DRIFTED_KEY, {resource_id: now})
+        elif error is None:
+            pipeline.zrem(DRIFT_DRIFTED_KEY, resource_id)
+        if sweep_id and current_sweep_id is not None and current_sweep_id.decode('utf8') == sweep_id:
+            pipeline.hincrby(DRIFT_SWEEP_KEY, 'failed' if error else 'checked', 1)
+            if drifted:
+                pipeline.hincrby(DRIFT_SWEEP_KEY, 'drifted', 1)
+        pipeline.execute()
+    except RedisError as e:
+        get_logger().warning("Unable to record the drift check of %s: %s", resource_id, e)
+
+
+def remove_drift(resource_id: str):
+    """
+    Remove a stack from the drift report
+
+    Args:
+        resource_id (str): stack/resource id
+    """
+    try:
+        pipeline = get_redis_client().pipeline()
+        pipeline.hdel(DRIFT_REPORT_KEY, resource_id)
+        pipeline.zrem(DRIFT_CHECKED_KEY, resource_id)
+        pipeline.zrem(DRIFT_DRIFTED_KEY, resource_id)
+        pipeline.execute()
+    except RedisError as e:
+        get_logger().warning("Unable to remove %s from the drift report: %s", resource_id, e)
+
+
+def get_drift_report(offset: int = 0, limit: int = 100, drifted_only: bool = True):
+    """
+    Get the drift report, most recently checked stacks first
+
+    Args:
+        offset (int): amount of stacks to skip
+        limit (int): maximum amount of stacks to return
+        drifted_only (bool): only return the drifted stacks
+
+    Returns:
+        dict: the current or last 'sweep', the 'total' amount of (drifted) stacks and the 'stacks'
+    """
+    client = get_redis_client()
+    index_key = DRIFT_DRIFTED_KEY if drifted_only else DRIFT_CHECKED_KEY
+
+    pipeline = client.pipeline()
+    pipeline.zcard(index_key)
+    pipeline.zrevrange(index_key, offset, offset + limit - 1)
+    total, resource_ids = pipeline.execute()
+
+    stacks = list()
+    if resource_ids:
+        for report in client.hmget(DRIFT_REPORT_KEY, resource_ids):
+            if report is not None:
+                stacks.append(json.loads(report))
+
+    return {'sweep': get_sweep(), 'total': total, 'stacks': stacks}
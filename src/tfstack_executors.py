@@ -1,36 +1,272 @@
+import os
 import re
+import json
+import time
 import subprocess
+from collections import deque
+from tfstack_metrics import EXECUTOR_STAGE_DURATION, SUBPROCESSES_IN_FLIGHT
+from tfstack_supervision import ProcessWatchdog
+from tfstack_workdirs import WORKDIR_INITIALIZED_ENV, workdir_initialized
 from utils import get_logger
 
 
-def parse_process_output(process: subprocess.Popen):
+OUTPUT_TAIL_SIZE = 50
+
+CREATE_SCRIPT_ERRORS = ['error:ExistingWorkspaceContainsResources']
+DELETE_SCRIPT_ERRORS = ['error:IdNotSpecified', 'error:WorkspaceNotExist']
+READ_SCRIPT_ERRORS = ['error:IdNotSpecified', 'error:WorkspaceNotExist']
+PLAN_SCRIPT_ERRORS = ['error:IdNotSpecified', 'error:WorkspaceNotExist']
+UPDATE_SCRIPT_ERRORS = ['error:IdNotSpecified', 'error:WorkspaceNotExist']
+DRIFT_SCRIPT_ERRORS = ['error:IdNotSpecified', 'error:WorkspaceNotExist']
+
+# exit codes of 'terraform plan -detailed-exitcode'
+PLAN_NO_CHANGES = 0
+PLAN_CHANGES = 2
+PLAN_SUMMARY = re.compile(r'Plan: (\d+) to add, (\d+) to change, (\d+) to destroy')
+# a resource that changed outside of Terraform, in the output of a refresh-only plan
+DRIFTED_RESOURCE = re.compile(r'# (\S+) has (changed|been deleted)')
+
+TF_WORKSPACE_LIST_CMD = os.environ.get(
+    "TF_WORKSPACE_LIST_CMD", "terraform init -input=false > /dev/null && terraform workspace list")
+
+# a step of a resource address, e.g. 'module', 'aws_instance' or 'this["a"]'
+ADDRESS_STEP = re.compile(r'([A-Za-z_][A-Za-z0-9_-]*)(?:\[("(?:[^"\\]|\\.)*"|[0-9]+)\])?(?:\.|$)')
+
+
+def iter_process_output(process: subprocess.Popen):
     """
-    Parses and print output from subprocess.Popen
+    Generator that yields the output lines from subprocess.Popen as they arrive.
+    Every line is logged, nothing is kept in memory.
 
     Args:
         process (subprocess.Popen): subprocess.Popen
 
-    Returns:
-        list: output from process
+    Yields:
+        str: stripped output line
     """
     logger = get_logger()
 
-    # process output
-    piped_output = list()
-    resource_id_line = ''
-    error_line = ''
-
-    while True:
-        # stream
-        line = process.stdout.readline()
-        if not line:
-            break
+    for line in iter(process.stdout.readline, b''):
         line_stripped = line.decode('utf8', errors='strict').strip()
         logger.info(line_stripped)
-        piped_output.append(line_stripped)
+        yield line_stripped
 
     process.wait()
-    return piped_output
+
+
+class OutputScanner:
+    """
+    Scans output lines in a single pass, while they are streamed.
+    Only the structured outcome and a bounded tail of the output are kept.
+    """
+
+    def __init__(self, script_errors: list = (), resource_id_grep_pattern: str = None,
+                 collect_output: bool = False, tail_size: int = OUTPUT_TAIL_SIZE, on_line=None):
+        """
+        Args:
+            script_errors (list): script error markers to look for
+            resource_id_grep_pattern (str): pattern of the line containing the resource_id
+            collect_output (bool): keep all output lines, for output that is the result itself
+            tail_size (int): amount of last output lines to keep for diagnostics
+            on_line (callable): optional callback that receives every output line, to publish progress
+        """
+        self.script_errors = script_errors
+        self.resource_id_grep_pattern = resource_id_grep_pattern
+        self.collect_output = collect_output
+        self.on_line = on_line
+
+        self.resource_id = None
+        self.script_error = None
+        self.output = list()
+        self.tail = deque(maxlen=tail_size)
+        self._resource_id_line_found = False
+        self.parse_seconds = 0.0
+
+    def scan(self, line: str):
+        """
+        Scans a single output line
+
+        Args:
+            line (str): output line
+        """
+        started = time.perf_counter()
+        self._scan(line)
+        self.parse_seconds += time.perf_counter() - started
+
+    def _scan(self, line: str):
+        self.tail.append(line)
+        if self.on_line:
+            self.on_line(line)
+        if self.collect_output:
+            self.output.append(line)
+
+        if self.script_error is None:
+            self.script_error = match_script_error(line, self.script_errors)
+
+        # only the first line containing the pattern holds the resource_id
+        if self.resource_id_grep_pattern and not self._resource_id_line_found \
+                and self.resource_id_grep_pattern in line:
+            self._resource_id_line_found = True
+            self.resource_id = match_resource_id(
+                line, self.resource_id_grep_pattern)
+
+    def outcome(self):
+        """
+        Returns:
+            dict: 'resource_id', 'script_error', 'tail' and 'output' when collected
+        """
+        outcome = {
+            'resource_id': self.resource_id,
+            'script_error': self.script_error,
+            'tail': list(self.tail),
+        }
+        if self.collect_output:
+            outcome['output'] = self.output
+        return outcome
+
+
+def parse_process_output(process: subprocess.Popen, script_errors: list = (),
+                         resource_id_grep_pattern: str = None, collect_output: bool = False,
+                         tail_size: int = OUTPUT_TAIL_SIZE, on_line=None, operation: str = None,
+                         timeout: int = None, cancelled=None):
+    """
+    Parses the output from subprocess.Popen in a single pass, while it is streamed.
+    Only the structured outcome and a bounded tail of the output are kept.
+    The process group is terminated when it exceeds the timeout, when the request is cancelled
+    or when the parsing is interrupted.
+
+    Args:
+        process (subprocess.Popen): subprocess.Popen
+        script_errors (list): script error markers to look for
+        resource_id_grep_pattern (str): pattern of the line containing the resource_id
+        collect_output (bool): keep all output lines, for output that is the result itself
+        tail_size (int): amount of last output lines to keep for diagnostics
+        on_line (callable): optional callback that receives every output line, to publish progress
+        operation (str): name of the operation for the metrics: create, read, delete
+        timeout (int): seconds, None for no time limit
+        cancelled (callable): returns True when the request is cancelled
+
+    Raises:
+        Exception: "Timeout during execution of Terraform executor"
+        Exception: "error:Cancelled"
+
+    Returns:
+        dict: 'resource_id', 'script_error', 'tail' and 'output' when collected
+    """
+    scanner = OutputScanner(script_errors=script_errors, resource_id_grep_pattern=resource_id_grep_pattern,
+                            collect_output=collect_output, tail_size=tail_size, on_line=on_line)
+
+    watchdog = ProcessWatchdog(process, operation, timeout, cancelled)
+    with watchdog:
+        if operation is None:
+            for line in iter_process_output(process):
+                scanner.scan(line)
+        else:
+            with SUBPROCESSES_IN_FLIGHT.labels(operation).track_inprogress():
+                for line in iter_process_output(process):
+                    scanner.scan(line)
+            EXECUTOR_STAGE_DURATION.labels(
+                operation, 'parse').observe(scanner.parse_seconds)
+    watchdog.raise_for_reason()
+    return scanner.outcome()
+
+
+def spawn_script(cmd: str, tf_dir: str, operation: str, variables: dict = None):
+    """
+    Spawns a Terraform shell script
+
+    Args:
+        cmd (str): the script and its arguments
+        tf_dir (str): the path to the directory containing terraform execution shell scripts
+        operation (str): name of the operation for the metrics: create, read, delete, list
+        variables (dict): input variables of the stack, passed as TF_VAR_<name>
+
+    Raises:
+        Exception: "Unable to execute Terraform executor"
+
+    Returns:
+        subprocess.Popen: the script process
+    """
+    started = time.perf_counter()
+    try:
+        process = subprocess.Popen(cmd,
+                                   shell=True,
+                                   executable='/bin/sh',
+                                   cwd=tf_dir,
+                                   env=script_env(variables, workdir_initialized(tf_dir)),
+                                   stdout=subprocess.PIPE,
+                                   # the script leads a process group, that includes terraform
+                                   start_new_session=True)
+    except Exception:
+        error_message = "Unable to execute Terraform executor"
+        raise Exception(error_message)
+    EXECUTOR_STAGE_DURATION.labels(operation, 'fork').observe(
+        time.perf_counter() - started)
+    return process
+
+
+def script_env(variables: dict = None, initialized: bool = False):
+    """
+    Environment of a Terraform shell script, with the input variables as TF_VAR_<name>.
+    Strings are passed as is, other values as JSON, which Terraform parses for numbers,
+    bools, lists and maps. In an initialized working directory TF_WORKDIR_INITIALIZED=1
+    tells the script to skip its 'terraform init'.
+
+    Args:
+        variables (dict): input variables of the stack
+        initialized (bool): whether the working directory is initialized, see tfstack_workdirs
+
+    Returns:
+        dict: the environment or None to inherit the environment of the worker
+    """
+    if not variables and not initialized:
+        return None
+    env = dict(os.environ)
+    if initialized:
+        env[WORKDIR_INITIALIZED_ENV] = '1'
+    for name, value in (variables or {}).items():
+        env['TF_VAR_' + name] = value if isinstance(value, str) else json.dumps(value)
+    return env
+
+
+def match_script_error(line: str, script_errors: list):
+    """
+    Match a script error in a single output line
+
+    Args:
+        line (str): output line
+        script_errors (list): script error markers
+
+    Returns:
+        str: the first matching script error or None
+    """
+    for i in script_errors:
+        if i in line:
+            return i
+    return None
+
+
+def match_resource_id(line: str, resource_id_grep_pattern: str):
+    """
+    Match the resource_id in a single line of terraform output
+
+    Args:
+        line (str): output line
+        resource_id_grep_pattern (str): pattern of the line containing the resource_id
+
+    Returns:
+        str: resource id or None
+    """
+    if resource_id_grep_pattern not in line:
+        return None
+
+    # specific terraform output
+    regex_result_list = re.findall('"([^"]*)"', line)
+    if len(regex_result_list) != 1:
+        return None
+    else:
+        resource_id = regex_result_list[0]
+        return resource_id
 
 
 def grep_script_error(process_output: list, script_errors: list):
@@ -46,9 +282,9 @@ def grep_script_error(process_output: list, script_errors: list):
     """
     # loop through the output lines
     for line in process_output:
-        for i in script_errors:
-            if i in line:
-                return i
+        script_error = match_script_error(line, script_errors)
+        if script_error:
+            return script_error
     return None
 
 
@@ -64,25 +300,35 @@ def grep_resource_id(process_output: list, resource_id_grep_pattern: str):
         str: resource id
     """
     # loop through the output lines
-
-    resource_id_line = None
     for line in process_output:
         if resource_id_grep_pattern in line:
-            resource_id_line = line
-            break
-    if not resource_id_line:
-        return None
+            return match_resource_id(line, resource_id_grep_pattern)
+    return None
 
-    # specific terraform output
-    regex_result_list = re.findall('"([^"]*)"', resource_id_line)
-    if len(regex_result_list) != 1:
-        return None
+
+def raise_executor_error(process_outcome: dict):
+    """
+    Raises the error of a failed Terraform executor, based on the parsed output
+
+    Args:
+        process_outcome (dict): outcome of parse_process_output
+
+    Raises:
+        Exception: the matched script error
+        Exception: "Unknown error occured during execution of Terraform executor"
+    """
+    logger = get_logger()
+
+    if process_outcome['script_error']:
+        error_message = process_outcome['script_error']
     else:
-        resource_id = regex_result_list[0]
-        return resource_id
+        error_message = "Unknown error occured during execution of Terraform executor"
+        logger.error("\n".join(process_outcome['tail']))
+    raise Exception(error_message)
 
 
-def create_tf_stack(tf_dir):
+def create_tf_stack(tf_dir, on_line=None, variables: dict = None,
+                    timeout: int = None, cancelled=None):
     """
     Executes the terraform shell script create_tfstack.
     Handles the output and errors. 
@@ -99,6 +345,10 @@ def create_tf_stack(tf_dir):
 
     Args:
         tf_dir (str): the path to the directory containing terraform execution shell scripts
+        on_line (callable): optional callback that receives every output line
+        variables (dict): input variables of the stack, passed as TF_VAR_<name>
+        timeout (int): seconds, None for no time limit
+        cancelled (callable): returns True when the request is cancelled
 
     Raises:
         Exception: "Unable to execute Terraform executor"
@@ -109,28 +359,35 @@ def create_tf_stack(tf_dir):
     Returns:
         str: 'message': "TFstack created succesfully"
     """
-    logger = get_logger()
+    cmd = './create_tfstack.sh'
+    process = spawn_script(cmd, tf_dir, 'create', variables)
 
-    script_errors = ['error:ExistingWorkspaceContainsResources']
+    # process output
+    process_outcome = parse_process_output(
+        process, script_errors=CREATE_SCRIPT_ERRORS, resource_id_grep_pattern='resource_id',
+        on_line=on_line, operation='create',
+        timeout=timeout, cancelled=cancelled)
 
-    try:
-        cmd = './create_tfstack.sh'
-        process = subprocess.Popen(cmd,
-                                   shell=True,
-                                   executable='/bin/sh',
-                                   cwd=tf_dir,
-                                   stdout=subprocess.PIPE)
-    except Exception:
-        error_message = "Unable to execute Terraform executor"
-        raise Exception(error_message)
+    return evaluate_create_tf_stack(process.returncode, process_outcome)
 
-    # process output
-    process_output = parse_process_output(process)
-    logger.info(process_output)
-    # evaluate script process
-    if process.returncode == 0:
-        resource_id = grep_resource_id(
-            process_output=process_output, resource_id_grep_pattern='resource_id')
+
+def evaluate_create_tf_stack(returncode: int, process_outcome: dict):
+    """
+    Evaluates the executed terraform shell script create_tfstack
+
+    Args:
+        returncode (int): return code of the script process
+        process_outcome (dict): outcome of the parsed output
+
+    Raises:
+        Exception: "Error! Executed Terraform executor succesfully, but did not get an resource_id back"
+        Exception: the matched script error or "Unknown error occured during execution of Terraform executor"
+
+    Returns:
+        str: 'message': "TFstack created succesfully"
+    """
+    if returncode == 0:
+        resource_id = process_outcome['resource_id']
         if resource_id:
             message = {
                 'message': "TFstack created succesfully",
@@ -141,15 +398,11 @@ def create_tf_stack(tf_dir):
             error_message = "Error! Executed Terraform executor succesfully, but did not get an resource_id back"
             raise Exception(error_message)
     else:
-        script_error = grep_script_error(process_output, script_errors)
-        if script_error:
-            error_message = script_error
-        else:
-            error_message = "Unknown error occured during execution of Terraform executor"
-        raise Exception(error_message)
+        raise_executor_error(process_outcome)
 
 
-def delete_tf_stack(tf_dir: str, resource_id: str):
+def delete_tf_stack(tf_dir: str, resource_id: str, on_line=None, variables: dict = None,
+                    timeout: int = None, cancelled=None):
     """
     Executes the terraform shell script delete_tfstack.
     Handles the output and errors. 
@@ -164,6 +417,10 @@ def delete_tf_stack(tf_dir: str, resource_id: str):
     Args:
         tf_dir (str): the path to the directory containing terraform execution shell scripts
         resource_id (str): stack/resource id
+        on_line (callable): optional callback that receives every output line
+        variables (dict): input variables of the stack, passed as TF_VAR_<name>
+        timeout (int): seconds, None for no time limit
+        cancelled (callable): returns True when the request is cancelled
 
     Raises:
         Exception: "Unable to execute Terraform executor"
@@ -174,40 +431,43 @@ def delete_tf_stack(tf_dir: str, resource_id: str):
     """
     logger = get_logger()
 
-    script_errors = ['error:IdNotSpecified', 'error:WorkspaceNotExist']
+    logger.info(resource_id)
+    cmd = './delete_tfstack.sh' + ' ' + resource_id
+    process = spawn_script(cmd, tf_dir, 'delete', variables)
 
-    try:
-        logger.info(id)
-        cmd = './delete_tfstack.sh' + ' ' + resource_id
+    # process output
+    process_outcome = parse_process_output(
+        process, script_errors=DELETE_SCRIPT_ERRORS, on_line=on_line, operation='delete',
+        timeout=timeout, cancelled=cancelled)
 
-        process = subprocess.Popen(cmd,
-                                   shell=True,
-                                   executable='/bin/sh',
-                                   cwd=tf_dir,
-                                   stdout=subprocess.PIPE)
-    except Exception:
-        error_message = "Unable to execute Terraform executor"
-        raise Exception(error_message)
+    return evaluate_delete_tf_stack(process.returncode, process_outcome)
 
-    # process output
-    process_output = parse_process_output(process)
 
-    # evaluate script process
-    if process.returncode == 0:
+def evaluate_delete_tf_stack(returncode: int, process_outcome: dict):
+    """
+    Evaluates the executed terraform shell script delete_tfstack
+
+    Args:
+        returncode (int): return code of the script process
+        process_outcome (dict): outcome of the parsed output
+
+    Raises:
+        Exception: the matched script error or "Unknown error occured during execution of Terraform executor"
+
+    Returns:
+        str: "TFstack" + " deleted succesfully"
+    """
+    if returncode == 0:
         message = {
             'message': "TFstack deleted succesfully",
         }
         return message
     else:
-        script_error = grep_script_error(process_output, script_errors)
-        if script_error:
-            error_message = script_error
-        else:
-            error_message = "Unknown error occured during execution of Terraform executor"
-        raise Exception(error_message)
+        raise_executor_error(process_outcome)
 
 
-def read_tf_stack(tf_dir: str, resource_id: str):
+def read_tf_stack(tf_dir: str, resource_id: str, on_line=None, variables: dict = None,
+                  timeout: int = None, cancelled=None):
     """
     Executes the terraform shell script read_tfstack.
     Handles the output and errors. 
@@ -219,9 +479,12 @@ def read_tf_stack(tf_dir: str, resource_id: str):
 
     Args:
         tf_dir (str): the path to the directory containing terraform execution shell scripts
-        id (str): stack/resource id    
+        resource_id (str): stack/resource id
+        on_line (callable): optional callback that receives every output line
+        variables (dict): input variables of the stack, passed as TF_VAR_<name>
+        timeout (int): seconds, None for no time limit
+        cancelled (callable): returns True when the request is cancelled
 
-    Raises:
     Raises:
         Exception: "Unable to execute Terraform executor"
         Exception: "Unknown error occured during execution of Terraform executor",
@@ -231,35 +494,343 @@ def read_tf_stack(tf_dir: str, resource_id: str):
     """
     logger = get_logger()
 
-    script_errors = ['error:IdNotSpecified', 'error:WorkspaceNotExist']
+    logger.info(resource_id)
+    cmd = './read_tfstack.sh' + ' ' + resource_id
+    process = spawn_script(cmd, tf_dir, 'read', variables)
 
-    try:
-        logger.info(id)
-        cmd = './read_tfstack.sh' + ' ' + resource_id
+    # process output, which is the result of the read operation
+    process_outcome = parse_process_output(
+        process, script_errors=READ_SCRIPT_ERRORS, collect_output=True, on_line=on_line, operation='read',
+        timeout=timeout, cancelled=cancelled)
 
-        process = subprocess.Popen(cmd,
-                                   shell=True,
-                                   executable='/bin/sh',
-                                   cwd=tf_dir,
-                                   stdout=subprocess.PIPE)
-    except Exception:
-        error_message = "Unable to execute Terraform executor"
-        raise Exception(error_message)
+    return evaluate_read_tf_stack(process.returncode, process_outcome)
 
-    # process output
-    process_output = parse_process_output(process)
 
-    # evaluate script process
-    if process.returncode == 0:
+def evaluate_read_tf_stack(returncode: int, process_outcome: dict):
+    """
+    Evaluates the executed terraform shell script read_tfstack
+
+    Args:
+        returncode (int): return code of the script process
+        process_outcome (dict): outcome of the parsed output, including the collected output
+
+    Raises:
+        Exception: the matched script error or "Unknown error occured during execution of Terraform executor"
+
+    Returns:
+        dict : containing message of status of succesful terraform operation, including result
+    """
+    if returncode == 0:
         message = {
             'message': "TFstack read succesfully",
-            'content': process_output
+            'resources': parse_state_list(process_outcome['output'])
         }
         return message
     else:
-        script_error = grep_script_error(process_output, script_errors)
-        if script_error:
-            error_message = script_error
-        else:
-            error_message = "Unknown error occured during execution of Terraform executor"
-        raise Exception(error_message)
+        raise_executor_error(process_outcome)
+
+
+def plan_tf_stack(tf_dir: str, resource_id: str, on_line=None, variables: dict = None,
+                  timeout: int = None, cancelled=None):
+    """
+    Executes the terraform shell script plan_tfstack, which runs
+    'terraform plan -detailed-exitcode' in the workspace of the stack and exits with its exit code.
+
+    Args:
+        tf_dir (str): the path to the directory containing terraform execution shell scripts
+        resource_id (str): stack/resource id
+        on_line (callable): optional callback that receives every output line
+        variables (dict): input variables of the stack, passed as TF_VAR_<name>
+        timeout (int): seconds, None for no time limit
+        cancelled (callable): returns True when the request is cancelled
+
+    Raises:
+        Exception: "Unable to execute Terraform executor"
+        Exception: "Unknown error occured during execution of Terraform executor",
+
+    Returns:
+        dict : containing message of status of succesful terraform plan, whether it has changes and its summary
+    """
+    cmd = './plan_tfstack.sh' + ' ' + resource_id
+    process = spawn_script(cmd, tf_dir, 'plan', variables)
+
+    process_outcome = parse_process_output(
+        process, script_errors=PLAN_SCRIPT_ERRORS, on_line=on_line, operation='plan',
+        timeout=timeout, cancelled=cancelled)
+
+    return evaluate_plan_tf_stack(process.returncode, process_outcome)
+
+
+def evaluate_plan_tf_stack(returncode: int, process_outcome: dict):
+    """
+    Evaluates the executed terraform shell script plan_tfstack
+
+    Args:
+        returncode (int): return code of the script process
+        process_outcome (dict): outcome of the parsed output
+
+    Raises:
+        Exception: the matched script error or "Unknown error occured during execution of Terraform executor"
+
+    Returns:
+        dict : containing message of status of succesful terraform plan, whether it has changes and its summary
+    """
+    if returncode == PLAN_NO_CHANGES:
+        return {
+            'message': "TFstack planned succesfully",
+            'changes': False,
+            'summary': {'add': 0, 'change': 0, 'destroy': 0}
+        }
+    elif returncode == PLAN_CHANGES:
+        return {
+            'message': "TFstack planned succesfully",
+            'changes': True,
+            'summary': match_plan_summary(process_outcome['tail'])
+        }
+    else:
+        raise_executor_error(process_outcome)
+
+
+def match_plan_summary(lines: list):
+    """
+    Match the summary of a terraform plan, e.g. 'Plan: 1 to add, 0 to change, 0 to destroy.'
+
+    Args:
+        lines (list): output lines
+
+    Returns:
+        dict: amount of resources to 'add', 'change' and 'destroy' or None
+    """
+    for line in reversed(lines):
+        match = PLAN_SUMMARY.search(line)
+        if match:
+            add, change, destroy = (int(group) for group in match.groups())
+            return {'add': add, 'change': change, 'destroy': destroy}
+    return None
+
+
+def drift_tf_stack(tf_dir: str, resource_id: str, on_line=None, variables: dict = None,
+                   timeout: int = None, cancelled=None):
+    """
+    Executes the terraform shell script drift_tfstack, which runs
+    'terraform plan -refresh-only -detailed-exitcode -lock=false' in the workspace of the stack
+    and exits with its exit code. It doesn't change the stack or its state.
+
+    Args:
+        tf_dir (str): the path to the directory containing terraform execution shell scripts
+        resource_id (str): stack/resource id
+        on_line (callable): optional callback that receives every output line
+        variables (dict): input variables of the stack, passed as TF_VAR_<name>
+        timeout (int): seconds, None for no time limit
+        cancelled (callable): returns True when the request is cancelled
+
+    Raises:
+        Exception: "Unable to execute Terraform executor"
+        Exception: "Unknown error occured during execution of Terraform executor",
+
+    Returns:
+        dict : containing message of status of succesful drift check, whether the stack drifted and the drifted resources
+    """
+    cmd = './drift_tfstack.sh' + ' ' + resource_id
+    process = spawn_script(cmd, tf_dir, 'drift', variables)
+
+    process_outcome = parse_process_output(
+        process, script_errors=DRIFT_SCRIPT_ERRORS, collect_output=True, on_line=on_line, operation='drift',
+        timeout=timeout, cancelled=cancelled)
+
+    return evaluate_drift_tf_stack(process.returncode, process_outcome)
+
+
+def evaluate_drift_tf_stack(returncode: int, process_outcome: dict):
+    """
+    Evaluates the executed terraform shell script drift_tfstack
+
+    Args:
+        returncode (int): return code of the script process
+        process_outcome (dict): outcome of the parsed output
+
+    Raises:
+        Exception: the matched script error or "Unknown error occured during execution of Terraform executor"
+
+    Returns:
+        dict : containing message of status of succesful drift check, whether the stack drifted and the drifted resources
+    """
+    if returncode not in (PLAN_NO_CHANGES, PLAN_CHANGES):
+        raise_executor_error(process_outcome)
+
+    return {
+        'message': "TFstack drift checked succesfully",
+        'drifted': returncode == PLAN_CHANGES,
+        'resources': match_drifted_resources(process_outcome['output']) if returncode == PLAN_CHANGES else []
+    }
+
+
+def match_drifted_resources(lines: list):
+    """
+    Match the resources that changed outside of Terraform, e.g. '# aws_instance.this has changed'
+
+    Args:
+        lines (list): output lines of a refresh-only plan
+
+    Returns:
+        list: 'address' and 'change' ('changed' or 'deleted') per drifted resource
+    """
+    resources = list()
+    for line in lines:
+        match = DRIFTED_RESOURCE.search(line)
+        if match:
+            resources.append({
+                'address': match.group(1),
+                'change': 'deleted' if match.group(2) == 'been deleted' else 'changed'
+            })
+    return resources
+
+
+def update_tf_stack(tf_dir: str, resource_id: str, on_line=None, variables: dict = None,
+                    timeout: int = None, cancelled=None):
+    """
+    Executes the terraform shell script update_tfstack, which runs
+    'terraform apply' in the workspace of an existing stack.
+
+    Args:
+        tf_dir (str): the path to the directory containing terraform execution shell scripts
+        resource_id (str): stack/resource id
+        on_line (callable): optional callback that receives every output line
+        variables (dict): input variables of the stack, passed as TF_VAR_<name>
+        timeout (int): seconds, None for no time limit
+        cancelled (callable): returns True when the request is cancelled
+
+    Raises:
+        Exception: "Unable to execute Terraform executor"
+        Exception: "Unknown error occured during execution of Terraform executor",
+
+    Returns:
+        dict : containing message of status of succesful terraform apply
+    """
+    cmd = './update_tfstack.sh' + ' ' + resource_id
+    process = spawn_script(cmd, tf_dir, 'update', variables)
+
+    process_outcome = parse_process_output(
+        process, script_errors=UPDATE_SCRIPT_ERRORS, on_line=on_line, operation='update',
+        timeout=timeout, cancelled=cancelled)
+
+    return evaluate_update_tf_stack(process.returncode, process_outcome)
+
+
+def evaluate_update_tf_stack(returncode: int, process_outcome: dict):
+    """
+    Evaluates the executed terraform shell script update_tfstack
+
+    Args:
+        returncode (int): return code of the script process
+        process_outcome (dict): outcome of the parsed output
+
+    Raises:
+        Exception: the matched script error or "Unknown error occured during execution of Terraform executor"
+
+    Returns:
+        dict : containing message of status of succesful terraform apply
+    """
+    if returncode == 0:
+        return {'message': "TFstack updated succesfully"}
+    else:
+        raise_executor_error(process_outcome)
+
+
+def parse_resource_address(address: str):
+    """
+    Parses a resource address of 'terraform state list',
+    e.g. 'module.network.aws_subnet.private[0]' or 'data.aws_ami.ubuntu'
+
+    Args:
+        address (str): resource address
+
+    Returns:
+        dict: 'address', 'module', 'mode', 'type', 'name' and 'index' or None when it is not a resource address
+    """
+    steps = list()
+    position = 0
+    while position < len(address):
+        match = ADDRESS_STEP.match(address, position)
+        if match is None:
+            return None
+        steps.append(match.groups())
+        position = match.end()
+
+    module = list()
+    while len(steps) > 2 and steps[0] == ('module', None):
+        name, index = steps[1]
+        module.append('module.' + name + ('[{}]'.format(index) if index is not None else ''))
+        steps = steps[2:]
+
+    mode = 'managed'
+    if len(steps) == 3 and steps[0] == ('data', None):
+        mode = 'data'
+        steps = steps[1:]
+    if len(steps) != 2 or steps[0][1] is not None:
+        return None
+
+    (resource_type, _), (name, index) = steps
+    if index is not None:
+        index = json.loads(index)
+    return {
+        'address': address,
+        'module': '.'.join(module) or None,
+        'mode': mode,
+        'type': resource_type,
+        'name': name,
+        'index': index,
+    }
+
+
+def parse_state_list(output: list):
+    """
+    Parses the output of 'terraform state list' into resources,
+    lines that are not a resource address are skipped
+
+    Args:
+        output (list): output lines
+
+    Returns:
+        list: the parsed resources
+    """
+    resources = list()
+    for line in output:
+        resource = parse_resource_address(line)
+        if resource is not None:
+            resources.append(resource)
+    return resources
+
+
+def list_tf_stacks(tf_dir: str, timeout: int = None):
+    """
+    Lists the Terraform workspaces, every workspace except 'default' is a stack.
+    Initializes the backend in tf_dir, so tf_dir should be a temporary copy.
+
+    Args:
+        tf_dir (str): the path to the directory containing the terraform config
+        timeout (int): seconds, None for no time limit
+
+    Raises:
+        Exception: "Unable to execute Terraform executor"
+        Exception: "Unknown error occured during execution of Terraform executor",
+
+    Returns:
+        dict : containing message of status of succesful terraform operation, including the resource_ids
+    """
+    process = spawn_script(TF_WORKSPACE_LIST_CMD, tf_dir, 'list')
+
+    process_outcome = parse_process_output(
+        process, collect_output=True, operation='list', timeout=timeout)
+
+    if process.returncode == 0:
+        # the current workspace is marked with a '*'
+        workspaces = [line.lstrip('*').strip()
+                      for line in process_outcome['output']]
+        message = {
+            'message': "TFstacks listed succesfully",
+            'resource_ids': [workspace for workspace in workspaces if workspace and workspace != 'default']
+        }
+        return message
+    else:
+        raise_executor_error(process_outcome)
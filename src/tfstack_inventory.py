@@ -0,0 +1,188 @@
+import os
+import json
+import time
+
+from redis.exceptions import RedisError
+
+from utils import get_logger, get_redis_client
+
+
+"""Inventory of the stacks, indexed in redis.
+
+Every stack has a hash with its creation time, last known state and the template and input variables
+it was created from (its spec), sorted sets
+per creation time (all stacks and per state) make listing and filtering cheap.
+The executors' outcomes keep it up to date, the reconciliation rebuilds it from the Terraform workspaces.
+"""
+
+INVENTORY_KEY = "tfstack:inventory"
+INVENTORY_STATE_KEY = "tfstack:inventory:state:{state}"
+INVENTORY_STACK_KEY = "tfstack:inventory:stack:{resource_id}"
+
+STACK_STATES = ['created', 'present', 'reconciled']
+
+INVENTORY_MAX_LIMIT = int(os.environ.get("INVENTORY_MAX_LIMIT", "1000"))
+
+
+def record_stack(resource_id: str, state: str, template: str = None, variables: dict = None):
+    """
+    Record a stack and its last known state
+
+    Args:
+        resource_id (str): stack/resource id
+        state (str): last known state, one of STACK_STATES
+        template (str): template the stack is created from, None for the default template
+        variables (dict): input variables the stack is created with
+    """
+    now = time.time()
+    try:
+        client = get_redis_client()
+        stack_key = INVENTORY_STACK_KEY.format(resource_id=resource_id)
+
+        created_at = client.hget(stack_key, 'created_at')
+        created_at = float(created_at) if created_at is not None else now
+
+        stack = {
+            'resource_id': resource_id,
+            'created_at': created_at,
+            'updated_at': now,
+            'state': state,
+        }
+        if template:
+            stack['template'] = template
+        if variables:
+            stack['variables'] = json.dumps(variables)
+
+        pipeline = client.pipeline()
+        pipeline.hset(stack_key, mapping=stack)
+        pipeline.zadd(INVENTORY_KEY, {resource_id: created_at})
+        for other_state in STACK_STATES:
+            if other_state != state:
+                pipeline.zrem(INVENTORY_STATE_KEY.format(
+                    state=other_state), resource_id)
+        pipeline.zadd(INVENTORY_STATE_KEY.format(
+            state=state), {resource_id: created_at})
+        pipeline.execute()
+    except RedisError as e:
+        get_logger().warning("Unable to record stack %s in the inventory: %s", resource_id, e)
+
+
+def remove_stack(resource_id: str):
+    """
+    Remove a stack from the inventory
+
+    Args:
+        resource_id (str): stack/resource id
+    """
+    try:
+        pipeline = get_redis_client().pipeline()
+        pipeline.delete(INVENTORY_STACK_KEY.format(resource_id=resource_id))
+        pipeline.zrem(INVENTORY_KEY, resource_id)
+        for state in STACK_STATES:
+            pipeline.zrem(INVENTORY_STATE_KEY.format(state=state), resource_id)
+        pipeline.execute()
+    except RedisError as e:
+        get_logger().warning("Unable to remove stack %s from the inventory: %s", resource_id, e)
+
+
+def get_stack_spec(resource_id: str):
+    """
+    Get the template and input variables a stack was created from
+
+    Args:
+        resource_id (str): stack/resource id
+
+    Returns:
+        tuple: (template, variables), None for the default template or without variables
+    """
+    try:
+        template, variables = get_redis_client().hmget(
+            INVENTORY_STACK_KEY.format(resource_id=resource_id), 'template', 'variables')
+    except RedisError as e:
+        get_logger().warning("Unable to read the spec of stack %s from the inventory: %s", resource_id, e)
+        return None, None
+    return (template.decode('utf8') if template else None,
+            json.loads(variables) if variables else None)
+
+
+def list_stacks(offset: int = 0, limit: int = 100, state: str = None,
+                created_after: float = None, created_before: float = None):
+    """
+    List the stacks, ordered by creation time
+
+    Args:
+        offset (int): amount of stacks to skip
+        limit (int): maximum amount of stacks to return, at most INVENTORY_MAX_LIMIT
+        state (str): only return stacks in this state
+        created_after (float): only return stacks created at or after this epoch time
+        created_before (float): only return stacks created at or before this epoch time
+
+    Raises:
+        ValueError: when the offset is negative or the limit is not positive
+
+    Returns:
+        dict: 'total' amount of matching stacks and the 'stacks'
+    """
+    # a negative limit would return all of the inventory
+    if offset < 0 or limit < 1:
+        error_message = "Invalid page: offset {}, limit {}".format(offset, limit)
+        raise ValueError(error_message)
+
+    client = get_redis_client()
+    index_key = INVENTORY_STATE_KEY.format(
+        state=state) if state else INVENTORY_KEY
+    min_score = created_after if created_after is not None else '-inf'
+    max_score = created_before if created_before is not None else '+inf'
+
+    pipeline = client.pipeline()
+    pipeline.zcount(index_key, min_score, max_score)
+    pipeline.zrangebyscore(index_key, min_score, max_score,
+                           start=offset, num=min(limit, INVENTORY_MAX_LIMIT))
+    total, resource_ids = pipeline.execute()
+
+    pipeline = client.pipeline()
+    for resource_id in resource_ids:
+        pipeline.hgetall(INVENTORY_STACK_KEY.format(
+            resource_id=resource_id.decode('utf8')))
+    stacks = list()
+    for stack in pipeline.execute():
+        if not stack:
+            continue
+        stack = {k.decode('utf8'): v.decode('utf8') for k, v in stack.items()}
+        stack['created_at'] = float(stack['created_at'])
+        stack['updated_at'] = float(stack['updated_at'])
+        # the input variables may hold secrets, they are not listed
+        stack.pop('variables', None)
+        stacks.append(stack)
+
+    return {'total': total, 'stacks': stacks}
+
+
+def reconcile_inventory(resource_ids: list, started_at: float):
+    """
+    Rebuild the inventory from the existing workspaces.
+    Stacks that are recorded after the workspaces were listed are kept.
+
+    Args:
+        resource_ids (list): stack/resource ids of the existing workspaces
+        started_at (float): epoch time at which the workspaces were listed
+
+    Returns:
+        dict: the 'added' and 'removed' stack/resource ids
+    """
+    client = get_redis_client()
+    workspace_resource_ids = set(resource_ids)
+    existing = {resource_id.decode('utf8'): created_at
+                for resource_id, created_at in client.zrange(INVENTORY_KEY, 0, -1, withscores=True)}
+
+    added = [resource_id for resource_id in workspace_resource_ids
+             if resource_id not in existing]
+    removed = [resource_id for resource_id, created_at in existing.items()
+               if resource_id not in workspace_resource_ids and created_at < started_at]
+
+    for resource_id in added:
+        record_stack(resource_id, 'reconciled')
+    for resource_id in removed:
+        remove_stack(resource_id)
+
+    return {'added': added, 'removed': removed}
@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import socket
+import threading
+from contextlib import contextmanager
+
+from redis.exceptions import RedisError
+
+from utils import get_logger, get_redis_client
+
+
+"""Durable journal of the executions of the tfstack tasks, a redis hash per task_id.
+
+The journal records the status of the execution, the Terraform stage it reached,
+the resource_id (workspace) that is allocated and the amount of output lines (output offset).
+Tasks are acknowledged late, so the broker redelivers a task of a worker that was lost:
+the journal tells the redelivered task that the previous execution was interrupted,
+and what it already did, so it can resume or return the result of a finished execution.
+A running execution renews the journal every JOURNAL_HEARTBEAT_INTERVAL seconds: a message that is redelivered
+while its execution still runs (e.g. after the visibility timeout of the broker) is not an interruption.
+"""
+
+JOURNAL_TTL = int(os.environ.get("JOURNAL_TTL", "86400"))
+JOURNAL_MAX_INTERRUPTIONS = int(os.environ.get("JOURNAL_MAX_INTERRUPTIONS", "3"))
+# the output offset is written every JOURNAL_OFFSET_INTERVAL lines
+JOURNAL_OFFSET_INTERVAL = int(os.environ.get("JOURNAL_OFFSET_INTERVAL", "50"))
+JOURNAL_HEARTBEAT_INTERVAL = int(os.environ.get("JOURNAL_HEARTBEAT_INTERVAL", "30"))
+# seconds without a heartbeat after which a started execution is considered interrupted
+JOURNAL_HEARTBEAT_TIMEOUT = int(os.environ.get("JOURNAL_HEARTBEAT_TIMEOUT", "120"))
+
+JOURNAL_KEY = "tfstack:journal:{task_id}"
+
+# status of an execution
+STARTED = 'started'
+RETRYING = 'retrying'
+FINISHED = 'finished'
+
+
+class ExecutionInProgress(Exception):
+    """
+    Raised when a previous execution of the task still runs, e.g. for a duplicate delivery of its message
+    """
+
+
+class TaskJournal:
+    """
+    Journal of a single execution of a task
+    """
+
+    def __init__(self, task_id: str, operation: str, resource_id: str = None):
+        """
+        Args:
+            task_id (str): task id, the request id
+            operation (str): name of the operation: create, read, delete, update
+            resource_id (str): stack/resource id, when known up front
+        """
+        self.key = JOURNAL_KEY.format(task_id=task_id)
+        self.operation = operation
+        self.resource_id = resource_id
+        self.stage = None
+        self.output_offset = 0
+        self.previous = None
+
+    def start(self):
+        """
+        Starts the journal of this execution
+
+        Raises:
+            ExecutionInProgress: when a previous execution still runs, the journal is left as is
+            Exception: "Execution interrupted too often, giving up"
+
+        Returns:
+            dict: the journal of the previous execution of the task, None when there is none
+        """
+        try:
+            client = get_redis_client()
+            previous = client.hgetall(self.key)
+        except RedisError as e:
+            get_logger().warning("Unable to read the journal: %s", e)
+            return None
+
+        if previous:
+            self.previous = _decode(previous)
+            if self.previous['status'] == FINISHED:
+                # the journaled result is returned, the journal is kept for a further redelivery
+                return self.previous
+            if self.previous['status'] == STARTED and \
+                    time.time() - self.previous['updated_at'] < JOURNAL_HEARTBEAT_TIMEOUT:
+                error_message = "Execution of {} still runs on {}".format(self.key, self.previous['owner'])
+                raise ExecutionInProgress(error_message)
+            if self.previous['status'] == STARTED:
+                self.previous['interruptions'] += 1
+                if self.previous['interruptions'] > JOURNAL_MAX_INTERRUPTIONS:
+                    error_message = "Execution interrupted too often, giving up"
+                    raise Exception(error_message)
+                self.resource_id = self.resource_id or self.previous['resource_id']
+                self.output_offset = self.previous['output_offset']
+
+        self._write({
+            'operation': self.operation,
+            'status': STARTED,
+            'owner': '{}:{}'.format(socket.gethostname(), os.getpid()),
+            'interruptions': self.previous['interruptions'] if self.previous else 0,
+            'output_offset': self.output_offset,
+            'resource_id': self.resource_id or '',
+        })
+        return self.previous
+
+    @property
+    def interrupted(self):
+        """
+        Returns:
+            bool: whether a previous execution of the task was interrupted
+        """
+        return self.previous is not None and self.previous['status'] == STARTED
+
+    def on_line(self, line: str, stage: str = None):
+        """
+        Counts an output line and records the Terraform stage when it changed
+
+        Args:
+            line (str): output line
+            stage (str): current Terraform stage
+        """
+        self.output_offset += 1
+        if stage != self.stage:
+            self.stage = stage
+            self._write({'stage': stage or '', 'output_offset': self.output_offset})
+        elif self.output_offset % JOURNAL_OFFSET_INTERVAL == 0:
+            self._write({'output_offset': self.output_offset})
+
+    def record_resource_id(self, resource_id: str):
+        """
+        Records the resource_id (workspace) that the execution allocated
+
+        Args:
+            resource_id (str): stack/resource id
+        """
+        if resource_id != self.resource_id:
+            self.resource_id = resource_id
+            self._write({'resource_id': resource_id})
+
+    @contextmanager
+    def heartbeat(self, interval: int = None):
+        """
+        Context manager that renews the journal every interval seconds, in a thread, while the execution runs
+
+        Args:
+            interval (int): seconds, JOURNAL_HEARTBEAT_INTERVAL by default
+        """
+        interval = JOURNAL_HEARTBEAT_INTERVAL if interval is None else interval
+        stopped = threading.Event()
+
+        def beat():
+            while not stopped.wait(interval):
+                self._write({})
+
+        thread = threading.Thread(target=beat, name='journal-heartbeat', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
+
+    def retrying(self):
+        """
+        Records that the task is retried later, which is not an interruption
+        """
+        self._write({'status': RETRYING})
+
+    def finish(self, result):
+        """
+        Records the result of the finished execution
+
+        Args:
+            result: the result of the task
+        """
+        self._write({'status': FINISHED, 'output_offset': self.output_offset,
+                     'result': json.dumps(result)})
+
+    def discard(self):
+        """
+        Removes the journal, when the task failed
+        """
+        try:
+            get_redis_client().delete(self.key)
+        except RedisError as e:
+            get_logger().warning("Unable to remove the journal: %s", e)
+
+    def _write(self, fields: dict):
+        fields['updated_at'] = time.time()
+        try:
+            pipeline = get_redis_client().pipeline()
+            pipeline.hset(self.key, mapping=fields)
+            pipeline.expire(self.key, JOURNAL_TTL)
+            pipeline.execute()
+        except RedisError as e:
+            get_logger().warning("Unable to write the journal: %s", e)
+
+
+def _decode(journal: dict):
+    journal = {k.decode('utf8'): v.decode('utf8') for k, v in journal.items()}
+    return {
+        'operation': journal.get('operation'),
+        'status': journal.get('status'),
+        'owner': journal.get('owner') or None,
+        'stage': journal.get('stage') or None,
+        'resource_id': journal.get('resource_id') or None,
+        'interruptions': int(journal.get('interruptions', 0)),
+        'output_offset': int(journal.get('output_offset', 0)),
+        'result': json.loads(journal['result']) if 'result' in journal else None,
+        'updated_at': float(journal.get('updated_at', 0)),
+    }
+
+
+def get_journal(task_id: str):
+    """
+    Get the journal of a task
+
+    Args:
+        task_id (str): task id, the request id
+
+    Returns:
+        dict: the journal or None
+    """
+    journal = get_redis_client().hgetall(JOURNAL_KEY.format(task_id=task_id))
+    if not journal:
+        return None
+    return _decode(journal)
@@ -0,0 +1,118 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from redis.exceptions import LockError, RedisError
+
+from utils import get_logger, get_redis_client
+
+
+"""Request coalescing and serialization of operations per resource_id.
+
+Identical requests that are in flight share a single Celery task (and request_id),
+conflicting operations on the same stack are serialized by a distributed lock.
+The stack lock is renewed while its operation runs, however long that takes, and expires
+STACK_LOCK_TIMEOUT seconds after the last renewal when the worker holding it dies.
+"""
+
+INFLIGHT_TTL = int(os.environ.get("INFLIGHT_TTL", "3600"))
+STACK_LOCK_TIMEOUT = int(os.environ.get("STACK_LOCK_TIMEOUT", "3600"))
+# seconds between the renewals of a held stack lock
+STACK_LOCK_RENEW_INTERVAL = int(os.environ.get("STACK_LOCK_RENEW_INTERVAL", str(max(1, STACK_LOCK_TIMEOUT // 3))))
+
+INFLIGHT_KEY = "tfstack:inflight:{operation}:{resource_id}"
+STACK_LOCK_KEY = "tfstack:lock:{resource_id}"
+
+# only delete the in-flight claim when it still belongs to the request
+RELEASE_INFLIGHT_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def claim_inflight_request(operation: str, resource_id: str, request_id: str):
+    """
+    Claim an operation on a resource_id for a new request, unless an
+    identical request is already in flight
+
+    Args:
+        operation (str): name of the operation, the Celery task name
+        resource_id (str): stack/resource id
+        request_id (str): request id for the new Celery task
+
+    Returns:
+        tuple: (request id that handles the operation, True when the claim is new)
+    """
+    client = get_redis_client()
+    key = INFLIGHT_KEY.format(operation=operation, resource_id=resource_id)
+
+    while True:
+        if client.set(key, request_id, nx=True, ex=INFLIGHT_TTL):
+            return request_id, True
+        existing_request_id = client.get(key)
+        # the claim can expire or be released in between
+        if existing_request_id is not None:
+            return existing_request_id.decode('utf8'), False
+
+
+def release_inflight_request(operation: str, resource_id: str, request_id: str):
+    """
+    Release the claim of a finished request
+
+    Args:
+        operation (str): name of the operation, the Celery task name
+        resource_id (str): stack/resource id
+        request_id (str): request id of the finished Celery task
+    """
+    key = INFLIGHT_KEY.format(operation=operation, resource_id=resource_id)
+    get_redis_client().eval(RELEASE_INFLIGHT_SCRIPT, 1, key, request_id)
+
+
+def stack_lock(resource_id: str):
+    """
+    Distributed lock that serializes the operations on a stack.
+    The lock expires after STACK_LOCK_TIMEOUT, in case a worker dies while holding it, see renewed_lock.
+
+    Args:
+        resource_id (str): stack/resource id
+
+    Returns:
+        redis.lock.Lock: the (not yet acquired) lock
+    """
+    # not thread local, the lock is renewed by another thread
+    return get_redis_client().lock(STACK_LOCK_KEY.format(resource_id=resource_id),
+                                   timeout=STACK_LOCK_TIMEOUT, thread_local=False)
+
+
+@contextmanager
+def renewed_lock(lock, interval: int = None):
+    """
+    Context manager that renews the expiry of a held lock every interval seconds, in a thread, until it exits
+
+    Args:
+        lock (redis.lock.Lock): the acquired lock
+        interval (int): seconds, STACK_LOCK_RENEW_INTERVAL by default
+    """
+    interval = STACK_LOCK_RENEW_INTERVAL if interval is None else interval
+    stopped = threading.Event()
+
+    def renew():
+        while not stopped.wait(interval):
+            try:
+                lock.reacquire()
+            except LockError as e:
+                # the lock expired and may be held by another operation, renewing is of no use anymore
+                get_logger().warning("Unable to renew the lock %s: %s", lock.name, e)
+                return
+            except RedisError as e:
+                get_logger().warning("Unable to renew the lock %s: %s", lock.name, e)
+
+    thread = threading.Thread(target=renew, name='lock-renewal', daemon=True)
+    thread.start()
+    try:
+        yield lock
+    finally:
+        stopped.set()
+        thread.join()
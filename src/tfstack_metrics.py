@@ -0,0 +1,179 @@
+import os
+import time
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, \
+    multiprocess, start_http_server
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from tfstack_queues import queue_lengths
+from tfstack_results import get_memory_usage
+from utils import get_logger
+
+
+"""Prometheus metrics of the API and the executor pipeline.
+
+Processes that fork (gunicorn, the prefork Celery pool) need PROMETHEUS_MULTIPROC_DIR,
+so the metrics of all processes are collected from a shared directory.
+"""
+
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR",
+                               os.environ.get("prometheus_multiproc_dir"))
+
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+API_REQUEST_DURATION = Histogram('tfstack_api_request_duration_seconds', 'Duration of API requests',
+                                 ['method', 'endpoint', 'status'])
+
+TASK_QUEUE_WAIT = Histogram('tfstack_task_queue_wait_seconds', 'Time between publishing and starting a task',
+                            ['operation'], buckets=DURATION_BUCKETS)
+TASK_DURATION = Histogram('tfstack_task_duration_seconds', 'Duration of tasks',
+                          ['operation', 'outcome'], buckets=DURATION_BUCKETS)
+TASKS = Counter('tfstack_tasks_total', 'Finished tasks',
+                ['operation', 'outcome', 'script_error'])
+RESULT_SIZE = Histogram('tfstack_result_size_bytes', 'Size of the serialized task results',
+                        ['operation'], buckets=(100, 1000, 10000, 100000, 1000000, 10000000))
+
+EXECUTOR_STAGE_DURATION = Histogram('tfstack_executor_stage_duration_seconds',
+                                    'Duration of the stages of a Terraform executor: fork, init, plan, apply, parse',
+                                    ['operation', 'stage'], buckets=DURATION_BUCKETS)
+SUBPROCESSES_IN_FLIGHT = Gauge('tfstack_subprocesses_in_flight', 'Running Terraform shell scripts',
+                               ['operation'], multiprocess_mode='livesum')
+DRIFT_CHECKS = Counter('tfstack_drift_checks_total', 'Drift checks of stacks by outcome: drifted, in_sync, error',
+                       ['outcome'])
+ORPHANS_REAPED = Counter('tfstack_orphans_reaped_total',
+                         'Orphaned Terraform processes and working directories reaped by kind: process, workdir',
+                         ['kind'])
+CALLBACKS = Counter('tfstack_callbacks_total',
+                    'Completion callbacks by outcome: delivered, retried, failed, dropped', ['outcome'])
+WORKER_COLD_START = Gauge('tfstack_worker_cold_start_seconds',
+                          'Time between the start of a worker and being ready to execute tasks',
+                          multiprocess_mode='max')
+
+# first output line of every stage of the Terraform workflow
+TERRAFORM_STAGE_MARKERS = [
+    ('Initializing the backend', 'init'),
+    ('Initializing provider plugins', 'init'),
+    ('Refreshing state', 'plan'),
+    ('Terraform used the selected providers', 'plan'),
+    ('Terraform will perform the following actions', 'plan'),
+    ('No changes.', 'plan'),
+    (': Creating...', 'apply'),
+    (': Modifying...', 'apply'),
+    (': Destroying...', 'apply'),
+    ('Apply complete!', None),
+    ('Destroy complete!', None),
+]
+
+
+class StageTimer:
+    """
+    Times the stages of the Terraform workflow, detected from its output lines
+    """
+
+    def __init__(self, operation: str):
+        """
+        Args:
+            operation (str): name of the operation: create, read, delete
+        """
+        self.operation = operation
+        self.stage = None
+        self.stage_started = None
+
+    def on_line(self, line: str):
+        """
+        Callback for the executors
+
+        Args:
+            line (str): output line
+        """
+        for marker, stage in TERRAFORM_STAGE_MARKERS:
+            if marker in line:
+                if stage != self.stage:
+                    self.finish()
+                    self.stage = stage
+                    self.stage_started = time.time()
+                return
+
+    def finish(self):
+        """
+        Observes the duration of the current stage
+        """
+        if self.stage is not None:
+            EXECUTOR_STAGE_DURATION.labels(self.operation, self.stage).observe(
+                time.time() - self.stage_started)
+        self.stage = None
+
+
+class QueueDepthCollector:
+    """
+    Collects the amount of waiting messages per queue from the broker on every scrape
+    """
+
+    def collect(self):
+        queue_depth = GaugeMetricFamily('tfstack_queue_depth', 'Messages waiting in the queue',
+                                        labels=['queue'])
+        try:
+            for queue, length in queue_lengths().items():
+                queue_depth.add_metric([queue], length)
+        except Exception as e:
+            get_logger().warning("Unable to collect the queue depth: %s", e)
+        yield queue_depth
+
+
+class RedisMemoryCollector:
+    """
+    Collects the memory usage of the broker and the result backend on every scrape,
+    both stores report the same redis when they share it
+    """
+
+    def collect(self):
+        used_memory = GaugeMetricFamily('tfstack_redis_used_memory_bytes', 'Memory used by the redis',
+                                        labels=['store'])
+        maxmemory = GaugeMetricFamily('tfstack_redis_maxmemory_bytes', 'Memory limit of the redis, 0 without a limit',
+                                      labels=['store'])
+        evicted_keys = CounterMetricFamily('tfstack_redis_evicted_keys', 'Keys evicted by the redis',
+                                           labels=['store'])
+        try:
+            usage = get_memory_usage()
+            for store in ('broker', 'backend'):
+                used_memory.add_metric([store], usage[store]['used_memory'])
+                maxmemory.add_metric([store], usage[store]['maxmemory'])
+                evicted_keys.add_metric([store], usage[store]['evicted_keys'])
+        except Exception as e:
+            get_logger().warning("Unable to collect the redis memory usage: %s", e)
+        yield used_memory
+        yield maxmemory
+        yield evicted_keys
+
+
+def metrics_registry():
+    """
+    Returns:
+        CollectorRegistry: registry of the metrics of all processes
+    """
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def start_metrics_server(port: int):
+    """
+    Exposes the metrics on a separate http server, for the Celery worker
+
+    Args:
+        port (int): port of the http server
+    """
+    start_http_server(port, registry=metrics_registry())
+
+
+def mark_process_dead(pid: int):
+    """
+    Cleans up the metrics of a stopped process
+
+    Args:
+        pid (int): process id
+    """
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
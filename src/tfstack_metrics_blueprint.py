@@ -0,0 +1,77 @@
+import time
+
+from flask import Blueprint, Response, jsonify, request
+from prometheus_client import CollectorRegistry, CONTENT_TYPE_LATEST, generate_latest
+
+from tfstack_metrics import API_REQUEST_DURATION, QueueDepthCollector, RedisMemoryCollector, metrics_registry
+from tfstack_queues import QUEUES, get_backlog
+from tfstack_results import get_memory_usage
+
+
+metrics_blueprint = Blueprint('metrics_blueprint', __name__)
+
+
+@metrics_blueprint.before_app_request
+def start_request_timer():
+    request.environ['tfstack.request_started'] = time.time()
+
+
+@metrics_blueprint.after_app_request
+def observe_request_duration(response):
+    started = request.environ.get('tfstack.request_started')
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        API_REQUEST_DURATION.labels(request.method, endpoint, response.status_code).observe(
+            time.time() - started)
+    return response
+
+
+@metrics_blueprint.route('/metrics', methods=['GET'])
+def metrics():
+    """Flask blueprint.
+       Exposes the Prometheus metrics of the API, including the queue depth and the redis memory usage.
+
+    Returns:
+        text: Prometheus exposition format
+    """
+    registry = metrics_registry()
+    output = generate_latest(registry)
+
+    queue_depth_registry = CollectorRegistry()
+    queue_depth_registry.register(QueueDepthCollector())
+    queue_depth_registry.register(RedisMemoryCollector())
+    output += generate_latest(queue_depth_registry)
+
+    return Response(output, mimetype=CONTENT_TYPE_LATEST)
+
+
+@metrics_blueprint.route('/backlog', methods=['GET'])
+def backlog():
+    """Flask blueprint.
+       Exposes the backlog and throughput per queue: the amount of waiting messages, the age of the oldest message,
+       the finished tasks per minute, the average task duration and the estimated drain time.
+       The optional query parameter 'queues' (comma separated) limits the queues, and their total,
+       e.g. to the queues of a single worker pool, as scaling signal.
+
+    Returns:
+        json: json datastructure
+    """
+    queues = request.args.get('queues')
+    queues = queues.split(',') if queues else QUEUES
+    unknown_queues = [queue for queue in queues if queue not in QUEUES]
+    if unknown_queues:
+        return jsonify({"error": "queues must be one of {}".format(", ".join(QUEUES))}), 400
+
+    return jsonify(get_backlog(queues)), 200
+
+
+@metrics_blueprint.route('/memory', methods=['GET'])
+def memory():
+    """Flask blueprint.
+       Exposes the memory usage of the broker and the result backend: the used memory, the memory limit
+       and eviction policy, and the amount of evicted, expired and stored keys.
+
+    Returns:
+        json: json datastructure
+    """
+    return jsonify(get_memory_usage()), 200
@@ -0,0 +1,104 @@
+import os
+import json
+import hashlib
+
+from redis.exceptions import RedisError
+
+from utils import get_logger, get_redis_client
+
+
+"""Cache of terraform plan results, keyed by the config revision and the workspace (resource_id) of a stack.
+
+A stack whose last plan for the current config revision was empty doesn't need an apply.
+The plan of a stack is cached for PLAN_CACHE_TTL seconds, changes outside of Terraform (drift)
+are only detected after it expires.
+"""
+
+PLAN_CACHE_TTL = int(os.environ.get("PLAN_CACHE_TTL", "3600"))
+
+PLAN_CACHE_KEY = "tfstack:plan:{resource_id}"
+
+CONFIG_IGNORE = ('.git', '.terraform')
+
+
+def config_revision(tf_dir: str):
+    """
+    Content hash of a Terraform config directory, including the shell scripts
+
+    Args:
+        tf_dir (str): the path to the directory containing the terraform config
+
+    Returns:
+        str: sha256 hex digest of the relative paths and contents of all files
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(tf_dir):
+        dirs[:] = sorted(d for d in dirs if d not in CONFIG_IGNORE)
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, tf_dir).encode('utf8'))
+            digest.update(b'\0')
+            with open(path, 'rb') as config_file:
+                digest.update(hashlib.sha256(config_file.read()).digest())
+    return digest.hexdigest()
+
+
+def get_cached_plan(resource_id: str, revision: str):
+    """
+    Get the cached plan result of a stack for a config revision
+
+    Args:
+        resource_id (str): stack/resource id
+        revision (str): config revision
+
+    Returns:
+        dict: the cached plan result or None
+    """
+    if PLAN_CACHE_TTL <= 0:
+        return None
+
+    try:
+        cached = get_redis_client().get(
+            PLAN_CACHE_KEY.format(resource_id=resource_id))
+    except RedisError as e:
+        get_logger().warning("Unable to read from the plan cache: %s", e)
+        return None
+
+    if cached is None:
+        return None
+    cached = json.loads(cached)
+    if cached['revision'] != revision:
+        return None
+    return cached['plan']
+
+
+def set_cached_plan(resource_id: str, revision: str, plan: dict):
+    """
+    Store the plan result of a stack for a config revision
+
+    Args:
+        resource_id (str): stack/resource id
+        revision (str): config revision
+        plan (dict): result of plan_tf_stack
+    """
+    if PLAN_CACHE_TTL <= 0:
+        return
+
+    try:
+        get_redis_client().setex(PLAN_CACHE_KEY.format(resource_id=resource_id), PLAN_CACHE_TTL,
+                                 json.dumps({'revision': revision, 'plan': plan}))
+    except RedisError as e:
+        get_logger().warning("Unable to write to the plan cache: %s", e)
+
+
+def invalidate_cached_plan(resource_id: str):
+    """
+    Remove the plan result of a stack from the cache
+
+    Args:
+        resource_id (str): stack/resource id
+    """
+    try:
+        get_redis_client().delete(PLAN_CACHE_KEY.format(resource_id=resource_id))
+    except RedisError as e:
+        get_logger().warning("Unable to invalidate the plan cache: %s", e)
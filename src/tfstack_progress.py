@@ -0,0 +1,107 @@
+import os
+
+from redis.exceptions import RedisError
+
+from utils import get_logger, get_redis_client
+
+
+"""Progress of running requests, published as a redis stream per request_id.
+
+The workers publish every output line of the Terraform shell scripts,
+the API tails the stream for clients. Every published request is registered,
+so the API can tell a queued request without progress from an unknown one.
+"""
+
+PROGRESS_MAXLEN = int(os.environ.get("PROGRESS_MAXLEN", "1000"))
+PROGRESS_TTL = int(os.environ.get("PROGRESS_TTL", "3600"))
+# seconds a published request is known, it must exceed the longest wait and execution
+PROGRESS_REQUEST_TTL = int(os.environ.get("PROGRESS_REQUEST_TTL", "86400"))
+
+PROGRESS_KEY = "tfstack:progress:{request_id}"
+PROGRESS_REQUEST_KEY = "tfstack:progress:request:{request_id}"
+
+
+def register_request(request_id: str):
+    """
+    Register a published request
+
+    Args:
+        request_id (str): request id of the Celery task
+    """
+    try:
+        get_redis_client().set(PROGRESS_REQUEST_KEY.format(request_id=request_id), 1, ex=PROGRESS_REQUEST_TTL)
+    except RedisError as e:
+        get_logger().warning("Unable to register request %s: %s", request_id, e)
+
+
+def request_known(request_id: str):
+    """
+    Args:
+        request_id (str): request id of the Celery task
+
+    Returns:
+        bool: whether the request was published in the last PROGRESS_REQUEST_TTL seconds,
+            True when redis is unavailable
+    """
+    try:
+        return bool(get_redis_client().exists(PROGRESS_REQUEST_KEY.format(request_id=request_id)))
+    except RedisError as e:
+        get_logger().warning("Unable to look up request %s: %s", request_id, e)
+        return True
+
+
+def publish_progress(request_id: str, line: str):
+    """
+    Publish an output line of a running request
+
+    Args:
+        request_id (str): request id of the Celery task
+        line (str): output line
+    """
+    _publish(request_id, {'line': line})
+
+
+def publish_progress_end(request_id: str, status: str):
+    """
+    Publish the end of a request, so clients stop tailing
+
+    Args:
+        request_id (str): request id of the Celery task
+        status (str): final status of the Celery task
+    """
+    _publish(request_id, {'end': status})
+
+
+def _publish(request_id: str, fields: dict):
+    key = PROGRESS_KEY.format(request_id=request_id)
+    try:
+        pipeline = get_redis_client().pipeline()
+        pipeline.xadd(key, fields, maxlen=PROGRESS_MAXLEN, approximate=True)
+        pipeline.expire(key, PROGRESS_TTL)
+        pipeline.execute()
+    except RedisError as e:
+        get_logger().warning("Unable to publish progress: %s", e)
+
+
+def read_progress(request_id: str, last_id: str = '0', block_ms: int = None):
+    """
+    Read the progress of a request that was published after last_id
+
+    Args:
+        request_id (str): request id of the Celery task
+        last_id (str): id of the last entry that was read, '0' to read from the start
+        block_ms (int): milliseconds to wait for new entries
+
+    Returns:
+        list: (entry id, fields) tuples, decoded to str
+    """
+    key = PROGRESS_KEY.format(request_id=request_id)
+    streams = get_redis_client().xread(
+        {key: last_id}, count=100, block=block_ms)
+
+    entries = list()
+    for _, stream_entries in streams:
+        for entry_id, fields in stream_entries:
+            entries.append((entry_id.decode('utf8'),
+                            {k.decode('utf8'): v.decode('utf8') for k, v in fields.items()}))
+    return entries
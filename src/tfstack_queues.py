@@ -0,0 +1,204 @@
+import os
+import json
+import time
+
+from redis.exceptions import RedisError
+
+from utils import get_broker_client, get_logger, get_redis_client
+
+
+"""Celery queues of the tfstack operations, their backlog in the redis broker and the throughput of the workers.
+
+The backlog and throughput are the scaling signal of the workers: GET /backlog serves them
+to a Kubernetes HPA or KEDA, see the chart in k8s/chart/tfstack-api.
+"""
+
+CREATE_QUEUE = 'tfstack.create'
+READ_QUEUE = 'tfstack.read'
+DELETE_QUEUE = 'tfstack.delete'
+UPDATE_QUEUE = 'tfstack.update'
+# the drift sweeps, so they never delay the reads of the users
+DRIFT_QUEUE = 'tfstack.drift'
+# the deliveries of the completion callbacks, bounded on their own, see tfstack_callbacks
+CALLBACK_QUEUE = 'tfstack.callbacks'
+QUEUES = [CREATE_QUEUE, READ_QUEUE, DELETE_QUEUE, UPDATE_QUEUE, DRIFT_QUEUE, CALLBACK_QUEUE]
+OPERATION_QUEUES = {'create': CREATE_QUEUE, 'read': READ_QUEUE, 'delete': DELETE_QUEUE, 'update': UPDATE_QUEUE,
+                    'drift': DRIFT_QUEUE, 'callback': CALLBACK_QUEUE}
+
+# the redis transport keeps a list per priority step, see broker_transport_options
+PRIORITY_STEPS = list(range(10))
+PRIORITY_SEPARATOR = '\x06\x16'
+
+THROUGHPUT_KEY = "tfstack:throughput:{operation}:{bucket}"
+THROUGHPUT_BUCKET_SECONDS = 60
+THROUGHPUT_WINDOW = int(os.environ.get("THROUGHPUT_WINDOW", "900"))
+
+
+def priority_queue_keys(queue: str):
+    """
+    Args:
+        queue (str): name of the Celery queue
+
+    Returns:
+        list: the redis keys of the queue, from the highest to the lowest priority
+    """
+    return [queue if step == 0 else '{}{}{}'.format(queue, PRIORITY_SEPARATOR, step)
+            for step in PRIORITY_STEPS]
+
+
+def queue_lengths(client=None, queues: list = QUEUES):
+    """
+    Counts the messages waiting in the queues, over all priorities
+
+    Args:
+        client (redis.Redis): redis client of the broker
+        queues (list): names of the Celery queues
+
+    Returns:
+        dict: amount of waiting messages per queue
+    """
+    if client is None:
+        client = get_broker_client()
+
+    pipeline = client.pipeline()
+    for queue in queues:
+        for key in priority_queue_keys(queue):
+            pipeline.llen(key)
+    lengths = pipeline.execute()
+
+    steps = len(PRIORITY_STEPS)
+    return {queue: sum(lengths[i * steps:(i + 1) * steps]) for i, queue in enumerate(queues)}
+
+
+def oldest_message_ages(queues: list = QUEUES, client=None):
+    """
+    Age of the oldest message waiting in the queues, over all priorities,
+    from the publish time header of the task messages
+
+    Args:
+        queues (list): names of the Celery queues
+        client (redis.Redis): redis client of the broker
+
+    Returns:
+        dict: age in seconds of the oldest waiting message per queue, None for an empty queue
+    """
+    if client is None:
+        client = get_broker_client()
+
+    # new messages are pushed on the left, the oldest message of a list is on the right
+    pipeline = client.pipeline()
+    for queue in queues:
+        for key in priority_queue_keys(queue):
+            pipeline.lindex(key, -1)
+    messages = pipeline.execute()
+
+    now = time.time()
+    steps = len(PRIORITY_STEPS)
+    ages = dict()
+    for i, queue in enumerate(queues):
+        published_at = [_published_at(message)
+                        for message in messages[i * steps:(i + 1) * steps] if message is not None]
+        published_at = [published for published in published_at if published is not None]
+        ages[queue] = now - min(published_at) if published_at else None
+    return ages
+
+
+def _published_at(message: bytes):
+    try:
+        return json.loads(message)['headers'].get('tfstack_published_at')
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def record_task_duration(operation: str, seconds: float):
+    """
+    Count a finished task and its duration, for the throughput of the workers
+
+    Args:
+        operation (str): name of the operation: create, read, delete
+        seconds (float): duration of the task
+    """
+    bucket = int(time.time() // THROUGHPUT_BUCKET_SECONDS)
+    key = THROUGHPUT_KEY.format(operation=operation, bucket=bucket)
+    try:
+        pipeline = get_redis_client().pipeline()
+        pipeline.hincrby(key, 'tasks', 1)
+        pipeline.hincrbyfloat(key, 'seconds', seconds)
+        pipeline.expire(key, THROUGHPUT_WINDOW + THROUGHPUT_BUCKET_SECONDS)
+        pipeline.execute()
+    except RedisError as e:
+        get_logger().warning("Unable to record the duration of a %s task: %s", operation, e)
+
+
+def task_throughput(window: int = THROUGHPUT_WINDOW, client=None):
+    """
+    Throughput of the workers per operation, over the last window seconds
+
+    Args:
+        window (int): seconds to look back
+        client (redis.Redis): redis client
+
+    Returns:
+        dict: 'tasks_per_minute' and 'average_task_duration' (None without finished tasks) per operation
+    """
+    if client is None:
+        client = get_redis_client()
+
+    last_bucket = int(time.time() // THROUGHPUT_BUCKET_SECONDS)
+    buckets = range(last_bucket - window // THROUGHPUT_BUCKET_SECONDS + 1, last_bucket + 1)
+
+    pipeline = client.pipeline()
+    for operation in OPERATION_QUEUES:
+        for bucket in buckets:
+            pipeline.hmget(THROUGHPUT_KEY.format(operation=operation, bucket=bucket), 'tasks', 'seconds')
+    counters = pipeline.execute()
+
+    throughput = dict()
+    for i, operation in enumerate(OPERATION_QUEUES):
+        tasks, seconds = 0, 0.0
+        for bucket_tasks, bucket_seconds in counters[i * len(buckets):(i + 1) * len(buckets)]:
+            tasks += int(bucket_tasks or 0)
+            seconds += float(bucket_seconds or 0)
+        throughput[operation] = {
+            'tasks_per_minute': tasks * 60.0 / window,
+            'average_task_duration': seconds / tasks if tasks else None,
+        }
+    return throughput
+
+
+def get_backlog(queues: list = QUEUES):
+    """
+    Backlog and throughput per queue, and the totals of the queues.
+    The estimated drain time is the time the current throughput needs to process the backlog.
+
+    Args:
+        queues (list): names of the Celery queues
+
+    Returns:
+        dict: 'queues' and 'total'
+    """
+    broker_client = get_broker_client()
+    lengths = queue_lengths(broker_client)
+    ages = oldest_message_ages(queues, broker_client)
+    throughput = task_throughput()
+
+    backlog = dict()
+    for operation, queue in OPERATION_QUEUES.items():
+        if queue not in queues:
+            continue
+        tasks_per_minute = throughput[operation]['tasks_per_minute']
+        backlog[queue] = {
+            'length': lengths[queue],
+            'oldest_message_age': ages[queue],
+            'tasks_per_minute': tasks_per_minute,
+            'average_task_duration': throughput[operation]['average_task_duration'],
+            'estimated_drain_time': lengths[queue] * 60.0 / tasks_per_minute if tasks_per_minute else None,
+        }
+
+    queue_ages = [queue_backlog['oldest_message_age'] for queue_backlog in backlog.values()
+                  if queue_backlog['oldest_message_age'] is not None]
+    total = {
+        'length': sum(queue_backlog['length'] for queue_backlog in backlog.values()),
+        'oldest_message_age': max(queue_ages) if queue_ages else None,
+    }
+    return {'queues': backlog, 'total': total}
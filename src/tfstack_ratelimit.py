@@ -0,0 +1,201 @@
+import os
+import time
+import hashlib
+
+from redis.exceptions import RedisError
+
+from tfstack_batches import pending_batch_items
+from tfstack_queues import CALLBACK_QUEUE, queue_lengths
+from utils import get_logger, get_redis_client
+
+
+"""Admission control of the API: rate limits per client and operation, and a global cap on the queued tasks.
+
+Every client has a token bucket per operation in redis. A client is identified by its API key
+when the key is one of API_KEYS, by its remote address otherwise, so a made up key doesn't get a bucket of its own.
+A rate limit is configured per operation as '<requests>/<seconds>' (RATE_LIMIT_CREATE etc.),
+the bucket holds <requests> tokens and refills at <requests>/<seconds> tokens per second.
+Requests that are not admitted are answered with a 429 and a Retry-After header,
+a request that costs more than a full bucket (e.g. a large batch) can never be admitted and is answered with a 400.
+The cap on the queued tasks counts the tasks in the queues and the pending items of the batches.
+Admission fails open when redis is unavailable.
+"""
+
+DEFAULT_RATE_LIMITS = {
+    'create': '20/60',
+    'update': '20/60',
+    'delete': '20/60',
+    'read': '60/60',
+    # cancellations, which broadcast a revoke to all workers
+    'cancel': '20/60',
+    # drift checks per state backend, see drift_tf_stack_task
+    'drift': '30/60',
+}
+RATE_LIMITS = {operation: os.environ.get("RATE_LIMIT_" + operation.upper(), limit)
+               for operation, limit in DEFAULT_RATE_LIMITS.items()}
+
+# comma separated API keys that identify a client, the X-API-Key header is ignored without them
+API_KEYS = frozenset(key.strip() for key in os.environ.get("API_KEYS", "").split(",") if key.strip())
+
+# 0 disables the cap
+MAX_QUEUED_TASKS = int(os.environ.get("MAX_QUEUED_TASKS", "1000"))
+QUEUED_TASKS_RETRY_AFTER = int(os.environ.get("QUEUED_TASKS_RETRY_AFTER", "30"))
+QUEUE_DEPTH_CACHE_SECONDS = 1.0
+
+RATE_LIMIT_KEY = "tfstack:ratelimit:{operation}:{client}"
+
+# takes cost tokens from the bucket when it holds enough tokens,
+# returns 1 or 0 and the milliseconds until enough tokens are available
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+
+local bucket = redis.call('hmget', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+
+local allowed = 0
+local wait_ms = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    wait_ms = math.ceil((cost - tokens) / rate * 1000)
+end
+
+redis.call('hset', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('expire', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, wait_ms}
+"""
+
+_queue_depth = {'checked_at': 0.0, 'queued': 0}
+
+
+class RateLimited(Exception):
+    """
+    Raised when a request is not admitted
+    """
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CostExceedsRateLimit(Exception):
+    """
+    Raised when a request costs more tokens than a bucket holds, it is never admitted
+    """
+
+
+def parse_rate_limit(rate_limit: str):
+    """
+    Args:
+        rate_limit (str): '<requests>/<seconds>', an empty value or '0' disables the limit
+
+    Returns:
+        tuple: (capacity, tokens per second) or None when disabled
+    """
+    if not rate_limit or rate_limit == '0':
+        return None
+    requests, seconds = rate_limit.split('/')
+    return int(requests), int(requests) / float(seconds)
+
+
+def client_key(api_key: str, remote_addr: str):
+    """
+    Args:
+        api_key (str): API key of the client, if any
+        remote_addr (str): remote address of the client
+
+    Returns:
+        str: identity of the client for the rate limits, API keys are hashed.
+            Keys that are not one of API_KEYS are ignored.
+    """
+    if api_key and api_key in API_KEYS:
+        return 'key:' + hashlib.sha256(api_key.encode('utf8')).hexdigest()[:32]
+    return 'addr:' + (remote_addr or 'unknown')
+
+
+def take_tokens(client: str, operation: str, cost: int = 1):
+    """
+    Take tokens from the bucket of a client and operation
+
+    Args:
+        client (str): identity of the client, see client_key
+        operation (str): name of the operation: create, read, delete, update
+        cost (int): amount of tokens, e.g. the size of a batch
+
+    Raises:
+        RateLimited: when the bucket doesn't hold enough tokens
+        CostExceedsRateLimit: when the cost exceeds the capacity of the bucket
+
+    Returns:
+        bool: True when admitted
+    """
+    rate_limit = parse_rate_limit(RATE_LIMITS.get(operation))
+    if rate_limit is None:
+        return True
+    capacity, rate = rate_limit
+    if cost > capacity:
+        raise CostExceedsRateLimit("Request of {} exceeds the {} rate limit of {}".format(
+            cost, operation, RATE_LIMITS[operation]))
+
+    try:
+        allowed, wait_ms = get_redis_client().eval(
+            TOKEN_BUCKET_SCRIPT, 1, RATE_LIMIT_KEY.format(operation=operation, client=client),
+            capacity, rate, time.time(), cost)
+    except RedisError as e:
+        get_logger().warning("Unable to check the rate limit: %s", e)
+        return True
+
+    if not allowed:
+        raise RateLimited("Rate limit of {} exceeded".format(operation), max(1, -(-wait_ms // 1000)))
+    return True
+
+
+def check_queued_tasks(cost: int = 1):
+    """
+    Check the global cap on the tasks that are waiting in the queues and the pending items of the batches,
+    the callbacks are bounded on their own
+
+    Args:
+        cost (int): amount of tasks the request enqueues
+
+    Raises:
+        RateLimited: when the queues are full
+    """
+    if MAX_QUEUED_TASKS <= 0:
+        return
+
+    now = time.time()
+    if now - _queue_depth['checked_at'] > QUEUE_DEPTH_CACHE_SECONDS:
+        try:
+            _queue_depth['queued'] = sum(length for queue, length in queue_lengths().items()
+                                         if queue != CALLBACK_QUEUE) + pending_batch_items()
+            _queue_depth['checked_at'] = now
+        except RedisError as e:
+            get_logger().warning("Unable to check the queue depth: %s", e)
+            return
+
+    if _queue_depth['queued'] + cost > MAX_QUEUED_TASKS:
+        raise RateLimited("Too many queued tasks", QUEUED_TASKS_RETRY_AFTER)
+
+
+def admit(client: str, operation: str, cost: int = 1):
+    """
+    Admission control of a request that enqueues tasks
+
+    Args:
+        client (str): identity of the client, see client_key
+        operation (str): name of the operation: create, read, delete, update
+        cost (int): amount of tasks the request enqueues
+
+    Raises:
+        RateLimited: when the request is not admitted
+        CostExceedsRateLimit: when the request can never be admitted
+    """
+    check_queued_tasks(cost)
+    take_tokens(client, operation, cost)
@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import time
+import tempfile
+
+
+"""Startup readiness of a Celery worker, for the startup and readiness probes of its container.
+
+A worker is ready when it is connected to the broker (Celery's worker_ready signal) and
+its warm working directory pool prepared a working directory (pre-initialized Terraform config).
+The worker then writes WORKER_READY_FILE, with its cold start time: the time between the start
+of the process and being ready. The probe of the container checks the file:
+
+    python -m tfstack_readiness
+"""
+
+WORKER_READY_FILE = os.environ.get(
+    "WORKER_READY_FILE", os.path.join(tempfile.gettempdir(), "tfstack-worker-ready"))
+# a worker without a warm working directory after WORKER_WARM_TIMEOUT seconds is ready anyway,
+# its tasks run in TF_DIR until the pool is filled
+WORKER_WARM_TIMEOUT = int(os.environ.get("WORKER_WARM_TIMEOUT", "300"))
+
+# fallback for the start of the process, when /proc is not available
+_imported_at = time.time()
+
+
+def process_start_time(pid: int = None):
+    """
+    Args:
+        pid (int): process id, the current process by default
+
+    Returns:
+        float: the start time of the process (epoch seconds), from /proc,
+            or the time this module was imported
+    """
+    try:
+        with open('/proc/{}/stat'.format(pid or os.getpid())) as stat_file:
+            # the process name between parentheses may contain spaces
+            fields = stat_file.read().rsplit(')', 1)[1].split()
+        with open('/proc/stat') as stat_file:
+            boot_time = next(int(line.split()[1]) for line in stat_file if line.startswith('btime'))
+        return boot_time + int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, IndexError, StopIteration, ValueError):
+        return _imported_at
+
+
+def wait_until(condition, timeout: float, interval: float = 0.5):
+    """
+    Args:
+        condition (function): returns True when met
+        timeout (float): seconds
+        interval (float): seconds between the checks
+
+    Returns:
+        bool: whether the condition was met before the timeout
+    """
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() >= deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+
+def mark_ready(started_at: float, warm: bool, path: str = WORKER_READY_FILE):
+    """
+    Writes the readiness file of the worker
+
+    Args:
+        started_at (float): start time of the worker process
+        warm (bool): whether a warm working directory was prepared
+        path (str): the path to the readiness file
+
+    Returns:
+        float: the cold start time in seconds
+    """
+    ready_at = time.time()
+    readiness = {
+        'started_at': started_at,
+        'ready_at': ready_at,
+        'cold_start_seconds': round(ready_at - started_at, 3),
+        'warm': warm,
+    }
+    # written atomically, the probe never reads a partial file
+    temporary_path = '{}.{}'.format(path, os.getpid())
+    with open(temporary_path, 'w') as ready_file:
+        json.dump(readiness, ready_file)
+    os.replace(temporary_path, path)
+    return readiness['cold_start_seconds']
+
+
+def clear_ready(path: str = WORKER_READY_FILE):
+    """
+    Removes the readiness file, when the worker starts or stops
+
+    Args:
+        path (str): the path to the readiness file
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def get_readiness(path: str = WORKER_READY_FILE):
+    """
+    Args:
+        path (str): the path to the readiness file
+
+    Returns:
+        dict: the readiness of the worker or None when it is not ready
+    """
+    try:
+        with open(path) as ready_file:
+            return json.load(ready_file)
+    except (OSError, ValueError):
+        return None
+
+
+def main():
+    """
+    Probe of the worker container, exits with 1 when the worker is not ready
+    """
+    readiness = get_readiness()
+    if readiness is None:
+        print("not ready")
+        sys.exit(1)
+    print(json.dumps(readiness))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+import os
+import json
+import zlib
+
+import msgpack
+from redis.exceptions import RedisError
+
+from utils import get_broker_client, get_logger, get_redis_client, get_results_client
+
+
+"""Compact encoding and retention of the task results in the result backend, and selection of result fields.
+
+Results are encoded with msgpack, payloads larger than RESULT_COMPRESSION_THRESHOLD bytes
+are compressed with zlib. The first byte of an encoded result tells whether it is compressed,
+results that were stored as JSON before (e.g. by a previous release) are still decoded.
+
+Results expire after a retention per operation (RESULT_EXPIRES_<OPERATION>). A result with verbose content
+(e.g. the resources of a read) is compacted RESULT_COMPACT_DELAY seconds after it is first fetched:
+the verbose content is replaced by its size, the rest of the result is kept.
+"""
+
+RESULT_SERIALIZER = os.environ.get("RESULT_SERIALIZER", "tfstack-msgpack")
+RESULT_COMPRESSION_THRESHOLD = int(
+    os.environ.get("RESULT_COMPRESSION_THRESHOLD", "1024"))
+RESULT_EXPIRES = int(os.environ.get("RESULT_EXPIRES", "86400"))
+# reads are cached and drift checks are kept in the drift report, their results are needed shortly
+DEFAULT_RESULT_EXPIRES = {
+    'create': RESULT_EXPIRES,
+    'update': RESULT_EXPIRES,
+    'delete': RESULT_EXPIRES,
+    'read': 3600,
+    'drift': 3600,
+}
+RESULT_EXPIRES_PER_OPERATION = {operation: int(os.environ.get("RESULT_EXPIRES_" + operation.upper(), expires))
+                                for operation, expires in DEFAULT_RESULT_EXPIRES.items()}
+# 0 disables the compaction
+RESULT_COMPACT_DELAY = int(os.environ.get("RESULT_COMPACT_DELAY", "300"))
+VERBOSE_RESULT_FIELDS = ('resources', 'output')
+
+# the key of a result in the Celery redis result backend
+RESULT_KEY = "celery-task-meta-{task_id}"
+RESULT_COMPACTION_KEY = "tfstack:results:compaction:{task_id}"
+
+CONTENT_TYPE = 'application/x-tfstack-msgpack'
+
+_PLAIN = b'\x00'
+_COMPRESSED = b'\x01'
+
+
+def dumps(obj, compression_threshold: int = RESULT_COMPRESSION_THRESHOLD):
+    """
+    Encodes a result
+
+    Args:
+        obj: the result, any msgpack serializable value
+        compression_threshold (int): size in bytes above which the encoded result is compressed, 0 disables compression
+
+    Returns:
+        bytes: the encoded result
+    """
+    packed = msgpack.packb(obj, use_bin_type=True)
+    if 0 < compression_threshold < len(packed):
+        return _COMPRESSED + zlib.compress(packed)
+    return _PLAIN + packed
+
+
+def loads(data: bytes):
+    """
+    Decodes a result encoded by dumps, or a JSON result that was stored before the results were encoded by dumps
+
+    Args:
+        data (bytes): the encoded result
+
+    Raises:
+        Exception: "Unknown result encoding"
+
+    Returns:
+        the result
+    """
+    if isinstance(data, str):
+        data = data.encode('latin-1')
+    marker, packed = data[:1], data[1:]
+    if marker == _COMPRESSED:
+        packed = zlib.decompress(packed)
+    elif marker != _PLAIN:
+        try:
+            return json.loads(data.decode('utf8'))
+        except ValueError:
+            raise Exception("Unknown result encoding")
+    return msgpack.unpackb(packed, raw=False)
+
+
+def register_result_serializer():
+    """
+    Registers the encoding as the kombu serializer 'tfstack-msgpack'
+    """
+    from kombu.serialization import register
+
+    register('tfstack-msgpack', dumps, loads,
+             content_type=CONTENT_TYPE, content_encoding='binary')
+
+
+def select_fields(document: dict, fields: list):
+    """
+    Selects fields of a document, nested fields are separated by dots, e.g. 'request_result.resources'.
+    Unknown fields are left out.
+
+    Args:
+        document (dict): the document
+        fields (list): the fields to select
+
+    Returns:
+        dict: the document with only the selected fields
+    """
+    selection = dict()
+    for field in fields:
+        source, target = document, selection
+        path = field.split('.')
+        for key in path[:-1]:
+            if not isinstance(source, dict) or not isinstance(source.get(key), dict):
+                break
+            source = source[key]
+            target = target.setdefault(key, dict())
+        else:
+            if isinstance(source, dict) and path[-1] in source:
+                target[path[-1]] = source[path[-1]]
+    return selection
+
+
+def expire_result(task_id: str, operation: str):
+    """
+    Applies the retention of the operation to a stored result
+
+    Args:
+        task_id (str): request id
+        operation (str): name of the operation: create, read, delete, update, drift
+    """
+    expires = RESULT_EXPIRES_PER_OPERATION.get(operation)
+    if expires is None or expires == RESULT_EXPIRES:
+        return
+    try:
+        get_results_client().expire(RESULT_KEY.format(task_id=task_id), expires)
+    except RedisError as e:
+        get_logger().warning("Unable to set the expiry of the result of %s: %s", task_id, e)
+
+
+def compact_result(result):
+    """
+    Args:
+        result: the result of a task
+
+    Returns:
+        dict: the result with the size of its verbose fields instead of their content ('<field>_count'),
+            None when the result has no verbose content
+    """
+    if not isinstance(result, dict) or result.get('compacted'):
+        return None
+    verbose_fields = [field for field in VERBOSE_RESULT_FIELDS if isinstance(result.get(field), list)]
+    if not verbose_fields:
+        return None
+
+    compacted = {key: value for key, value in result.items() if key not in verbose_fields}
+    for field in verbose_fields:
+        compacted[field + '_count'] = len(result[field])
+    compacted['compacted'] = True
+    return compacted
+
+
+def claim_result_compaction(task_id: str, result):
+    """
+    Claims the compaction of a fetched result, once per result
+
+    Args:
+        task_id (str): request id
+        result: the fetched result
+
+    Returns:
+        bool: True when the result has verbose content and its compaction wasn't claimed before
+    """
+    if RESULT_COMPACT_DELAY <= 0 or compact_result(result) is None:
+        return False
+    try:
+        return bool(get_redis_client().set(
+            RESULT_COMPACTION_KEY.format(task_id=task_id), 1, nx=True, ex=RESULT_EXPIRES))
+    except RedisError as e:
+        get_logger().warning("Unable to claim the compaction of the result of %s: %s", task_id, e)
+        return False
+
+
+def replace_result(task_id: str, encoded_meta: bytes):
+    """
+    Replaces a stored result, keeping its expiry
+
+    Args:
+        task_id (str): request id
+        encoded_meta (bytes): the result and its metadata, encoded by the result backend
+
+    Returns:
+        bool: whether the result still existed
+    """
+    return bool(get_results_client().set(
+        RESULT_KEY.format(task_id=task_id), encoded_meta, xx=True, keepttl=True))
+
+
+def memory_usage(client):
+    """
+    Args:
+        client (redis.Redis): redis client
+
+    Returns:
+        dict: memory usage, limit and eviction policy, and the amount of evicted, expired and stored keys of the redis
+    """
+    info = client.info()
+    return {
+        'used_memory': info['used_memory'],
+        'used_memory_peak': info['used_memory_peak'],
+        'maxmemory': info.get('maxmemory', 0),
+        'maxmemory_policy': info.get('maxmemory_policy'),
+        'evicted_keys': info.get('evicted_keys', 0),
+        'expired_keys': info.get('expired_keys', 0),
+        'keys': sum(db['keys'] for name, db in info.items() if name.startswith('db') and isinstance(db, dict)),
+    }
+
+
+def get_memory_usage():
+    """
+    Returns:
+        dict: memory usage of the 'broker' and the result 'backend', and whether they share a redis
+    """
+    broker_client, backend_client = get_broker_client(), get_results_client()
+    broker = memory_usage(broker_client)
+    shared = broker_client is backend_client
+    return {
+        'broker': broker,
+        'backend': broker if shared else memory_usage(backend_client),
+        'shared': shared,
+    }
@@ -0,0 +1,161 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+
+
+"""Reader of the Terraform remote state of the stacks, straight from the S3 state backend.
+
+The API reads the resources of a stack from its workspace state object, instead of running
+'terraform state list' on a worker. Every process keeps a snapshot cache of the parsed states,
+a read is a conditional GET (If-None-Match with the ETag of the snapshot) that only transfers
+the state when it changed. boto3 is only imported when the state reader is used.
+"""
+
+TF_STATE_BUCKET = os.environ.get("TF_STATE_BUCKET")
+TF_STATE_KEY = os.environ.get("TF_STATE_KEY", "terraform.tfstate")
+TF_STATE_WORKSPACE_KEY_PREFIX = os.environ.get(
+    "TF_STATE_WORKSPACE_KEY_PREFIX", "env:")
+# e.g. a local S3 stand-in
+TF_STATE_ENDPOINT_URL = os.environ.get("TF_STATE_ENDPOINT_URL")
+TF_STATE_REGION = os.environ.get("TF_STATE_REGION")
+
+STATE_SNAPSHOT_CACHE_SIZE = int(
+    os.environ.get("STATE_SNAPSHOT_CACHE_SIZE", "1000"))
+
+_s3_client = None
+_snapshots = OrderedDict()
+_snapshots_lock = threading.Lock()
+
+
+def state_reader_enabled():
+    """
+    Returns:
+        bool: whether the state backend is configured
+    """
+    return bool(TF_STATE_BUCKET)
+
+
+def get_s3_client():
+    """
+    Returns:
+        botocore.client.S3: S3 client of the state backend, created on first use
+    """
+    global _s3_client
+
+    if _s3_client is None:
+        import boto3
+        from botocore.config import Config
+
+        config = Config(s3={'addressing_style': 'path'}) if TF_STATE_ENDPOINT_URL else None
+        _s3_client = boto3.client('s3', endpoint_url=TF_STATE_ENDPOINT_URL,
+                                  region_name=TF_STATE_REGION, config=config)
+    return _s3_client
+
+
+def state_object_key(resource_id: str):
+    """
+    Args:
+        resource_id (str): stack/resource id, the Terraform workspace
+
+    Returns:
+        str: key of the state object of the workspace in the S3 state backend
+    """
+    return '{}/{}/{}'.format(TF_STATE_WORKSPACE_KEY_PREFIX, resource_id, TF_STATE_KEY)
+
+
+def read_state(resource_id: str):
+    """
+    Reads the resources of a stack from its remote state, with a conditional GET
+    when a snapshot of the state is cached
+
+    Args:
+        resource_id (str): stack/resource id
+
+    Raises:
+        Exception: "error:WorkspaceNotExist"
+
+    Returns:
+        dict : containing message of status of succesful read, including the resources
+    """
+    from botocore.exceptions import ClientError
+
+    with _snapshots_lock:
+        snapshot = _snapshots.get(resource_id)
+
+    request = {'Bucket': TF_STATE_BUCKET, 'Key': state_object_key(resource_id)}
+    if snapshot is not None:
+        request['IfNoneMatch'] = snapshot['etag']
+
+    try:
+        response = get_s3_client().get_object(**request)
+    except ClientError as e:
+        error_code = e.response.get('Error', {}).get('Code')
+        if error_code in ('304', 'NotModified') and snapshot is not None:
+            _store_snapshot(resource_id, snapshot)
+            return _read_result(snapshot['resources'])
+        if error_code in ('404', 'NoSuchKey'):
+            _drop_snapshot(resource_id)
+            error_message = 'error:WorkspaceNotExist'
+            raise Exception(error_message)
+        raise
+
+    resources = parse_state_resources(json.loads(response['Body'].read()))
+    _store_snapshot(resource_id, {'etag': response['ETag'], 'resources': resources})
+    return _read_result(resources)
+
+
+def _read_result(resources: list):
+    return {
+        'message': "TFstack read succesfully",
+        'resources': resources
+    }
+
+
+def _store_snapshot(resource_id: str, snapshot: dict):
+    with _snapshots_lock:
+        _snapshots[resource_id] = snapshot
+        _snapshots.move_to_end(resource_id)
+        while len(_snapshots) > STATE_SNAPSHOT_CACHE_SIZE:
+            _snapshots.popitem(last=False)
+
+
+def _drop_snapshot(resource_id: str):
+    with _snapshots_lock:
+        _snapshots.pop(resource_id, None)
+
+
+def parse_state_resources(state: dict):
+    """
+    Parses the resources of a Terraform state (format version 4), one per resource instance,
+    like the resource addresses of 'terraform state list'
+
+    Args:
+        state (dict): the decoded state
+
+    Returns:
+        list: 'address', 'module', 'mode', 'type', 'name' and 'index' per resource instance
+    """
+    resources = list()
+    for resource in state.get('resources', []):
+        module = resource.get('module')
+        mode = resource.get('mode', 'managed')
+        prefix = '{}.'.format(module) if module else ''
+        if mode == 'data':
+            prefix += 'data.'
+        base_address = '{}{}.{}'.format(prefix, resource['type'], resource['name'])
+
+        for instance in resource.get('instances', []):
+            index = instance.get('index_key')
+            address = base_address
+            if index is not None:
+                address += '[{}]'.format(json.dumps(index))
+            resources.append({
+                'address': address,
+                'module': module,
+                'mode': mode,
+                'type': resource['type'],
+                'name': resource['name'],
+                'index': index,
+            })
+    return resources
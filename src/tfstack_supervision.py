@@ -0,0 +1,381 @@
+import os
+import re
+import json
+import time
+import shutil
+import signal
+import tempfile
+import threading
+import subprocess
+
+from redis.exceptions import RedisError
+
+from tfstack_metrics import ORPHANS_REAPED
+from utils import get_logger, get_redis_client
+
+
+"""Supervision of the Terraform shell scripts: time limits, cancellation and reaping of orphans.
+
+Every script runs in its own process group, with a time limit per operation (TIME_LIMIT_<OPERATION>).
+A script that exceeds its time limit or of which the request is cancelled first gets SIGINT,
+so Terraform is able to release the state lock, and SIGKILL after TERMINATE_GRACE_PERIOD.
+The Celery tasks have a soft and hard time limit on top, for the parts that are not a script.
+
+A running script is registered in TF_PROCESS_DIR with the worker process that owns it. When a worker process
+is lost (e.g. killed at the hard time limit), the reaper of the worker terminates the process groups
+it owned, and removes the working directories it left behind.
+"""
+
+DEFAULT_TIME_LIMITS = {
+    'create': 3600,
+    'update': 3600,
+    'delete': 3600,
+    'plan': 1800,
+    'drift': 1800,
+    'read': 600,
+    'list': 600,
+}
+# seconds per execution of a script
+TIME_LIMITS = {operation: int(os.environ.get("TIME_LIMIT_" + operation.upper(), limit))
+               for operation, limit in DEFAULT_TIME_LIMITS.items()}
+TERMINATE_GRACE_PERIOD = int(os.environ.get("TERMINATE_GRACE_PERIOD", "60"))
+
+# seconds between the checks of the watchdog for a cancellation of the request
+CANCEL_CHECK_INTERVAL = float(os.environ.get("CANCEL_CHECK_INTERVAL", "5"))
+CANCEL_EXPIRES = int(os.environ.get("CANCEL_EXPIRES", "86400"))
+CANCEL_KEY = "tfstack:cancel:{request_id}"
+
+TF_PROCESS_DIR = os.environ.get(
+    "TF_PROCESS_DIR", os.path.join(tempfile.gettempdir(), "tfstack-processes"))
+REAPER_INTERVAL = int(os.environ.get("REAPER_INTERVAL", "60"))
+# temporary directories are named after the process that owns them, see owned_prefix
+OWNED_DIR_NAME = re.compile(r'^(?:tmp|warm|staging)-(\d+)-')
+
+TIMED_OUT = 'timed_out'
+CANCELLED = 'cancelled'
+
+
+def task_time_limits(operations: list):
+    """
+    Soft and hard time limit of a Celery task that executes the scripts of the operations, one after another.
+    The soft limit leaves the executors time to stop a script themselves, the hard limit
+    leaves the task time to stop a script after the soft limit.
+
+    Args:
+        operations (list): names of the operations, e.g. ['plan', 'update']
+
+    Returns:
+        tuple: (soft time limit, hard time limit) in seconds
+    """
+    soft_time_limit = sum(TIME_LIMITS[operation] for operation in operations) + TERMINATE_GRACE_PERIOD
+    return soft_time_limit, soft_time_limit + TERMINATE_GRACE_PERIOD + 30
+
+
+def owned_prefix(kind: str):
+    """
+    Args:
+        kind (str): kind of temporary directory: tmp, warm or staging
+
+    Returns:
+        str: prefix of a temporary directory that is owned by the current process
+    """
+    return '{}-{}-'.format(kind, os.getpid())
+
+
+def process_alive(pid: int):
+    """
+    Args:
+        pid (int): process id
+
+    Returns:
+        bool: whether the process exists
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def process_group_alive(pgid: int):
+    """
+    Args:
+        pgid (int): process group id
+
+    Returns:
+        bool: whether any process of the group exists
+    """
+    try:
+        os.killpg(pgid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def terminate_process_group(process, grace_period: int = None):
+    """
+    Terminates the process group of a script, SIGINT first and SIGKILL after the grace period
+
+    Args:
+        process (subprocess.Popen): the script process, leader of its process group
+        grace_period (int): seconds, TERMINATE_GRACE_PERIOD by default
+    """
+    if process.poll() is not None:
+        return
+
+    grace_period = TERMINATE_GRACE_PERIOD if grace_period is None else grace_period
+    try:
+        os.killpg(process.pid, signal.SIGINT)
+        process.wait(grace_period)
+    except ProcessLookupError:
+        pass
+    except subprocess.TimeoutExpired:
+        get_logger().warning(
+            "Terraform executor did not stop after SIGINT, killing it")
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
+
+
+class ProcessWatchdog:
+    """
+    Context manager that supervises a script process: terminates its process group when it exceeds
+    its time limit or when the request is cancelled, and registers it for the reaper meanwhile.
+    """
+
+    def __init__(self, process, operation: str = None, timeout: float = None, cancelled=None,
+                 interval: float = None, process_dir: str = None):
+        """
+        Args:
+            process (subprocess.Popen): the script process, leader of its process group
+            operation (str): name of the operation
+            timeout (float): seconds, None for no time limit
+            cancelled (callable): returns True when the request is cancelled
+            interval (float): seconds between the checks, CANCEL_CHECK_INTERVAL by default
+            process_dir (str): the path to the process registry, TF_PROCESS_DIR by default
+        """
+        self.process = process
+        self.operation = operation
+        self.timeout = timeout
+        self.cancelled = cancelled
+        self.interval = interval or CANCEL_CHECK_INTERVAL
+        self.process_dir = process_dir or TF_PROCESS_DIR
+        self.reason = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        register_process(self.process.pid, self.operation, self.process_dir)
+        if self.timeout or self.cancelled:
+            self._thread = threading.Thread(target=self._watch, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stopped.set()
+        # e.g. the soft time limit of the task or an error of the output callback
+        if exc_type is not None:
+            terminate_process_group(self.process)
+        if self._thread is not None:
+            self._thread.join()
+        unregister_process(self.process.pid, self.process_dir)
+
+    def _watch(self):
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        while True:
+            interval = self.interval if deadline is None else \
+                min(self.interval, max(0, deadline - time.monotonic()))
+            if self._stopped.wait(interval):
+                return
+            if deadline is not None and time.monotonic() >= deadline:
+                self.reason = TIMED_OUT
+            elif self.cancelled and self._is_cancelled():
+                self.reason = CANCELLED
+            else:
+                continue
+            get_logger().warning("Terminating Terraform executor %s: %s", self.operation, self.reason)
+            terminate_process_group(self.process)
+            return
+
+    def _is_cancelled(self):
+        try:
+            return self.cancelled()
+        except Exception as e:
+            get_logger().warning("Unable to check the cancellation of the request: %s", e)
+            return False
+
+    def raise_for_reason(self):
+        """
+        Raises:
+            Exception: "Timeout during execution of Terraform executor"
+            Exception: "error:Cancelled"
+        """
+        if self.reason == TIMED_OUT:
+            error_message = "Timeout during execution of Terraform executor"
+            raise Exception(error_message)
+        if self.reason == CANCELLED:
+            error_message = 'error:Cancelled'
+            raise Exception(error_message)
+
+
+def request_cancel(request_id: str):
+    """
+    Flags a request as cancelled, for the task and the watchdog of its script
+
+    Args:
+        request_id (str): request id of the Celery task
+    """
+    get_redis_client().set(CANCEL_KEY.format(request_id=request_id), 1, ex=CANCEL_EXPIRES)
+
+
+def cancel_requested(request_id: str):
+    """
+    Args:
+        request_id (str): request id of the Celery task
+
+    Returns:
+        bool: whether the request was cancelled, False when redis is unavailable
+    """
+    try:
+        return bool(get_redis_client().exists(CANCEL_KEY.format(request_id=request_id)))
+    except RedisError as e:
+        get_logger().warning("Unable to check the cancellation of %s: %s", request_id, e)
+        return False
+
+
+def register_process(pgid: int, operation: str = None, process_dir: str = None):
+    """
+    Registers the process group of a running script with the current process as its owner
+
+    Args:
+        pgid (int): process group id
+        operation (str): name of the operation
+        process_dir (str): the path to the process registry, TF_PROCESS_DIR by default
+    """
+    process_dir = process_dir or TF_PROCESS_DIR
+    try:
+        os.makedirs(process_dir, exist_ok=True)
+        with open(os.path.join(process_dir, str(pgid)), 'w') as process_file:
+            json.dump({'owner': os.getpid(), 'operation': operation, 'started_at': time.time()}, process_file)
+    except OSError as e:
+        get_logger().warning("Unable to register process group %s: %s", pgid, e)
+
+
+def unregister_process(pgid: int, process_dir: str = None):
+    """
+    Args:
+        pgid (int): process group id
+        process_dir (str): the path to the process registry, TF_PROCESS_DIR by default
+    """
+    try:
+        os.remove(os.path.join(process_dir or TF_PROCESS_DIR, str(pgid)))
+    except FileNotFoundError:
+        pass
+
+
+def reap_processes(process_dir: str = None, grace_period: int = None):
+    """
+    Terminates the process groups of which the owning worker process is gone, SIGINT first
+    and SIGKILL at a following call after the grace period
+
+    Args:
+        process_dir (str): the path to the process registry, TF_PROCESS_DIR by default
+        grace_period (int): seconds, TERMINATE_GRACE_PERIOD by default
+
+    Returns:
+        int: amount of process groups that were signalled
+    """
+    process_dir = process_dir or TF_PROCESS_DIR
+    grace_period = TERMINATE_GRACE_PERIOD if grace_period is None else grace_period
+    if not os.path.isdir(process_dir):
+        return 0
+
+    signalled = 0
+    for name in os.listdir(process_dir):
+        path = os.path.join(process_dir, name)
+        try:
+            with open(path) as process_file:
+                registration = json.load(process_file)
+            pgid = int(name)
+        except (OSError, ValueError):
+            continue
+        if process_alive(registration['owner']):
+            continue
+        if not process_group_alive(pgid):
+            unregister_process(pgid, process_dir)
+            continue
+
+        if registration.get('signalled_at') is None:
+            signum = signal.SIGINT
+            registration['signalled_at'] = time.time()
+            with open(path, 'w') as process_file:
+                json.dump(registration, process_file)
+        elif time.time() - registration['signalled_at'] >= grace_period:
+            signum = signal.SIGKILL
+        else:
+            continue
+
+        get_logger().warning("Reaping orphaned Terraform executor %s (process group %s) with %s",
+                             registration.get('operation'), pgid, signum.name)
+        try:
+            os.killpg(pgid, signum)
+        except ProcessLookupError:
+            pass
+        ORPHANS_REAPED.labels('process').inc()
+        signalled += 1
+    return signalled
+
+
+def reap_workdirs(base_dirs: list):
+    """
+    Removes the temporary directories of which the owning process is gone
+
+    Args:
+        base_dirs (list): the paths to the directories that hold the temporary directories
+
+    Returns:
+        int: amount of removed directories
+    """
+    removed = 0
+    for base_dir in base_dirs:
+        if not os.path.isdir(base_dir):
+            continue
+        for name in os.listdir(base_dir):
+            match = OWNED_DIR_NAME.match(name)
+            if match is None or process_alive(int(match.group(1))):
+                continue
+            get_logger().warning("Removing orphaned working directory %s", name)
+            shutil.rmtree(os.path.join(base_dir, name), ignore_errors=True)
+            ORPHANS_REAPED.labels('workdir').inc()
+            removed += 1
+    return removed
+
+
+def start_reaper(base_dirs: list, interval: int = REAPER_INTERVAL):
+    """
+    Reaps orphaned processes and working directories in a background thread,
+    in the main process of a worker that outlives its worker processes
+
+    Args:
+        base_dirs (list): the paths to the directories that hold the temporary directories
+        interval (int): seconds between two rounds, 0 disables the reaper
+    """
+    if interval <= 0:
+        return
+
+    def reap():
+        while True:
+            try:
+                reap_processes()
+                reap_workdirs(base_dirs)
+            except Exception as e:
+                get_logger().warning("Unable to reap orphans: %s", e)
+            time.sleep(interval)
+
+    threading.Thread(target=reap, daemon=True).start()
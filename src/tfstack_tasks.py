@@ -1,12 +1,42 @@
 import os
 import time
-import subprocess
-import traceback
-import re
-from celery import Celery, Task, states, current_task
-from celery.exceptions import Ignore
+import uuid
+import threading
+from contextlib import contextmanager
+from functools import partial
+from celery import Celery, Task, group, states
+from celery.signals import before_task_publish, task_revoked, worker_init, worker_process_init, \
+    worker_process_shutdown, worker_ready, worker_shutdown
+from celery.exceptions import Retry, SoftTimeLimitExceeded
+from redis.exceptions import LockError
 
-from tfstack_executors import create_tf_stack, delete_tf_stack, read_tf_stack
+from tfstack_batches import BATCH_MAX_PARALLEL, BATCH_REAP_INTERVAL, create_batch, claim_batch_item, \
+    record_batch_result, get_batch_status, get_batch_operation, expired_batch_requests
+from tfstack_cache import set_cached_read, invalidate_cached_read
+from tfstack_callbacks import CALLBACK_MAX_RETRIES, CallbackDeliveryError, callback_queue_full, completion_payload, \
+    deliver_callback, pop_callbacks, retry_countdown
+from tfstack_executors import create_tf_stack, delete_tf_stack, read_tf_stack, plan_tf_stack, update_tf_stack, \
+    drift_tf_stack, list_tf_stacks, match_resource_id
+from tfstack_drift import DRIFT_MAX_PARALLEL, DRIFT_SWEEP_INTERVAL, DRIFT_SWEEP_TICK, RUNNING, get_sweep, sweep_due, \
+    start_sweep, next_sweep_page, update_sweep, finish_sweep, record_drift, remove_drift
+from tfstack_inventory import record_stack, remove_stack, reconcile_inventory, get_stack_spec
+from tfstack_journal import FINISHED, JOURNAL_HEARTBEAT_TIMEOUT, ExecutionInProgress, TaskJournal
+from tfstack_locks import release_inflight_request, renewed_lock, stack_lock
+from tfstack_metrics import CALLBACKS, DRIFT_CHECKS, RESULT_SIZE, TASK_DURATION, TASK_QUEUE_WAIT, TASKS, WORKER_COLD_START, \
+    StageTimer, mark_process_dead, start_metrics_server
+from tfstack_plans import get_cached_plan, set_cached_plan, invalidate_cached_plan
+from tfstack_progress import publish_progress, publish_progress_end, register_request
+from tfstack_queues import CREATE_QUEUE, READ_QUEUE, DELETE_QUEUE, UPDATE_QUEUE, DRIFT_QUEUE, CALLBACK_QUEUE, \
+    PRIORITY_STEPS, record_task_duration
+from tfstack_ratelimit import RateLimited, take_tokens
+from tfstack_readiness import WORKER_WARM_TIMEOUT, clear_ready, mark_ready, process_start_time, wait_until
+from tfstack_results import RESULT_COMPACT_DELAY, RESULT_EXPIRES, RESULT_SERIALIZER, register_result_serializer, dumps, \
+    expire_result, claim_result_compaction, compact_result, replace_result
+from tfstack_state import TF_STATE_BUCKET
+from tfstack_supervision import TIME_LIMITS, cancel_requested, request_cancel, start_reaper, task_time_limits
+from tfstack_templates import TF_CONFIG_CACHE_DIR, stack_revision, template_dir, template_workdir
+from tfstack_workdirs import TF_WARM_POOL_DIR, start_workdir_pool, warm_workdir, temporary_workdir, warm_pool_ready, \
+    clear_warm_marker
 from utils import get_logger
 
 
@@ -18,54 +48,810 @@ celery.conf.broker_url = os.environ.get("CELERY_BROKER_URL",
                                         "redis://host.docker.internal:6379")
 celery.conf.result_backend = os.environ.get(
     "CELERY_RESULT_BACKEND", "redis://host.docker.internal:6379")
+# broker connections are pooled per process, shared by the threads of an API worker
+celery.conf.broker_pool_limit = int(
+    os.environ.get("CELERY_BROKER_POOL_LIMIT", "10"))
 
+# results are stored compactly (msgpack, compressed when large) and expire,
+# after a retention per operation for the tfstack operations, see TfStackTask.finish_request
+register_result_serializer()
+celery.conf.result_serializer = RESULT_SERIALIZER
+celery.conf.result_accept_content = ['json', 'tfstack-msgpack']
+celery.conf.result_expires = RESULT_EXPIRES
 
-@celery.task(name="create_tf_stack_task")
-def create_tf_stack_task(tf_dir):
+# every operation has its own queue, so workers can subscribe to different sets of queues
+celery.conf.task_routes = {
+    'create_tf_stack_task': {'queue': CREATE_QUEUE},
+    'read_tf_stack_task': {'queue': READ_QUEUE},
+    'delete_tf_stack_task': {'queue': DELETE_QUEUE},
+    'update_tf_stack_task': {'queue': UPDATE_QUEUE},
+    'reconcile_inventory_task': {'queue': READ_QUEUE},
+    'drift_tf_stack_task': {'queue': DRIFT_QUEUE},
+    'drift_sweep_task': {'queue': DRIFT_QUEUE},
+    'compact_result_task': {'queue': READ_QUEUE},
+    'deliver_callback_task': {'queue': CALLBACK_QUEUE},
+}
+# with redis, 0 is the highest priority and 9 the lowest
+PRIORITIES = {'high': 0, 'normal': 5, 'low': 9}
+celery.conf.task_default_priority = PRIORITIES['normal']
+celery.conf.broker_transport_options = {
+    'priority_steps': PRIORITY_STEPS,
+    'queue_order_strategy': 'priority',
+    # unacknowledged messages of a lost worker are redelivered after the visibility timeout, it should exceed
+    # the longest wait and execution: a message of a running execution that is redelivered waits on it, see tfstack_journal
+    'visibility_timeout': int(os.environ.get("BROKER_VISIBILITY_TIMEOUT", "7200")),
+}
+# tasks are acknowledged after the execution, so the tasks of a lost worker are redelivered
+# and resumed from their journal
+celery.conf.task_acks_late = True
+celery.conf.task_reject_on_worker_lost = True
+celery.conf.worker_prefetch_multiplier = 1
+
+# soft and hard time limits of the tasks (prefork pool), on top of the time limit of every script execution.
+# At the soft time limit a running script is terminated, SIGINT first, see tfstack_supervision.
+TASK_OPERATIONS = {
+    'create_tf_stack_task': ['create'],
+    'read_tf_stack_task': ['read'],
+    'delete_tf_stack_task': ['delete'],
+    'update_tf_stack_task': ['plan', 'update'],
+    'drift_tf_stack_task': ['drift'],
+    'reconcile_inventory_task': ['list'],
+}
+celery.conf.task_annotations = {
+    name: dict(zip(('soft_time_limit', 'time_limit'), task_time_limits(operations)))
+    for name, operations in TASK_OPERATIONS.items()
+}
+
+INVENTORY_RECONCILE_INTERVAL = int(
+    os.environ.get("INVENTORY_RECONCILE_INTERVAL", "0"))
+# the schedules require celery beat
+celery.conf.beat_schedule = dict()
+if INVENTORY_RECONCILE_INTERVAL > 0 and "TF_DIR" in os.environ:
+    celery.conf.beat_schedule['reconcile-inventory'] = {
+        'task': 'reconcile_inventory_task',
+        'schedule': INVENTORY_RECONCILE_INTERVAL,
+        'kwargs': {'tf_dir': os.environ["TF_DIR"]},
+    }
+if DRIFT_SWEEP_INTERVAL > 0 and "TF_DIR" in os.environ:
+    # every tick continues the current sweep or starts a new one when it is due
+    celery.conf.beat_schedule['drift-sweep'] = {
+        'task': 'drift_sweep_task',
+        'schedule': DRIFT_SWEEP_TICK,
+        'kwargs': {'tf_dir': os.environ["TF_DIR"]},
+    }
+if BATCH_REAP_INTERVAL > 0:
+    celery.conf.beat_schedule['reap-batches'] = {
+        'task': 'reap_batches_task',
+        'schedule': BATCH_REAP_INTERVAL,
+    }
+
+STACK_LOCK_RETRY_DELAY = int(os.environ.get("STACK_LOCK_RETRY_DELAY", "10"))
+STACK_LOCK_MAX_RETRIES = int(os.environ.get("STACK_LOCK_MAX_RETRIES", "360"))
+
+# 'sync' runs a blocking executor per task, 'async' runs the executors of all tasks
+# of a worker process in a single event loop (use with --pool threads)
+EXECUTOR_MODE = os.environ.get("EXECUTOR_MODE", "sync")
+
+WORKER_METRICS_PORT = int(os.environ.get("WORKER_METRICS_PORT", "0"))
+
+
+@before_task_publish.connect
+def add_published_at_header(sender=None, headers=None, **kwargs):
     """
-    Celery task that executes a specific Terraform shell script.
+    Adds the publish time to every task message, to measure the time spent in the queue,
+    and registers the requests of the tfstack operations, for the progress stream
+    """
+    headers['tfstack_published_at'] = time.time()
+    if isinstance(celery.tasks.get(sender), TfStackTask):
+        register_request(headers['id'])
+
+
+@worker_init.connect
+def init_worker(**kwargs):
+    """
+    Exposes the metrics of the worker processes, resets the readiness of a previous run
+    and reaps the processes and working directories of lost worker processes
+    """
+    clear_ready()
+    clear_warm_marker()
+    if WORKER_METRICS_PORT > 0:
+        start_metrics_server(WORKER_METRICS_PORT)
+    start_reaper([TF_WARM_POOL_DIR, TF_CONFIG_CACHE_DIR])
+
+
+@worker_ready.connect
+def report_worker_ready(**kwargs):
+    """
+    The worker is connected to the broker, it is ready as soon as a warm working directory
+    is prepared. Waits in the background, see tfstack_readiness.
+    """
+    def wait_until_warm():
+        warm = "TF_DIR" not in os.environ or wait_until(warm_pool_ready, WORKER_WARM_TIMEOUT)
+        if not warm:
+            get_logger().warning("No warm working directory after %s seconds", WORKER_WARM_TIMEOUT)
+        cold_start = mark_ready(process_start_time(), warm)
+        WORKER_COLD_START.set(cold_start)
+        get_logger().info("Worker ready after a cold start of %.1f seconds", cold_start)
+
+    threading.Thread(target=wait_until_warm, daemon=True).start()
+
+
+@worker_shutdown.connect
+def shutdown_worker(**kwargs):
+    clear_ready()
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(pid=None, **kwargs):
+    mark_process_dead(pid or os.getpid())
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    """
+    Starts the warm working directory pool in every worker process
+    """
+    if "TF_DIR" in os.environ:
+        start_workdir_pool(os.environ["TF_DIR"])
+
+
+class TfStackTask(Task):
+    """
+    Celery task base class for the tfstack operations.
+    - publishes the output and the end of the task to the progress stream
+    - releases the in-flight claim of the request on a resource_id
+    - notifies the callbacks of the request when it finishes
+    - serializes the operations on a resource_id
+    - enqueues the next pending item of a batch
+    - records the metrics of the task
+    - journals the execution, returns the result of a finished execution when a task is redelivered
+      and retries a redelivered task later while its execution still runs
+    - fails a cancelled request, or a request that exceeds its soft time limit
+    """
+
+    @property
+    def operation(self):
+        """
+        Returns:
+            str: name of the operation for the metrics, e.g. 'create' for create_tf_stack_task
+        """
+        return self.name.split('_')[0]
+
+    def __call__(self, *args, **kwargs):
+        # per execution state lives on the request, tasks are shared by the threads of a worker
+        self.request.stage_timer = StageTimer(self.operation)
+        published_at = getattr(self.request, 'tfstack_published_at', None)
+        if published_at is not None:
+            TASK_QUEUE_WAIT.labels(self.operation).observe(
+                time.time() - published_at)
+
+        started = time.time()
+        outcome = 'failure'
+        script_error = 'none'
+        self.request.journal = TaskJournal(
+            self.request.id, self.operation, kwargs.get('resource_id'))
+        try:
+            if cancel_requested(self.request.id):
+                error_message = 'error:Cancelled'
+                raise Exception(error_message)
+            previous = self.request.journal.start()
+            if previous is not None and previous['status'] == FINISHED:
+                get_logger().info("Task %s already finished, returning its journaled result", self.request.id)
+                result = previous['result']
+            else:
+                if self.request.journal.interrupted:
+                    get_logger().warning("Resuming task %s, interrupted at stage %s after %s output lines",
+                                         self.request.id, previous['stage'], previous['output_offset'])
+                with self.request.journal.heartbeat():
+                    result = super().__call__(*args, **kwargs)
+                self.request.journal.finish(result)
+            outcome = 'success'
+            RESULT_SIZE.labels(self.operation).observe(len(dumps(result)))
+            return result
+        except Retry:
+            outcome = 'retry'
+            self.request.journal.retrying()
+            raise
+        except ExecutionInProgress as e:
+            # a duplicate delivery, it returns the journaled result once the running execution finished,
+            # or resumes it when it was interrupted
+            outcome = 'retry'
+            get_logger().warning("%s, retrying task %s later", e, self.request.id)
+            raise self.retry(countdown=JOURNAL_HEARTBEAT_TIMEOUT, max_retries=None)
+        except SoftTimeLimitExceeded:
+            # also raised by a cancellation of a running task, see cancel_request
+            script_error = 'error:Cancelled' if cancel_requested(self.request.id) else 'error:TimeLimitExceeded'
+            self.request.journal.discard()
+            raise Exception(script_error)
+        except Exception as e:
+            script_error = str(e) if str(e).startswith('error:') else 'unknown'
+            self.request.journal.discard()
+            raise
+        finally:
+            self.request.stage_timer.finish()
+            duration = time.time() - started
+            TASK_DURATION.labels(self.operation, outcome).observe(duration)
+            TASKS.labels(self.operation, outcome, script_error).inc()
+            if outcome != 'retry':
+                record_task_duration(self.operation, duration)
+
+    @property
+    def cancelled(self):
+        """
+        Returns:
+            callable: for the executors, returns True when the request is cancelled, from any thread
+        """
+        return partial(cancel_requested, self.request.id)
+
+    @property
+    def on_line(self):
+        """
+        Returns:
+            callable: for the executors, the output line callback of the current execution, from any thread.
+                The async executors call it from a thread of the event loop, where self.request is empty,
+                so the request id, stage timer and journal are bound on the task thread.
+        """
+        return partial(handle_output_line, self.request.id, self.operation,
+                       getattr(self.request, 'stage_timer', None), getattr(self.request, 'journal', None))
+
+    @contextmanager
+    def serialized(self, resource_id):
+        """
+        Context manager that holds the stack lock of resource_id, renewed while the operation runs.
+        Retries the task later when another operation holds the lock.
+
+        Args:
+            resource_id (str): stack/resource id
+        """
+        lock = stack_lock(resource_id)
+        if not lock.acquire(blocking=False):
+            raise self.retry(countdown=STACK_LOCK_RETRY_DELAY,
+                             max_retries=STACK_LOCK_MAX_RETRIES)
+        try:
+            with renewed_lock(lock):
+                yield
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                get_logger().warning(
+                    "Stack lock of %s expired before it was released", resource_id)
+
+    def after_return(self, status, retval, task_id, args, kwargs, einfo):
+        self.finish_request(status, task_id, kwargs,
+                            priority=(self.request.delivery_info or {}).get('priority'), retval=retval)
+
+    def finish_request(self, status, task_id, kwargs, priority=None, retval=None):
+        """
+        Publishes the end of a request, applies the retention of its result, notifies its callbacks,
+        releases its in-flight claim and enqueues the next item of its batch
+
+        Args:
+            status (str): the final state of the task
+            task_id (str): request id
+            kwargs (dict): kwargs of the task
+            priority (int): message priority of the task
+            retval: the result of the task, or its exception
+        """
+        publish_progress_end(task_id, status)
+        expire_result(task_id, self.operation)
+        notify_callbacks(task_id, self.operation, status, retval, kwargs.get('resource_id'))
+        if 'resource_id' in kwargs:
+            release_inflight_request(self.name, kwargs['resource_id'], task_id)
+        if kwargs.get('batch_id') and record_batch_result(kwargs['batch_id'], task_id, status == states.SUCCESS):
+            enqueue_next_batch_item(self, kwargs['batch_id'], priority=priority)
+
+
+def handle_output_line(request_id, operation, stage_timer, journal, line):
+    """
+    Publishes an output line of an executor to the progress stream,
+    times the stages of the Terraform workflow and journals the progress
+
+    Args:
+        request_id (str): request id
+        operation (str): name of the operation
+        stage_timer (StageTimer): stage timer of the execution, if any
+        journal (TaskJournal): journal of the execution, if any
+        line (str): output line
+    """
+    publish_progress(request_id, line)
+    if stage_timer is not None:
+        stage_timer.on_line(line)
+    if journal is not None:
+        journal.on_line(line, stage_timer.stage if stage_timer is not None else None)
+        # the workspace of a new stack is allocated as soon as its resource_id shows up
+        if operation == 'create' and journal.resource_id is None:
+            resource_id = match_resource_id(line, 'resource_id')
+            if resource_id:
+                journal.record_resource_id(resource_id)
+
+
+@task_revoked.connect
+def finish_revoked_request(sender=None, request=None, terminated=False, **kwargs):
+    """
+    A task that is revoked before it runs doesn't return, finishes its request like after_return.
+    A terminated task returns itself.
+    """
+    if terminated or not isinstance(sender, TfStackTask):
+        return
+    sender.finish_request(states.REVOKED, request.id, request.kwargs or {},
+                          priority=(request.delivery_info or {}).get('priority'))
+
+
+def cancel_request(request_id):
+    """
+    Cancels a request: a queued task is revoked, a running task gets SIGUSR1 (prefork pool),
+    which raises SoftTimeLimitExceeded in the task. The executors terminate the script of a cancelled request
+    in any pool, SIGINT first, see tfstack_supervision.
+
+    Args:
+        request_id (str): request id of the Celery task
+    """
+    request_cancel(request_id)
+    celery.control.revoke(request_id, terminate=True, signal='SIGUSR1')
+
+
+def execute(executor, async_executor, *args, **kwargs):
+    """
+    Runs a Terraform executor according to EXECUTOR_MODE
+
+    Args:
+        executor (function): the blocking executor
+        async_executor (str): name of the asyncio variant of the executor in tfstack_async_executors,
+            which is only imported in async mode
+
+    Returns:
+        the result of the executor
+    """
+    if EXECUTOR_MODE == 'async':
+        import tfstack_async_executors
+        return tfstack_async_executors.get_async_runner().run(
+            getattr(tfstack_async_executors, async_executor), *args, **kwargs)
+    return executor(*args, **kwargs)
+
+
+def schedule_result_compaction(request_id, result):
+    """
+    Compacts a fetched result after RESULT_COMPACT_DELAY seconds, once per result with verbose content
+
+    Args:
+        request_id (str): request id
+        result: the fetched result
+    """
+    if claim_result_compaction(request_id, result):
+        compact_result_task.apply_async(args=[request_id], countdown=RESULT_COMPACT_DELAY,
+                                        priority=PRIORITIES['low'])
+
+
+def notify_callbacks(request_id, operation, status, result=None, resource_id=None):
+    """
+    Enqueues the delivery of the completion payload of a finished request to its callbacks, if any.
+    Deliveries are dropped while the callback queue is full.
+
+    Args:
+        request_id (str): request id
+        operation (str): name of the operation: create, read, delete, update
+        status (str): the final state of the task
+        result: the result of the task, or its exception
+        resource_id (str): stack/resource id
+    """
+    urls = pop_callbacks(request_id)
+    if not urls:
+        return
+    payload = completion_payload(request_id, operation, status, result, resource_id)
+    try:
+        if callback_queue_full():
+            get_logger().warning("Callback queue is full, dropping %s callbacks of %s", len(urls), request_id)
+            CALLBACKS.labels('dropped').inc(len(urls))
+            return
+        for url in urls:
+            deliver_callback_task.apply_async(args=[url, payload])
+    except Exception as e:
+        get_logger().warning("Unable to enqueue the callbacks of %s: %s", request_id, e)
+
+
+def start_batch(celery_task, items, priority=None, max_parallel=BATCH_MAX_PARALLEL):
+    """
+    Creates a batch of async Celery tasks, of which at most max_parallel are enqueued at a time.
+    The following items of the batch are enqueued with the same priority.
+
+    Args:
+        celery_task (celery.Task): the Celery task of the operation
+        items (list): kwargs (dict) of the Celery task per item
+        priority (int): message priority, one of PRIORITIES
+        max_parallel (int): amount of items that are enqueued at a time
+
+    Returns:
+        str: batch id
+    """
+    batch_id = create_batch(celery_task.name, items, priority=priority)
+
+    # the items are registered with their request ids before they are enqueued, see claim_batch_item
+    signatures = list()
+    for _ in range(max_parallel):
+        request_id = str(uuid.uuid4())
+        item = claim_batch_item(batch_id, request_id)
+        if item is None:
+            break
+        signatures.append(celery_task.signature(kwargs=dict(item, batch_id=batch_id), task_id=request_id,
+                                                priority=priority))
+
+    group(signatures).apply_async()
+    return batch_id
+
+
+def enqueue_next_batch_item(celery_task, batch_id, priority=None):
+    """
+    Enqueues the next pending item of a batch, if any.
+
+    Args:
+        celery_task (celery.Task): the Celery task of the operation
+        batch_id (str): batch id
+        priority (int): message priority, one of PRIORITIES
+    """
+    request_id = str(uuid.uuid4())
+    item = claim_batch_item(batch_id, request_id)
+    if item is not None:
+        celery_task.apply_async(
+            kwargs=dict(item, batch_id=batch_id), task_id=request_id, priority=priority)
+
+
+@celery.task(name="create_tf_stack_task", bind=True, base=TfStackTask)
+def create_tf_stack_task(self, tf_dir, template=None, variables=None, batch_id=None):
+    """
+    Celery task that executes a specific Terraform shell script,
+    in a warm (pre-initialized) working directory when available,
+    or in a copy of the compiled config of a template.
+    When an interrupted execution already allocated the workspace of the new stack,
+    the apply is finished in that workspace by the update_tfstack script.
 
     Args:
         tf_dir (str): the path to the directory containing terraform execution shell scripts
+        template (str): template the stack is created from, None for the default template (tf_dir)
+        variables (dict): input variables of the stack
+        batch_id (str): batch id, when the task is part of a batch
 
     Returns:
         dict : containing message of status of succesful terraform apply, including the new stack/resource id.
     """
 
-    result_create_tf_stack = create_tf_stack(tf_dir)
+    journal = self.request.journal
+    if journal.interrupted and journal.resource_id:
+        # the interrupted execution already allocated the workspace, finish its apply
+        # instead of creating another stack
+        with template_workdir(template, tf_dir) as workdir:
+            execute(update_tf_stack, 'update_tf_stack_async',
+                    workdir, journal.resource_id, on_line=self.on_line, variables=variables,
+                    timeout=TIME_LIMITS['create'], cancelled=self.cancelled)
+        result_create_tf_stack = {
+            'message': "TFstack created succesfully",
+            'resource_id': journal.resource_id
+        }
+    else:
+        workdir_context = template_workdir(template, tf_dir) if template else warm_workdir(tf_dir)
+        with workdir_context as workdir:
+            result_create_tf_stack = execute(
+                create_tf_stack, 'create_tf_stack_async', workdir, on_line=self.on_line, variables=variables,
+                timeout=TIME_LIMITS['create'], cancelled=self.cancelled)
+    # a new stack must never be answered from a stale cache entry
+    invalidate_cached_read(result_create_tf_stack['resource_id'])
+    record_stack(result_create_tf_stack['resource_id'], 'created', template, variables)
+    if template:
+        result_create_tf_stack['template'] = template
     return result_create_tf_stack
 
 
-@celery.task(name="delete_tf_stack_task")
-def delete_tf_stack_task(tf_dir, resource_id):
+@celery.task(name="delete_tf_stack_task", bind=True, base=TfStackTask)
+def delete_tf_stack_task(self, tf_dir, resource_id, batch_id=None):
     """
     Celery task that executes a specific Terraform shell script.
 
     Args:
         tf_dir (str): the path to the directory containing terraform execution shell scripts
         resource_id (str): stack/resource id
+        batch_id (str): batch id, when the task is part of a batch
 
     Returns:
         dict  : containing message of status of succesful terraform operation
     """
 
-    result_delete_tf_stack = delete_tf_stack(tf_dir, resource_id)
+    template, variables = get_stack_spec(resource_id)
+    try:
+        with self.serialized(resource_id), template_workdir(template, tf_dir) as workdir:
+            result_delete_tf_stack = execute(
+                delete_tf_stack, 'delete_tf_stack_async', workdir, resource_id, on_line=self.on_line,
+                variables=variables, timeout=TIME_LIMITS['delete'], cancelled=self.cancelled)
+    except Exception as e:
+        if str(e) != 'error:WorkspaceNotExist':
+            raise
+        remove_stack(resource_id)
+        # the interrupted execution already deleted the workspace
+        if not self.request.journal.interrupted:
+            raise
+        result_delete_tf_stack = {'message': "TFstack deleted succesfully"}
+    invalidate_cached_read(resource_id)
+    invalidate_cached_plan(resource_id)
+    remove_stack(resource_id)
+    remove_drift(resource_id)
     return result_delete_tf_stack
 
 
-@celery.task(name="read_tf_stack_task")
-def read_tf_stack_task(tf_dir, resource_id):
+@celery.task(name="read_tf_stack_task", bind=True, base=TfStackTask)
+def read_tf_stack_task(self, tf_dir, resource_id):
     """
     Celery task that executes a specific Terraform shell script.
-    This is the Read operation, which results in a terraform state list
+    This is the Read operation, which results in a terraform state list.
+    The result is stored in the read cache, so subsequent reads can be answered by the API.
 
     Args:
         tf_dir (str): the path to the directory containing terraform execution shell scripts
-        id (str): stack/resource id    
+        resource_id (str): stack/resource id
 
 
     Returns:
         dict : containing message of status of succesful terraform operation, including result
     """
-    result_read_tf_stack = read_tf_stack(tf_dir, resource_id)
+    template, variables = get_stack_spec(resource_id)
+    try:
+        with self.serialized(resource_id), template_workdir(template, tf_dir) as workdir:
+            result_read_tf_stack = execute(
+                read_tf_stack, 'read_tf_stack_async', workdir, resource_id, on_line=self.on_line,
+                variables=variables, timeout=TIME_LIMITS['read'], cancelled=self.cancelled)
+    except Retry:
+        raise
+    except Exception as e:
+        invalidate_cached_read(resource_id)
+        if str(e) == 'error:WorkspaceNotExist':
+            remove_stack(resource_id)
+        raise
+    set_cached_read(resource_id, result_read_tf_stack)
+    record_stack(resource_id, 'present')
     return result_read_tf_stack
+
+
+@celery.task(name="update_tf_stack_task", bind=True, base=TfStackTask)
+def update_tf_stack_task(self, tf_dir, resource_id):
+    """
+    Celery task that reconciles an existing stack with the Terraform config, plan first:
+    the apply is skipped when the plan has no changes. An empty plan is cached per config revision
+    and input variables, so a following update of the same revision doesn't even plan.
+
+    Args:
+        tf_dir (str): the path to the directory containing terraform execution shell scripts
+        resource_id (str): stack/resource id
+
+    Returns:
+        dict : containing message of status of succesful terraform operation, including whether it had changes
+    """
+    template, variables = get_stack_spec(resource_id)
+    try:
+        revision = stack_revision(template_dir(template, tf_dir), variables)
+        with self.serialized(resource_id):
+            result_plan_tf_stack = get_cached_plan(resource_id, revision)
+            plan_cached = result_plan_tf_stack is not None
+            if not plan_cached:
+                with template_workdir(template, tf_dir) as workdir:
+                    result_plan_tf_stack = execute(
+                        plan_tf_stack, 'plan_tf_stack_async', workdir, resource_id, on_line=self.on_line,
+                        variables=variables, timeout=TIME_LIMITS['plan'], cancelled=self.cancelled)
+
+            if not result_plan_tf_stack['changes']:
+                set_cached_plan(resource_id, revision, result_plan_tf_stack)
+                if not plan_cached:
+                    # the plan refreshed the stack, it didn't drift
+                    record_drift(resource_id, {'drifted': False, 'resources': []})
+                return {
+                    'message': "TFstack is up to date",
+                    'changes': False,
+                    'plan_cached': plan_cached
+                }
+
+            with template_workdir(template, tf_dir) as workdir:
+                result_update_tf_stack = execute(
+                    update_tf_stack, 'update_tf_stack_async', workdir, resource_id, on_line=self.on_line,
+                    variables=variables, timeout=TIME_LIMITS['update'], cancelled=self.cancelled)
+    except Retry:
+        raise
+    except Exception as e:
+        if str(e) == 'error:WorkspaceNotExist':
+            invalidate_cached_plan(resource_id)
+            remove_stack(resource_id)
+        raise
+
+    # after the apply the stack matches this config revision
+    set_cached_plan(resource_id, revision, {
+        'message': "TFstack planned succesfully",
+        'changes': False,
+        'summary': {'add': 0, 'change': 0, 'destroy': 0}
+    })
+    invalidate_cached_read(resource_id)
+    record_stack(resource_id, 'present')
+    record_drift(resource_id, {'drifted': False, 'resources': []})
+    result_update_tf_stack.update(
+        {'changes': True, 'summary': result_plan_tf_stack['summary']})
+    return result_update_tf_stack
+
+
+@celery.task(name="drift_tf_stack_task", bind=True, base=TfStackTask)
+def drift_tf_stack_task(self, tf_dir, resource_id, sweep_id=None, batch_id=None):
+    """
+    Celery task that checks a stack for drift with a refresh-only plan, that doesn't change the stack.
+    The drift checks are rate limited per state backend (RATE_LIMIT_DRIFT) over all workers,
+    a check that exceeds the rate limit is retried later.
+
+    Args:
+        tf_dir (str): the path to the directory containing terraform execution shell scripts
+        resource_id (str): stack/resource id
+        sweep_id (str): the sweep the drift check is part of
+        batch_id (str): batch id, the page of the sweep
+
+    Returns:
+        dict : containing message of status of succesful drift check, whether the stack drifted and the drifted resources
+    """
+    try:
+        take_tokens('backend:' + (TF_STATE_BUCKET or 'default'), 'drift')
+    except RateLimited as e:
+        raise self.retry(countdown=e.retry_after, max_retries=None)
+
+    template, variables = get_stack_spec(resource_id)
+    try:
+        with self.serialized(resource_id), template_workdir(template, tf_dir) as workdir:
+            result_drift_tf_stack = execute(
+                drift_tf_stack, 'drift_tf_stack_async', workdir, resource_id, on_line=self.on_line,
+                variables=variables, timeout=TIME_LIMITS['drift'], cancelled=self.cancelled)
+    except Retry:
+        raise
+    except Exception as e:
+        DRIFT_CHECKS.labels('error').inc()
+        if str(e) == 'error:WorkspaceNotExist':
+            remove_stack(resource_id)
+            remove_drift(resource_id)
+        else:
+            record_drift(resource_id, error=str(e), sweep_id=sweep_id)
+        raise
+
+    DRIFT_CHECKS.labels('drifted' if result_drift_tf_stack['drifted'] else 'in_sync').inc()
+    if result_drift_tf_stack['drifted']:
+        # a cached plan without changes doesn't hold anymore, the next update plans again
+        invalidate_cached_plan(resource_id)
+    record_drift(resource_id, result_drift_tf_stack, sweep_id=sweep_id)
+    return result_drift_tf_stack
+
+
+@celery.task(name="drift_sweep_task")
+def drift_sweep_task(tf_dir):
+    """
+    Celery task that takes a step of the drift sweep, scheduled by celery beat every DRIFT_SWEEP_TICK seconds.
+    A step enqueues the drift checks of the next page of the inventory as a low priority batch,
+    with at most DRIFT_MAX_PARALLEL checks running at a time, once the previous page is done.
+    A new sweep starts DRIFT_SWEEP_INTERVAL seconds after the start of the previous one.
+
+    Args:
+        tf_dir (str): the path to the directory containing terraform execution shell scripts
+
+    Returns:
+        dict : the sweep
+    """
+    now = time.time()
+    sweep = get_sweep()
+    if sweep is not None and sweep['batch_id']:
+        batch = get_batch_status(sweep['batch_id'])
+        if batch is not None and batch['done'] < batch['total']:
+            return sweep
+
+    if sweep_due(sweep, now):
+        sweep = start_sweep(now)
+    elif sweep['status'] != RUNNING:
+        return sweep
+
+    resource_ids, skipped, cursor = next_sweep_page(sweep['cursor'], now)
+    if cursor is None:
+        update_sweep({}, {'skipped': skipped})
+        finish_sweep(now)
+        get_logger().info("Drift sweep %s finished", sweep['sweep_id'])
+        return get_sweep()
+
+    batch_id = start_batch(drift_tf_stack_task, [
+        {'tf_dir': tf_dir, 'resource_id': resource_id, 'sweep_id': sweep['sweep_id']}
+        for resource_id in resource_ids], priority=PRIORITIES['low'], max_parallel=DRIFT_MAX_PARALLEL)
+    update_sweep({'cursor': cursor, 'batch_id': batch_id},
+                 {'enqueued': len(resource_ids), 'skipped': skipped})
+    return get_sweep()
+
+
+@celery.task(name="reap_batches_task")
+def reap_batches_task():
+    """
+    Celery task that counts the items of batches that didn't finish within BATCH_ITEM_TIMEOUT seconds,
+    scheduled by celery beat every BATCH_REAP_INTERVAL seconds. An item of which the task finished is counted
+    with its result, a lost or stuck item is cancelled and counted as failed, and the next pending item of its batch
+    is enqueued, so a lost task doesn't stall its batch (and a drift sweep that waits on the batch).
+
+    Returns:
+        int : amount of reaped items
+    """
+    reaped = 0
+    for batch_id, request_id in expired_batch_requests():
+        operation, priority = get_batch_operation(batch_id)
+        celery_task = celery.tasks.get(operation)
+        if not isinstance(celery_task, TfStackTask):
+            continue
+
+        result = celery_task.AsyncResult(request_id)
+        if result.ready():
+            status = result.status
+        else:
+            cancel_request(request_id)
+            status = states.FAILURE
+        if record_batch_result(batch_id, request_id, status == states.SUCCESS):
+            get_logger().warning("Item %s of batch %s didn't finish in time, counted as %s", request_id, batch_id, status)
+            enqueue_next_batch_item(celery_task, batch_id, priority=priority)
+            reaped += 1
+    return reaped
+
+
+@celery.task(name="reconcile_inventory_task")
+def reconcile_inventory_task(tf_dir):
+    """
+    Celery task that rebuilds the stack inventory from the Terraform workspaces.
+
+    Args:
+        tf_dir (str): the path to the directory containing the terraform config
+
+    Returns:
+        dict : the 'added' and 'removed' stack/resource ids
+    """
+    started_at = time.time()
+    with temporary_workdir(tf_dir) as workdir:
+        result_list_tf_stacks = list_tf_stacks(workdir, timeout=TIME_LIMITS['list'])
+    return reconcile_inventory(result_list_tf_stacks['resource_ids'], started_at)
+
+
+@celery.task(name="compact_result_task", ignore_result=True)
+def compact_result_task(request_id):
+    """
+    Celery task that replaces the verbose content of a stored result by its size, see tfstack_results.
+
+    Args:
+        request_id (str): request id of the fetched result
+
+    Returns:
+        bool : whether the result was compacted
+    """
+    meta = celery.backend.get_task_meta(request_id)
+    if meta['status'] != states.SUCCESS:
+        return False
+    compacted = compact_result(meta['result'])
+    if compacted is None:
+        return False
+    meta['result'] = compacted
+    return replace_result(request_id, celery.backend.encode(meta))
+
+
+@celery.task(name="deliver_callback_task", bind=True, ignore_result=True, max_retries=CALLBACK_MAX_RETRIES)
+def deliver_callback_task(self, url, payload):
+    """
+    Celery task that delivers the completion payload of a request to a callback URL,
+    retried with an exponential backoff while the receiver is unavailable, see tfstack_callbacks.
+
+    Args:
+        url (str): the callback URL
+        payload (dict): the completion payload
+
+    Returns:
+        bool : whether the callback was delivered
+    """
+    started = time.time()
+    try:
+        deliver_callback(url, payload)
+    except CallbackDeliveryError as e:
+        if e.retryable and self.request.retries < self.max_retries:
+            CALLBACKS.labels('retried').inc()
+            raise self.retry(countdown=retry_countdown(self.request.retries))
+        get_logger().warning("Unable to deliver the callback of %s: %s", payload['request_id'], e)
+        CALLBACKS.labels('failed').inc()
+        return False
+    finally:
+        record_task_duration('callback', time.time() - started)
+    CALLBACKS.labels('delivered').inc()
+    return True
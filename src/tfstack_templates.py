@@ -0,0 +1,252 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import tempfile
+import subprocess
+from contextlib import contextmanager
+
+from tfstack_plans import config_revision
+from tfstack_supervision import owned_prefix
+from tfstack_workdirs import INITIALIZED_MARKER, TF_INIT_CMD, mark_initialized, temporary_workdir
+from utils import get_logger
+
+
+"""Registry of the Terraform configs (templates) that stacks are created from.
+
+The 'default' template is the config in TF_DIR, every subdirectory of TF_TEMPLATES_DIR is another template,
+with the same shell scripts. A stack is created from a template with input variables, which are passed
+to the shell scripts as TF_VAR_<name> environment variables.
+
+Every worker compiles a template once per content hash (config revision): a copy of the config on which
+'terraform init' and 'terraform validate' ran, kept in TF_CONFIG_CACHE_DIR with its provider set.
+An operation on a stack of a template runs in a copy of its compiled config, so it is not validated
+or initialized from scratch per request.
+"""
+
+TF_TEMPLATES_DIR = os.environ.get("TF_TEMPLATES_DIR")
+TF_CONFIG_CACHE_DIR = os.environ.get(
+    "TF_CONFIG_CACHE_DIR", os.path.join(tempfile.gettempdir(), "tfstack-configs"))
+TF_VALIDATE_CMD = os.environ.get("TF_VALIDATE_CMD", "terraform validate -no-color")
+
+DEFAULT_TEMPLATE = 'default'
+
+TEMPLATE_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$')
+VARIABLE_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_-]{0,63}$')
+MAX_VARIABLES = int(os.environ.get("MAX_VARIABLES", "100"))
+MAX_VARIABLES_SIZE = int(os.environ.get("MAX_VARIABLES_SIZE", "65536"))
+
+COMPILED_CONFIG_FILE = 'config.json'
+LOCK_FILE_PROVIDER = re.compile(r'provider "([^"]+)" \{\s*version\s*=\s*"([^"]+)"')
+
+
+class InvalidTemplate(Exception):
+    """
+    Raised when a request has an unknown template or invalid variables
+    """
+
+
+def list_templates(tf_dir: str):
+    """
+    Args:
+        tf_dir (str): the path to the directory containing the default terraform config
+
+    Returns:
+        dict: the path to the config per template name
+    """
+    templates = {DEFAULT_TEMPLATE: tf_dir}
+    if TF_TEMPLATES_DIR and os.path.isdir(TF_TEMPLATES_DIR):
+        for name in sorted(os.listdir(TF_TEMPLATES_DIR)):
+            path = os.path.join(TF_TEMPLATES_DIR, name)
+            if TEMPLATE_NAME.match(name) and name != DEFAULT_TEMPLATE and os.path.isdir(path):
+                templates[name] = path
+    return templates
+
+
+def template_dir(template: str, tf_dir: str):
+    """
+    Args:
+        template (str): template name, None for the default template
+        tf_dir (str): the path to the directory containing the default terraform config
+
+    Raises:
+        Exception: "error:TemplateNotExist"
+
+    Returns:
+        str: the path to the config of the template
+    """
+    if not template or template == DEFAULT_TEMPLATE:
+        return tf_dir
+    path = os.path.join(TF_TEMPLATES_DIR or '', template)
+    if not TF_TEMPLATES_DIR or not TEMPLATE_NAME.match(template) or not os.path.isdir(path):
+        error_message = 'error:TemplateNotExist'
+        raise Exception(error_message)
+    return path
+
+
+def validate_template_request(body: dict, tf_dir: str):
+    """
+    Validates the optional 'template' and 'variables' of a request body
+
+    Args:
+        body (dict): the request body
+        tf_dir (str): the path to the directory containing the default terraform config
+
+    Raises:
+        InvalidTemplate: when the template doesn't exist or the variables are invalid
+
+    Returns:
+        tuple: (template, variables), None when not given
+    """
+    template = body.get('template')
+    variables = body.get('variables')
+
+    if template is not None:
+        if not isinstance(template, str) or template not in list_templates(tf_dir):
+            raise InvalidTemplate("template must be one of {}".format(", ".join(list_templates(tf_dir))))
+        if template == DEFAULT_TEMPLATE:
+            template = None
+
+    if variables is not None:
+        if not isinstance(variables, dict) or len(variables) > MAX_VARIABLES:
+            raise InvalidTemplate("variables must be an object of at most {} variables".format(MAX_VARIABLES))
+        for name in variables:
+            if not VARIABLE_NAME.match(name):
+                raise InvalidTemplate("invalid variable name: {}".format(name))
+        if len(json.dumps(variables)) > MAX_VARIABLES_SIZE:
+            raise InvalidTemplate("variables exceed {} bytes".format(MAX_VARIABLES_SIZE))
+        variables = variables or None
+
+    return template, variables
+
+
+def stack_revision(tf_dir: str, variables: dict = None):
+    """
+    Revision of a stack's desired state, for the plan cache
+
+    Args:
+        tf_dir (str): the path to the directory containing the terraform config
+        variables (dict): input variables of the stack
+
+    Returns:
+        str: the config revision, combined with the variables when given
+    """
+    revision = config_revision(tf_dir)
+    if not variables:
+        return revision
+    return hashlib.sha256('{}\0{}'.format(
+        revision, json.dumps(variables, sort_keys=True)).encode('utf8')).hexdigest()
+
+
+def parse_providers(lock_file: str):
+    """
+    Args:
+        lock_file (str): the path to a dependency lock file (.terraform.lock.hcl)
+
+    Returns:
+        dict: the version per provider
+    """
+    if not os.path.exists(lock_file):
+        return dict()
+    with open(lock_file) as f:
+        return dict(LOCK_FILE_PROVIDER.findall(f.read()))
+
+
+def compile_config(tf_dir: str, cache_dir: str = None):
+    """
+    Compiles a Terraform config once per config revision: init and validate a copy of it,
+    that is kept in the cache directory.
+
+    Args:
+        tf_dir (str): the path to the directory containing the terraform config
+        cache_dir (str): the path to the directory that holds the compiled configs, TF_CONFIG_CACHE_DIR by default
+
+    Raises:
+        Exception: "error:InvalidConfig"
+
+    Returns:
+        dict: 'revision', 'path' of the compiled config, 'providers' and whether it is 'valid'
+    """
+    cache_dir = cache_dir or TF_CONFIG_CACHE_DIR
+    revision = config_revision(tf_dir)
+    compiled_dir = os.path.join(cache_dir, revision)
+    compiled = _read_compiled_config(compiled_dir)
+
+    if compiled is None:
+        os.makedirs(cache_dir, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(prefix=owned_prefix('staging'), dir=cache_dir)
+        try:
+            compiled = _compile(tf_dir, staging_dir, revision)
+            # concurrent compilations of the same revision: the first one is kept
+            os.rename(staging_dir, compiled_dir)
+        except OSError:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            compiled = _read_compiled_config(compiled_dir)
+            if compiled is None:
+                raise
+        except Exception:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        get_logger().info("Compiled config %s revision %s", tf_dir, revision)
+
+    if not compiled['valid']:
+        error_message = 'error:InvalidConfig'
+        raise Exception(error_message)
+    compiled['path'] = os.path.join(compiled_dir, 'tf')
+    return compiled
+
+
+def _compile(tf_dir: str, staging_dir: str, revision: str):
+    workdir = os.path.join(staging_dir, 'tf')
+    shutil.copytree(tf_dir, workdir, ignore=shutil.ignore_patterns('.git', '.terraform', INITIALIZED_MARKER))
+
+    # an init failure (e.g. the provider registry is unreachable) is not cached
+    subprocess.run(TF_INIT_CMD, shell=True, executable='/bin/sh', cwd=workdir,
+                   stdout=subprocess.DEVNULL, check=True)
+    # the copies of the compiled config are initialized, the scripts skip their init
+    mark_initialized(workdir)
+    validation = subprocess.run(TF_VALIDATE_CMD, shell=True, executable='/bin/sh', cwd=workdir,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    compiled = {
+        'revision': revision,
+        'providers': parse_providers(os.path.join(workdir, '.terraform.lock.hcl')),
+        'valid': validation.returncode == 0,
+    }
+    if not compiled['valid']:
+        get_logger().warning("Config %s revision %s is invalid: %s", tf_dir, revision,
+                             validation.stdout.decode('utf8', errors='replace'))
+    with open(os.path.join(staging_dir, COMPILED_CONFIG_FILE), 'w') as f:
+        json.dump(compiled, f)
+    return compiled
+
+
+def _read_compiled_config(compiled_dir: str):
+    try:
+        with open(os.path.join(compiled_dir, COMPILED_CONFIG_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def template_workdir(template: str, tf_dir: str):
+    """
+    Context manager that provides the working directory for an operation on a stack of a template:
+    tf_dir itself for the default template, a temporary copy of the compiled config otherwise.
+
+    Args:
+        template (str): template name, None for the default template
+        tf_dir (str): the path to the directory containing the default terraform config
+
+    Yields:
+        str: the path to the working directory to execute the Terraform shell scripts in
+    """
+    if not template or template == DEFAULT_TEMPLATE:
+        yield tf_dir
+        return
+
+    compiled = compile_config(template_dir(template, tf_dir))
+    with temporary_workdir(compiled['path'], include_terraform_dir=True) as workdir:
+        yield workdir
@@ -0,0 +1,251 @@
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from tfstack_supervision import owned_prefix
+from utils import get_logger
+
+
+"""Pool of pre-initialized Terraform working directories.
+
+A warm working directory is a copy of TF_DIR on which 'terraform init' already ran, backend included,
+using the shared provider plugin cache (TF_PLUGIN_CACHE_DIR) and a shared dependency lock file.
+Every warm working directory is used by a single execution and removed afterwards,
+the pool refills itself in the background.
+
+An initialized working directory holds INITIALIZED_MARKER, the shell scripts that run in it
+get TF_WORKDIR_INITIALIZED=1 and skip their own 'terraform init'.
+"""
+
+TF_WARM_POOL_SIZE = int(os.environ.get("TF_WARM_POOL_SIZE", "0"))
+TF_WARM_POOL_DIR = os.environ.get(
+    "TF_WARM_POOL_DIR", os.path.join(tempfile.gettempdir(), "tfstack-warm"))
+# with the backend, so the scripts don't need to init an initialized working directory
+TF_INIT_CMD = os.environ.get(
+    "TF_INIT_CMD", "terraform init -input=false")
+
+TF_LOCK_FILE = ".terraform.lock.hcl"
+# created in TF_WARM_POOL_DIR when the first warm working directory of any process is ready
+WARM_MARKER = ".warm"
+# created in a working directory on which TF_INIT_CMD ran
+INITIALIZED_MARKER = ".tfstack-initialized"
+WORKDIR_INITIALIZED_ENV = "TF_WORKDIR_INITIALIZED"
+
+_workdir_pool = None
+
+
+class WorkdirPool:
+    """
+    Pool of warm working directories for a single Terraform config directory
+    """
+
+    def __init__(self, tf_dir: str, size: int, base_dir: str = TF_WARM_POOL_DIR):
+        """
+        Args:
+            tf_dir (str): the path to the directory containing terraform execution shell scripts
+            size (int): amount of warm working directories to keep ready
+            base_dir (str): the path to the directory that holds the warm working directories
+        """
+        self.tf_dir = tf_dir
+        self.size = size
+        self.base_dir = base_dir
+        self.shared_lock_file = os.path.join(base_dir, TF_LOCK_FILE)
+        self._warm_workdirs = queue.Queue()
+        self._refill = threading.Event()
+
+    def start(self):
+        """
+        Starts filling the pool in a background thread
+        """
+        os.makedirs(self.base_dir, exist_ok=True)
+        threading.Thread(target=self._fill, daemon=True).start()
+
+    def _fill(self):
+        logger = get_logger()
+
+        while True:
+            while self._warm_workdirs.qsize() < self.size:
+                try:
+                    self._warm_workdirs.put(self._prepare())
+                except Exception:
+                    logger.exception("Unable to prepare a warm working directory")
+                    time.sleep(30)
+            self._refill.wait()
+            self._refill.clear()
+
+    def _prepare(self):
+        """
+        Copies the Terraform config directory and initializes it
+
+        Returns:
+            str: the path to the warm working directory
+        """
+        workdir = os.path.join(tempfile.mkdtemp(
+            prefix=owned_prefix('warm'), dir=self.base_dir), 'tf')
+        shutil.copytree(self.tf_dir, workdir,
+                        ignore=shutil.ignore_patterns('.git', '.terraform', INITIALIZED_MARKER))
+
+        workdir_lock_file = os.path.join(workdir, TF_LOCK_FILE)
+        if not os.path.exists(workdir_lock_file) and os.path.exists(self.shared_lock_file):
+            shutil.copyfile(self.shared_lock_file, workdir_lock_file)
+
+        try:
+            subprocess.run(TF_INIT_CMD, shell=True, executable='/bin/sh', cwd=workdir,
+                           stdout=subprocess.DEVNULL, check=True)
+        except Exception:
+            remove_workdir(workdir)
+            raise
+        mark_initialized(workdir)
+
+        # the first init pins the provider versions for all following working directories
+        if not os.path.exists(self.shared_lock_file) and os.path.exists(workdir_lock_file):
+            shutil.copyfile(workdir_lock_file, self.shared_lock_file)
+
+        open(os.path.join(self.base_dir, WARM_MARKER), 'a').close()
+        return workdir
+
+    def take(self):
+        """
+        Takes a warm working directory from the pool and triggers a refill
+
+        Returns:
+            str: the path to the warm working directory or None when the pool is empty
+        """
+        try:
+            workdir = self._warm_workdirs.get_nowait()
+        except queue.Empty:
+            workdir = None
+        self._refill.set()
+        return workdir
+
+
+def mark_initialized(workdir: str):
+    """
+    Marks a working directory on which TF_INIT_CMD ran
+
+    Args:
+        workdir (str): the path to the working directory
+    """
+    open(os.path.join(workdir, INITIALIZED_MARKER), 'a').close()
+
+
+def workdir_initialized(workdir: str):
+    """
+    Args:
+        workdir (str): the path to the working directory
+
+    Returns:
+        bool: whether TF_INIT_CMD ran on the working directory, so the scripts can skip their init
+    """
+    return os.path.exists(os.path.join(workdir, INITIALIZED_MARKER))
+
+
+def remove_workdir(workdir: str):
+    """
+    Removes a warm working directory
+
+    Args:
+        workdir (str): the path to the warm working directory
+    """
+    shutil.rmtree(os.path.dirname(workdir), ignore_errors=True)
+
+
+def start_workdir_pool(tf_dir: str, size: int = TF_WARM_POOL_SIZE):
+    """
+    Starts the warm working directory pool of this process, if enabled
+
+    Args:
+        tf_dir (str): the path to the directory containing terraform execution shell scripts
+        size (int): amount of warm working directories to keep ready, 0 disables the pool
+    """
+    global _workdir_pool
+
+    if size > 0:
+        _workdir_pool = WorkdirPool(tf_dir, size)
+        _workdir_pool.start()
+
+
+def warm_pool_ready(size: int = TF_WARM_POOL_SIZE, base_dir: str = TF_WARM_POOL_DIR):
+    """
+    Args:
+        size (int): amount of warm working directories per process, 0 disables the pool
+        base_dir (str): the path to the directory that holds the warm working directories
+
+    Returns:
+        bool: whether a warm working directory was prepared, always True when the pool is disabled
+    """
+    return size <= 0 or os.path.exists(os.path.join(base_dir, WARM_MARKER))
+
+
+def clear_warm_marker(base_dir: str = TF_WARM_POOL_DIR):
+    """
+    Removes the marker of a previous run of the worker, before the pools start
+
+    Args:
+        base_dir (str): the path to the directory that holds the warm working directories
+    """
+    try:
+        os.remove(os.path.join(base_dir, WARM_MARKER))
+    except FileNotFoundError:
+        pass
+
+
+@contextmanager
+def warm_workdir(tf_dir: str):
+    """
+    Context manager that provides a warm working directory for tf_dir,
+    or tf_dir itself when there is no warm working directory available.
+
+    Args:
+        tf_dir (str): the path to the directory containing terraform execution shell scripts
+
+    Yields:
+        str: the path to the working directory to execute the Terraform shell scripts in
+    """
+    workdir = None
+    if _workdir_pool is not None and _workdir_pool.tf_dir == tf_dir:
+        workdir = _workdir_pool.take()
+        if workdir is None:
+            get_logger().warning("Warm working directory pool is empty, using %s", tf_dir)
+
+    if workdir is None:
+        yield tf_dir
+        return
+
+    try:
+        yield workdir
+    finally:
+        remove_workdir(workdir)
+
+
+@contextmanager
+def temporary_workdir(tf_dir: str, include_terraform_dir: bool = False):
+    """
+    Context manager that provides a temporary copy of tf_dir, that is removed afterwards
+
+    Args:
+        tf_dir (str): the path to the directory containing terraform execution shell scripts
+        include_terraform_dir (bool): also copy the initialized .terraform directory,
+            keeping its symlinks to the provider plugin cache, and the INITIALIZED_MARKER
+
+    Yields:
+        str: the path to the temporary working directory
+    """
+    os.makedirs(TF_WARM_POOL_DIR, exist_ok=True)
+    workdir = os.path.join(tempfile.mkdtemp(
+        prefix=owned_prefix('tmp'), dir=TF_WARM_POOL_DIR), 'tf')
+    if include_terraform_dir:
+        shutil.copytree(tf_dir, workdir, symlinks=True,
+                        ignore=shutil.ignore_patterns('.git'))
+    else:
+        shutil.copytree(tf_dir, workdir,
+                        ignore=shutil.ignore_patterns('.git', '.terraform', INITIALIZED_MARKER))
+    try:
+        yield workdir
+    finally:
+        remove_workdir(workdir)
@@ -1,4 +1,11 @@
 import logging
+import os
+
+import redis
+
+
+# redis clients by URL
+_clients = dict()
 
 
 def get_logger() -> logging.Logger:
@@ -12,3 +19,55 @@ def get_logger() -> logging.Logger:
     logger.setLevel(logging.INFO)
 
     return logger
+
+
+def _shared_client(url: str) -> redis.Redis:
+    """
+    Args:
+        url (str): redis URL
+
+    Returns:
+        redis.Redis - the client of this process for the URL, the redis instances that share a URL share a client
+    """
+    if url not in _clients:
+        _clients[url] = redis.Redis.from_url(url)
+    return _clients[url]
+
+
+def get_redis_client() -> redis.Redis:
+    """
+    Function that will return the redis client of this process for the state of the API
+    (locks, caches, inventory, batches etc.). The client is created once and shares its connection pool.
+    It points to STATE_REDIS_URL, the Celery result backend by default. The state must not be evicted,
+    its redis runs with the noeviction policy, see get_results_client.
+
+    Returns:
+        redis.Redis - instance
+    """
+    return _shared_client(os.environ.get("STATE_REDIS_URL", _result_backend_url()))
+
+
+def get_results_client() -> redis.Redis:
+    """
+    Function that will return the redis client of the Celery result backend, for the results.
+    A separate result backend only holds the results, that can be evicted under memory pressure.
+
+    Returns:
+        redis.Redis - instance
+    """
+    return _shared_client(_result_backend_url())
+
+
+def get_broker_client() -> redis.Redis:
+    """
+    Function that will return the redis client of the Celery broker, for the queues.
+    It is the client of get_redis_client when the broker and the state are the same redis.
+
+    Returns:
+        redis.Redis - instance
+    """
+    return _shared_client(os.environ.get("CELERY_BROKER_URL", "redis://host.docker.internal:6379"))
+
+
+def _result_backend_url() -> str:
+    return os.environ.get("CELERY_RESULT_BACKEND", "redis://host.docker.internal:6379")
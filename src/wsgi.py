@@ -0,0 +1,14 @@
+from os import environ
+
+from app import create_app
+
+
+"""WSGI entry point of the tfstack-api API component, for production grade serving.
+
+    gunicorn --config gunicorn.conf.py wsgi:app
+
+  Expected environment variables:
+    TF_DIR: the path to the directory containing terraform execution shell scripts
+"""
+
+app = create_app(environ['TF_DIR'])